@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from scripts.database import AsyncDatabase, Database
+
+# A burst of bot updates: every handler reads its user, every other one also writes.
+USERS_COUNT = 20000
+HANDLERS_COUNT = 2000
+IDLE_CALLS = 2000
+
+
+def _create_database(directory: str, name: str) -> str:
+    path = os.path.join(directory, name)
+    database = Database(path)
+    with database.transaction():
+        database.connection.executemany(
+            "INSERT INTO users (user_id, group_id, sub_group, mailing) VALUES (?, ?, 0, ?)",
+            [(user_id, 100 + user_id % 500, '07:00' if user_id % 3 == 0 else None) for user_id in range(USERS_COUNT)]
+        )
+    database.connection.close()
+    return path
+
+
+def _percentile(values, share: float) -> float:
+    return sorted(values)[int(len(values) * share) - 1] * 1000
+
+
+async def _watch_event_loop(stop: asyncio.Event, stalls: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        stalls.append(time.perf_counter() - started - 0.001)
+
+
+async def _run(kind: str, directory: str):
+    path = _create_database(directory, f"bench_{kind}.db")
+    if kind == "sync":
+        database = Database(path)
+
+        async def call(method, *args):
+            return getattr(database, method)(*args)
+    else:
+        database = AsyncDatabase(path)
+
+        async def call(method, *args):
+            return await getattr(database, method)(*args)
+
+    latencies, stalls, stop = [], [], asyncio.Event()
+    watcher = asyncio.create_task(_watch_event_loop(stop, stalls))
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+
+    async def handler(index: int):
+        user_id = random.randrange(USERS_COUNT)
+        await call("get_user", user_id)
+        if index % 4 == 0:
+            await call("set_mailing_time", user_id, '08:00')
+        elif index % 4 == 1:
+            await call("add_user", user_id, 123, 1)
+        latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(handler(index) for index in range(HANDLERS_COUNT)))
+    total = time.perf_counter() - started
+    stop.set()
+    await watcher
+
+    idle = []
+    for user_id in range(IDLE_CALLS):
+        call_started = time.perf_counter()
+        await call("get_user", user_id)
+        idle.append(time.perf_counter() - call_started)
+    if kind == "async":
+        await database.close()
+    else:
+        database.connection.close()
+
+    print(f"{kind:5}: {HANDLERS_COUNT} handlers in {total * 1000:.0f} ms, "
+          f"completion p50 {_percentile(latencies, 0.5):.1f} ms p99 {_percentile(latencies, 0.99):.1f} ms, "
+          f"max event loop stall {max(stalls) * 1000:.1f} ms, idle get_user p50 {_percentile(idle, 0.5) * 1000:.0f} us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the users database called on the event loop and through "
+                                                 "the database thread")
+    parser.add_argument('--dir', help='where to create the databases, a temporary directory by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        for kind in ("sync", "async"):
+            asyncio.run(_run(kind, args.dir or temporary_directory))
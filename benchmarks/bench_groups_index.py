@@ -0,0 +1,99 @@
+import argparse
+import json
+import random
+import time
+from collections.abc import Mapping
+from typing import Any
+
+from scripts import schedule_api
+
+FACULTIES_COUNT = 20
+FORMS = ("очная", "заочная", "очно-заочная")
+LEVELS = ("бакалавриат", "магистратура")
+COURSES_COUNT = 4
+GROUPS_PER_COURSE = 6
+LOOKUPS_COUNT = 1000
+
+
+def _synthetic_tree() -> dict[str, Any]:
+    # The shape of the production tree: faculty, form, level, course, group.
+    groups = []
+    for faculty_id in range(FACULTIES_COUNT):
+        for form in FORMS:
+            for level in LEVELS:
+                for course in range(1, COURSES_COUNT + 1):
+                    for _ in range(GROUPS_PER_COURSE):
+                        group_id = len(groups) + 1
+                        groups.append({"id": group_id, "name": f"Группа {group_id}", "faculty_id": faculty_id,
+                                       "education_form": form, "education_level": level, "course": course,
+                                       "sub_group_ids": [group_id * 10 + 1, group_id * 10 + 2]})
+    faculties = [{"id": faculty_id, "name": f"Факультет {faculty_id}"} for faculty_id in range(FACULTIES_COUNT)]
+    return schedule_api._build_groups_tree(groups, faculties, [])
+
+
+# The lookups the index replaced, as they were before it.
+def _find_group_meta(groups_node: Mapping[str, Any], group_id: int) -> Mapping[str, Any] | None:
+    for value in groups_node.values():
+        if not isinstance(value, Mapping):
+            continue
+        raw_group_id = value.get("id")
+        if raw_group_id is not None:
+            try:
+                if int(raw_group_id) == group_id:
+                    return value
+            except (TypeError, ValueError):
+                pass
+        nested_result = _find_group_meta(value, group_id)
+        if nested_result:
+            return nested_result
+    return None
+
+
+def _extract_group_numbers(data) -> list[str]:
+    if isinstance(data, Mapping):
+        if "id" in data and isinstance(data["id"], (int, str)):
+            return [str(data["id"])]
+        return [number for value in data.values() for number in _extract_group_numbers(value)]
+    if isinstance(data, (int, str)) and str(data).isdigit():
+        return [str(data)]
+    return []
+
+
+def _per_call_us(function, calls: int, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat / calls * 10 ** 6
+
+
+def main(tree_path: str | None):
+    if tree_path:
+        with open(tree_path, encoding="utf-8") as tree_file:
+            groups_tree = json.load(tree_file)
+    else:
+        groups_tree = _synthetic_tree()
+    schedule_api._install_groups_tree(groups_tree, None)
+    group_ids = list(schedule_api._groups_index)
+    lookups = [random.choice(group_ids) for _ in range(LOOKUPS_COUNT)]
+
+    # The old helpers walked the plain tree decoded from the cache.
+    results = {
+        "recursive _find_group_meta": _per_call_us(
+            lambda: [_find_group_meta(groups_tree, group_id) for group_id in lookups], LOOKUPS_COUNT),
+        "validate_user id list": _per_call_us(
+            lambda: [str(group_id) in _extract_group_numbers(groups_tree) for group_id in lookups], LOOKUPS_COUNT),
+        "index lookup": _per_call_us(
+            lambda: [schedule_api._groups_index.get(group_id) for group_id in lookups], LOOKUPS_COUNT, 100),
+    }
+    print(f"{len(group_ids)} groups, {'tree from ' + tree_path if tree_path else 'synthetic tree'}")
+    for name, per_call in results.items():
+        print(f"{name:30}{per_call:10.2f} us per lookup")
+    build_ms = _per_call_us(lambda: schedule_api._build_groups_index(schedule_api._groups_tree), 1, 10) / 1000
+    print(f"{'building the index':30}{build_ms:10.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare group lookups by walking the groups tree and by the id index")
+    parser.add_argument('--tree', help='a groups tree as JSON, e.g. the groups:tree value from Redis; '
+                                       'a synthetic tree of the production shape by default')
+    args = parser.parse_args()
+    main(args.tree)
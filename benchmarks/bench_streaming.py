@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from scripts.database import AsyncDatabase, Database
+from scripts.mailing_store import AsyncMailingStore, MailingStore, group_recipient_pages
+
+MAILING_TIMES = ('07:00', '08:00', '18:00', None)
+
+
+async def _measure(name: str, function):
+    tracemalloc.start()
+    started = time.perf_counter()
+    users_count = await function()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{name:42} {users_count:>7} users  peak {peak / 2 ** 20:7.1f} MiB  {elapsed:5.2f}s")
+
+
+async def main(directory: str, users_count: int):
+    random.seed(1)
+    users = [(10 ** 8 + index, random.randrange(3000), random.randrange(3), random.choice(MAILING_TIMES))
+             for index in range(users_count)]
+    database = AsyncDatabase(os.path.join(directory, "user_data.db"))
+    mailings = AsyncMailingStore(os.path.join(directory, "mailing.db"))
+    await database.import_users(users)
+    await mailings.create_run("run", "today", datetime.now(timezone.utc), users)
+    del users
+
+    async def run_recipients_at_once():
+        # What a run did before: every pending recipient in one list, then grouped in a dict.
+        groups = defaultdict(list)
+        recipients = await mailings._call(MailingStore.get_pending_recipients_page, "run", None, users_count)
+        for user_id, group_id, sub_group, _ in recipients:
+            groups[group_id, sub_group].append(user_id)
+        return sum(len(user_ids) for user_ids in groups.values())
+
+    async def run_recipients_streamed():
+        groups = group_recipient_pages(mailings.iter_pending_recipients("run"))
+        return sum([len(user_ids) async for _, user_ids in groups])
+
+    async def subscribers_at_once():
+        return len(await database._call(Database.get_mailing_subscribers_page, None, users_count))
+
+    async def subscribers_streamed():
+        return sum([len(page) async for page in database.iter_mailing_subscribers()])
+
+    try:
+        await _measure("run recipients: all at once", run_recipients_at_once)
+        await _measure("run recipients: keyset pages by group", run_recipients_streamed)
+        await _measure("subscribers: all at once", subscribers_at_once)
+        await _measure("subscribers: iter_mailing_subscribers", subscribers_streamed)
+    finally:
+        await database.close()
+        await mailings.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Peak memory of loading mailing recipients at once and page by page")
+    parser.add_argument('--users', type=int, default=300000)
+    parser.add_argument('--dir', help='where to create the databases, a temporary directory by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        asyncio.run(main(args.dir or temporary_directory, args.users))
@@ -0,0 +1,96 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from scripts.database import MIGRATIONS, SUBSCRIBERS_PAGE_SIZE, Database
+
+MAILING_TIMES = ('07:00', '08:00', '18:00', '20:00', '21:00')
+GROUPS_COUNT = 3000
+
+QUERIES = {
+    "all subscribers": "SELECT user_id, group_id, sub_group, mailing FROM users WHERE mailing IS NOT NULL",
+    "users of 30 groups": "SELECT user_id, group_id, sub_group, mailing FROM users "
+                          f"WHERE group_id IN ({', '.join('?' * 30)})",
+    "get_user": "SELECT group_id, sub_group FROM users WHERE user_id = ?",
+    "subscribers page": "SELECT user_id, group_id, sub_group, mailing FROM users WHERE mailing IS NOT NULL "
+                        "AND (group_id, sub_group, mailing, user_id) > (?, ?, ?, ?) "
+                        "ORDER BY group_id, sub_group, mailing, user_id LIMIT ?",
+}
+
+
+def _create_original_database(path: str, users):
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute(MIGRATIONS[0][0])
+        connection.executemany("INSERT INTO users VALUES (?, ?, ?, ?)", users)
+    return connection
+
+
+def _timed(function, repeat: int = 1) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def _bench(connection: sqlite3.Connection, users) -> dict:
+    user_ids = [user[0] for user in random.sample(users, 10000)]
+    group_ids = random.sample(range(GROUPS_COUNT), 30)
+
+    def all_subscriber_pages():
+        after = (-1, -1, "", -1)
+        while page := connection.execute(QUERIES["subscribers page"], (*after, SUBSCRIBERS_PAGE_SIZE)).fetchall():
+            user_id, group_id, sub_group, mailing = page[-1]
+            after = (group_id, sub_group, mailing, user_id)
+
+    def writes():
+        for user_id in user_ids[:1000]:
+            with connection:
+                connection.execute("UPDATE users SET mailing = ? WHERE user_id = ?", ('20:00', user_id))
+
+    return {
+        "all subscribers": _timed(lambda: connection.execute(QUERIES["all subscribers"]).fetchall(), 5),
+        "users of 30 groups": _timed(
+            lambda: connection.execute(QUERIES["users of 30 groups"], group_ids).fetchall(), 5),
+        "10k get_user": _timed(lambda: [connection.execute(QUERIES["get_user"], (user_id,)).fetchone()
+                                        for user_id in user_ids]),
+        "all subscriber pages": _timed(all_subscriber_pages),
+        "1k committed writes": _timed(writes),
+    }
+
+
+def main(directory: str, users_count: int):
+    random.seed(1)
+    users = [(index * 7919 + 100000000, random.randrange(GROUPS_COUNT), random.randrange(3),
+              random.choice(MAILING_TIMES) if random.random() < 0.3 else None) for index in range(users_count)]
+
+    before = _bench(_create_original_database(os.path.join(directory, "original.db"), users), users)
+
+    path = os.path.join(directory, "migrated.db")
+    _create_original_database(path, users).close()
+    started = time.perf_counter()
+    database = Database(path)
+    migration_seconds = time.perf_counter() - started
+    after = _bench(database.connection, users)
+
+    print(f"{users_count} users, migrating the original database took {migration_seconds * 1000:.0f} ms")
+    print(f"{'':24}{'original':>12}{'migrated':>12}")
+    for name in before:
+        print(f"{name:24}{before[name]:>10.1f}ms{after[name]:>10.1f}ms")
+    print("query plans after the migration:")
+    for name, query in QUERIES.items():
+        plan = database.connection.execute(f"EXPLAIN QUERY PLAN {query}", (0,) * query.count("?")).fetchall()
+        print(f"  {name}: {'; '.join(row[3] for row in plan)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare queries on the original users schema and on the migrated one")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--dir', help='where to create the databases, a temporary directory by default')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        main(args.dir or temporary_directory, args.users)
@@ -30,6 +30,24 @@ TIMEZONE = os.environ.get('TIMEZONE', 'Europe/Moscow')
 
 # Redis cache
 REDIS_URL = os.environ.get('REDIS_URL')
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', '50'))
+REDIS_FETCH_LOCKS = os.environ.get('REDIS_FETCH_LOCKS', '1') == '1'
+
+# Mailing
+MAILING_RATE_LIMIT = float(os.environ.get('MAILING_RATE_LIMIT', '25'))
+MAILING_CONCURRENCY = int(os.environ.get('MAILING_CONCURRENCY', '20'))
+MAILING_WARMUP_MINUTES = int(os.environ.get('MAILING_WARMUP_MINUTES', '30'))
+MAILING_WARMUP_CONCURRENCY = int(os.environ.get('MAILING_WARMUP_CONCURRENCY', '4'))
+# After how many failed deliveries in a row a user is removed (0 - never)
+MAILING_PRUNE_FORBIDDEN_AFTER = int(os.environ.get('MAILING_PRUNE_FORBIDDEN_AFTER', '2'))
+MAILING_PRUNE_NOT_FOUND_AFTER = int(os.environ.get('MAILING_PRUNE_NOT_FOUND_AFTER', '1'))
+SCHEDULE_WATCH_MINUTES = int(os.environ.get('SCHEDULE_WATCH_MINUTES', '60'))
+# local - send mailings from this process, coordinator - queue them in Redis for `run.py --mailing-worker`
+# processes, off - this replica does not run mailings at all
+MAILING_ROLE = os.environ.get('MAILING_ROLE', 'local')
 
 # Path to run.py dir
 BASE_DIR = Path(__file__).parent.parent
+
+# Where users are stored: sqlite://<path>, redis://host:port/db (shared by several bot replicas) or memory://
+USER_STORAGE_URL = os.environ.get('USER_STORAGE_URL', f"sqlite://{BASE_DIR / 'storage' / 'user_data.db'}")
@@ -7,23 +7,30 @@ from aiohttp import web
 
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from data.config import WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, PUBLIC_KEY_PATH
+from data.config import WEBHOOK_URL, WEBHOOK_PATH, WEBAPP_HOST, WEBAPP_PORT, PUBLIC_KEY_PATH, MAILING_ROLE
 
-from scripts.bot import dp, bot
+from scripts.bot import dp, bot, db, mailings
 from scripts.log_manager import log_rotation_and_archiving
 
-from scripts.message_handlers import mailing_schedule
+from scripts.message_handlers import mailing_dispatcher, render_group_mailing, broadcast_schedule
 from scripts.parse import update_groups
+from scripts.schedule_changes import watch_schedule_changes
+from scripts import cache, schedule_api, broadcasts, mailing_queue
 
 import scripts.handlers  # Although it looks like an unused import, it is necessary for the handlers to be registered
 
 
 async def on_startup(bot: Bot):
     await bot.delete_webhook(drop_pending_updates=True)
+    await schedule_api.open_http_session()
+    schedule_api.load_reference_snapshot()
     
     loop = asyncio.get_event_loop()
     loop.create_task(update_groups('00:00'))
-    loop.create_task(mailing_schedule('18:00', 'tomorrow'))
+    if MAILING_ROLE != 'off':
+        loop.create_task(mailing_dispatcher())
+        loop.create_task(watch_schedule_changes())
+        loop.create_task(broadcasts.resume_broadcasts())
     loop.create_task(log_rotation_and_archiving(bool(debug_mode)))
 
     if debug_mode:
@@ -38,9 +45,24 @@ async def on_startup(bot: Bot):
 async def on_shutdown(bot: Bot):
     await bot.delete_webhook()
 
+    await schedule_api.close_http_session()
+    await cache.close()
+    await db.close()
+    await mailings.close()
     await dp.storage.close()
 
 
+async def run_mailing_worker():
+    await schedule_api.open_http_session()
+    schedule_api.load_reference_snapshot()
+    try:
+        await mailing_queue.run_mailing_worker(render_group_mailing, broadcast_schedule)
+    finally:
+        await schedule_api.close_http_session()
+        await cache.close()
+        await bot.session.close()
+
+
 def main():
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
@@ -68,7 +90,12 @@ def main():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--debug', action='store_true', help='Run the bot in debug mode')
+    parser.add_argument('--mailing-worker', action='store_true',
+                        help='Only send mailings queued by the coordinator, without handling updates')
     args = parser.parse_args()
 
     debug_mode = args.debug
-    main()
+    if args.mailing_worker:
+        asyncio.run(run_mailing_worker())
+    else:
+        main()
@@ -5,11 +5,13 @@ from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-import scripts.database as database
-from data.config import TELEGRAM_TOKEN, BASE_DIR
+import scripts.mailing_store as mailing_store
+from data.config import TELEGRAM_TOKEN, BASE_DIR, USER_STORAGE_URL
+from scripts.user_storage import open_user_storage
 
 storage = MemoryStorage()
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
 dp = Dispatcher(storage=storage)
 
-db = database.Database(Path(BASE_DIR / 'storage' / 'user_data.db'))
+db = open_user_storage(USER_STORAGE_URL)
+mailings = mailing_store.AsyncMailingStore(Path(BASE_DIR / 'storage' / 'mailing.db'))
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from functools import partial
+from typing import Tuple
+
+from aiogram import exceptions
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from data.config import ADMIN_TELEGRAM_ID
+from scripts import schedule_api, sender
+from scripts.bot import bot, db, mailings
+from scripts.mailing_store import (DeliveryJournal, RecipientRecorder, broadcast_run_id, BROADCAST_RUNNING, BROADCAST_DONE,
+                                   BROADCAST_ABORTED, BROADCAST_FAILED, METRICS_BROADCAST)
+from scripts.message_handlers import broadcast_message, prune_unreachable_users
+from scripts.user_storage import iter_users
+from scripts.utils import notify_admins
+
+TARGET_ALL = "all"
+TARGET_SUBSCRIBERS = "subscribers"
+TARGET_FACULTY = "faculty"
+TARGET_GROUP = "group"
+
+BROADCAST_PROGRESS_INTERVAL = 5
+BROADCAST_MAX_RESTARTS = 3
+BROADCAST_RESTART_DELAY = 10
+BROADCAST_STATUS_FLUSH_SIZE = 10
+
+_jobs: dict[int, asyncio.Task] = {}
+_aborted: set[int] = set()
+
+
+class BroadcastAbortCallback(CallbackData, prefix="abort_broadcast"):
+    job_id: int
+
+
+async def _iter_group_users(group_ids):
+    # One group at a time, each one is a range of the users_group_id index.
+    for group_id in group_ids:
+        if users := await db.get_users_by_groups([group_id]):
+            yield users
+
+
+async def resolve_recipients(target: str, value: str | None = None):
+    # Pages of recipients, the whole audience is never held in memory at once.
+    if target == TARGET_SUBSCRIBERS:
+        # Keyset pages in (group_id, sub_group, mailing) order, range scans of the users_group_id index. There is
+        # no index on mailing alone.
+        pages = db.iter_mailing_subscribers()
+    elif target == TARGET_FACULTY:
+        pages = _iter_group_users(await schedule_api.get_faculty_group_ids(value))
+    elif target == TARGET_GROUP:
+        pages = _iter_group_users([int(value)])
+    else:
+        # Pages by user_id, the rowid.
+        pages = iter_users(db)
+    async for recipients in pages:
+        if recipients := [recipient for recipient in recipients if recipient[0] != ADMIN_TELEGRAM_ID]:
+            yield recipients
+
+
+def abort_markup(job_id: int) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(
+        text="Отменить", callback_data=BroadcastAbortCallback(job_id=job_id).pack())]])
+
+
+def _progress_text(counts: dict) -> str:
+    done = counts['sent'] + counts['failed']
+    total = counts['total']
+    progress = (done / total) * 100 if total else 100
+    progress_bar = f"<code>[{'#' * (int(progress) // 5)}{'-' * (20 - (int(progress) // 5))}]</code>"
+    return f"Отправлено {done} из {total} ({progress:.2f}%) {progress_bar}"
+
+
+async def _edit_progress(job: dict, text: str, reply_markup: InlineKeyboardMarkup | None = None):
+    if not job['progress_message_id']:
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=job['progress_chat_id'], message_id=job['progress_message_id'],
+                                    reply_markup=reply_markup)
+    except exceptions.TelegramAPIError as e:
+        # "message is not modified" and similar errors must not break the broadcast itself.
+        logging.debug(f"failed to update broadcast progress: {e}")
+
+
+async def _report_progress(job: dict):
+    run_id = broadcast_run_id(job['job_id'])
+    last_text = None
+    while True:
+        await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        text = _progress_text(await mailings.get_recipient_counts(run_id))
+        if text != last_text:
+            await _edit_progress(job, text, abort_markup(job['job_id']))
+            last_text = text
+
+
+async def _send_broadcast(job: dict) -> str:
+    job_id = job['job_id']
+    run_id = broadcast_run_id(job_id)
+
+    def aborted() -> bool:
+        return job_id in _aborted
+
+    async def deliveries():
+        async for recipients in mailings.iter_pending_recipients(run_id):
+            for user_id, *_ in recipients:
+                if aborted():
+                    return
+                yield user_id, partial(broadcast_message, user_id, job['from_chat_id'], job['message_id'],
+                                       job['mode'])
+
+    journal = DeliveryJournal(mailings)
+    recorder = RecipientRecorder(mailings, run_id, BROADCAST_STATUS_FLUSH_SIZE, journal)
+    progress = asyncio.create_task(_report_progress(job))
+    try:
+        report = await sender.send_all(deliveries(), journal.record_error, on_result=recorder,
+                                       should_stop=aborted)
+    finally:
+        progress.cancel()
+        await recorder.flush()
+        await prune_unreachable_users(journal)
+
+    logging.info(f"admin broadcast {job_id} finished: {report.summary()}")
+    await mailings.save_run_metrics(METRICS_BROADCAST, run_id, report, {"target": job['target'], "mode": job['mode']})
+    return BROADCAST_ABORTED if job_id in _aborted else BROADCAST_DONE
+
+
+async def _supervise(job_id: int):
+    job = await mailings.get_broadcast(job_id)
+    status = BROADCAST_FAILED
+    # Only pending recipients are sent to, so a crashed attempt can simply be started again.
+    for attempt in range(1, BROADCAST_MAX_RESTARTS + 1):
+        try:
+            status = await _send_broadcast(job)
+            break
+        except Exception:
+            logging.exception(f"admin broadcast {job_id} crashed (attempt {attempt})")
+            await asyncio.sleep(BROADCAST_RESTART_DELAY)
+
+    await mailings.finish_broadcast(job_id, status)
+    counts = await mailings.get_recipient_counts(broadcast_run_id(job_id))
+    done = counts['sent'] + counts['failed']
+    if status == BROADCAST_ABORTED:
+        await _edit_progress(job, f"🚫 Рассылка отменена. Отправлено {done} из {counts['total']}.")
+    elif status == BROADCAST_FAILED:
+        await _edit_progress(job, _progress_text(counts))
+        await notify_admins(f"Рассылка {job_id} остановилась из-за ошибок. "
+                            f"Отправлено {done} из {counts['total']}.")
+    else:
+        await _edit_progress(job, f"✅ Рассылка завершена. {_progress_text(counts)}\n"
+                                  f"Доставлено {counts['sent']}, ошибок {counts['failed']}.")
+
+
+def _spawn(job_id: int):
+    task = asyncio.create_task(_supervise(job_id))
+    _jobs[job_id] = task
+
+    def forget(done_task: asyncio.Task):
+        _jobs.pop(job_id, None)
+        _aborted.discard(job_id)
+        if not done_task.cancelled() and done_task.exception():
+            logging.error(f"admin broadcast {job_id} supervisor failed", exc_info=done_task.exception())
+
+    task.add_done_callback(forget)
+
+
+async def start_broadcast(from_chat_id: int, message_id: int, mode: str, target: str, recipient_pages,
+                          progress_chat_id: int, progress_message_id: int) -> Tuple[int, int]:
+    job_id = await mailings.create_broadcast(from_chat_id, message_id, mode, target)
+    recipients_count = 0
+    try:
+        async for recipients in recipient_pages:
+            await mailings.add_broadcast_recipients(job_id, recipients)
+            recipients_count += len(recipients)
+    except Exception:
+        await mailings.finish_broadcast(job_id, BROADCAST_FAILED)
+        raise
+    if not recipients_count:
+        await mailings.finish_broadcast(job_id, BROADCAST_DONE)
+        return job_id, 0
+
+    await mailings.set_broadcast_progress_message(job_id, progress_chat_id, progress_message_id)
+    await mailings.start_broadcast(job_id)
+    _spawn(job_id)
+    logging.info(f"admin broadcast {job_id} started: {recipients_count} recipients, target {target}")
+    return job_id, recipients_count
+
+
+async def abort_broadcast(job_id: int) -> bool:
+    if job_id in _jobs:
+        _aborted.add(job_id)
+        return True
+    job = await mailings.get_broadcast(job_id)
+    if job and job['status'] == BROADCAST_RUNNING:
+        await mailings.finish_broadcast(job_id, BROADCAST_ABORTED)
+        return True
+    return False
+
+
+async def resume_broadcasts():
+    # A job still being prepared when the bot stopped has only part of its recipients.
+    await mailings.fail_unprepared_broadcasts()
+    for job_id in await mailings.get_unfinished_broadcasts():
+        logging.info(f"resuming admin broadcast {job_id}")
+        _spawn(job_id)
+
+
+def estimate_seconds(recipients_count: int) -> float:
+    return recipients_count / sender.bot_limiter.rate
@@ -0,0 +1,373 @@
+import asyncio
+import datetime
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple
+
+from redis.asyncio import BlockingConnectionPool, Redis
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError, LockError
+from redis.retry import Retry
+
+from data.config import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_FETCH_LOCKS
+
+REDIS_POOL_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 2
+REDIS_HEALTH_CHECK_INTERVAL = 30
+REDIS_PROBE_BACKOFF_INITIAL = 1
+REDIS_PROBE_BACKOFF_MAX = 300
+
+FETCH_LOCK_PREFIX = "lock"
+FETCH_LOCK_TTL = 15
+FETCH_LOCK_WAIT = 12
+FETCH_LOCK_POLL_INTERVAL = 0.2
+STALE_REFRESH_GRACE = 2
+
+CACHE_STATE_DISABLED = "disabled"
+CACHE_STATE_CONNECTED = "connected"
+CACHE_STATE_DOWN = "down"
+
+
+
+class CacheEntry(NamedTuple):
+    value: Any
+    fetched_at: datetime.datetime | None
+    fresh: bool
+
+
+_redis_pool: BlockingConnectionPool | None = None
+_redis_client: Redis | None = None
+_redis_healthy = False
+_probe_backoff = REDIS_PROBE_BACKOFF_INITIAL
+_next_probe_at = 0.0
+_down_since: datetime.datetime | None = None
+_last_error: str | None = None
+_stats = {
+    "probes": 0,
+    "failures": 0,
+    "reconnects": 0,
+}
+_in_flight: dict[str, asyncio.Task] = {}
+
+
+def _create_client() -> Redis:
+    global _redis_pool, _redis_client
+    if _redis_client is None:
+        # Blocking pool makes bursts of updates wait for a free connection instead of failing.
+        _redis_pool = BlockingConnectionPool.from_url(
+            REDIS_URL,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            retry=Retry(ExponentialBackoff(cap=1, base=0.05), 2),
+            retry_on_error=[RedisConnectionError, RedisTimeoutError],
+            decode_responses=True,
+        )
+        _redis_client = Redis(connection_pool=_redis_pool)
+    return _redis_client
+
+
+def _mark_down(exc: Exception) -> None:
+    global _redis_healthy, _probe_backoff, _next_probe_at, _down_since, _last_error
+    _stats["failures"] += 1
+    _last_error = str(exc)
+    if _redis_healthy or _down_since is None:
+        logging.warning("Redis is unavailable, cache is disabled: %s", exc)
+        _down_since = datetime.datetime.now(datetime.timezone.utc)
+        _probe_backoff = REDIS_PROBE_BACKOFF_INITIAL
+    _redis_healthy = False
+    _next_probe_at = time.monotonic() + _probe_backoff
+    _probe_backoff = min(_probe_backoff * 2, REDIS_PROBE_BACKOFF_MAX)
+
+
+def _mark_up() -> None:
+    global _redis_healthy, _probe_backoff, _down_since, _last_error
+    if _down_since is not None:
+        _stats["reconnects"] += 1
+        logging.info("Redis is available again, cache is enabled")
+    _redis_healthy = True
+    _probe_backoff = REDIS_PROBE_BACKOFF_INITIAL
+    _down_since = None
+    _last_error = None
+
+
+def handle_error(exc: Exception) -> None:
+    if isinstance(exc, (RedisConnectionError, RedisTimeoutError, OSError)):
+        _mark_down(exc)
+
+
+async def get_redis() -> Redis | None:
+    global _next_probe_at
+    if not REDIS_URL:
+        return None
+    if _redis_healthy:
+        return _redis_client
+    if time.monotonic() < _next_probe_at:
+        return None
+
+    _stats["probes"] += 1
+    # Keep concurrent callers from probing at the same time while this ping is in flight.
+    _next_probe_at = time.monotonic() + REDIS_SOCKET_TIMEOUT
+    try:
+        client = _create_client()
+        await client.ping()
+    except Exception as exc:
+        _mark_down(exc)
+        return None
+    _mark_up()
+    return client
+
+
+def get_status() -> dict[str, Any]:
+    if not REDIS_URL:
+        state = CACHE_STATE_DISABLED
+    elif _redis_healthy:
+        state = CACHE_STATE_CONNECTED
+    else:
+        state = CACHE_STATE_DOWN
+    return {
+        "state": state,
+        "down_since": _down_since,
+        "next_probe_in": max(0.0, _next_probe_at - time.monotonic()) if state == CACHE_STATE_DOWN else None,
+        "last_error": _last_error,
+        **_stats,
+    }
+
+
+async def close() -> None:
+    global _redis_pool, _redis_client, _redis_healthy
+    if _redis_client is not None:
+        await _redis_client.aclose()
+    if _redis_pool is not None:
+        await _redis_pool.disconnect()
+    _redis_client = None
+    _redis_pool = None
+    _redis_healthy = False
+
+
+async def get_value(key: str) -> str | None:
+    redis_client = await get_redis()
+    if not redis_client:
+        return None
+    try:
+        return await redis_client.get(key)
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to read cache %s: %s", key, exc)
+        return None
+
+
+async def incr(key: str) -> int | None:
+    redis_client = await get_redis()
+    if not redis_client:
+        return None
+    try:
+        return await redis_client.incr(key)
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to write cache %s: %s", key, exc)
+        return None
+
+
+def is_available() -> bool:
+    return get_status()["state"] == CACHE_STATE_CONNECTED
+
+
+async def get_json(key: str) -> Any | None:
+    redis_client = await get_redis()
+    if not redis_client:
+        return None
+    try:
+        cached = await redis_client.get(key)
+        if not cached:
+            return None
+        return json.loads(cached)
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to read cache %s: %s", key, exc)
+        return None
+
+
+async def set_json(key: str, value: Any, ttl: datetime.timedelta) -> None:
+    redis_client = await get_redis()
+    if not redis_client:
+        return
+    try:
+        await redis_client.setex(key, int(ttl.total_seconds()), json.dumps(value, ensure_ascii=False))
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to write cache %s: %s", key, exc)
+
+
+def _wrap_entry(value: Any, ttl: datetime.timedelta) -> dict[str, Any]:
+    fetched_at = time.time()
+    return {"v": value, "t": fetched_at, "f": fetched_at + ttl.total_seconds()}
+
+
+def _unwrap_entry(raw: Any) -> CacheEntry:
+    if isinstance(raw, dict) and raw.keys() == {"v", "t", "f"}:
+        fetched_at = datetime.datetime.fromtimestamp(raw["t"], datetime.timezone.utc)
+        return CacheEntry(raw["v"], fetched_at, time.time() < raw["f"])
+    # Values written before entries carried timestamps are treated as fresh until they expire.
+    return CacheEntry(raw, None, True)
+
+
+async def get_entry(key: str) -> CacheEntry | None:
+    cached = await get_json(key)
+    if cached is None:
+        return None
+    return _unwrap_entry(cached)
+
+
+async def get_fresh_entry(key: str) -> CacheEntry | None:
+    entry = await get_entry(key)
+    return entry if entry is not None and entry.fresh else None
+
+
+async def set_entry(key: str, value: Any, ttl: datetime.timedelta, stale_ttl: datetime.timedelta) -> CacheEntry:
+    entry = _wrap_entry(value, ttl)
+    await set_json(key, entry, stale_ttl)
+    return _unwrap_entry(entry)
+
+
+async def get_many(prefix: str, ids: list[int]) -> tuple[dict[int, CacheEntry], list[int]]:
+    redis_client = await get_redis()
+    if not redis_client:
+        return {}, ids
+    keys = [f"{prefix}:{item_id}" for item_id in ids]
+    try:
+        values = await redis_client.mget(keys)
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to read cache %s: %s", prefix, exc)
+        return {}, ids
+
+    found: dict[int, CacheEntry] = {}
+    missing: list[int] = []
+    for item_id, raw in zip(ids, values):
+        if raw:
+            try:
+                found[item_id] = _unwrap_entry(json.loads(raw))
+            except Exception:
+                missing.append(item_id)
+        else:
+            missing.append(item_id)
+    return found, missing
+
+
+async def set_many(prefix: str, items: Iterable[dict[str, Any]], ttl: datetime.timedelta,
+                   stale_ttl: datetime.timedelta) -> None:
+    redis_client = await get_redis()
+    if not redis_client:
+        return
+    ttl_seconds = int(stale_ttl.total_seconds())
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for item in items:
+            raw_id = item.get("id")
+            if raw_id is None:
+                continue
+            try:
+                item_id = int(raw_id)
+            except (TypeError, ValueError):
+                continue
+            key = f"{prefix}:{item_id}"
+            pipeline.setex(key, ttl_seconds, json.dumps(_wrap_entry(item, ttl), ensure_ascii=False))
+        await pipeline.execute()
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to write cache %s: %s", prefix, exc)
+
+
+def start_flight(key: str, fetch: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+    task = _in_flight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(fetch())
+        _in_flight[key] = task
+
+        def forget(done_task: asyncio.Task) -> None:
+            if _in_flight.get(key) is done_task:
+                del _in_flight[key]
+            if not done_task.cancelled() and done_task.exception():
+                logging.error("Fetch %s failed: %s", key, done_task.exception())
+
+        task.add_done_callback(forget)
+    return task
+
+
+async def single_flight(key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+    # Shield the shared task so one cancelled waiter does not cancel the fetch for everyone else.
+    return await asyncio.shield(start_flight(key, fetch))
+
+
+async def fetch_locked(key: str, fetch: Callable[[], Awaitable[Any]],
+                       read: Callable[[str], Awaitable[Any]] = get_json) -> Any:
+    redis_client = await get_redis()
+    if not redis_client or not REDIS_FETCH_LOCKS:
+        return await fetch()
+
+    lock = redis_client.lock(f"{FETCH_LOCK_PREFIX}:{key}", timeout=FETCH_LOCK_TTL, blocking=False)
+    try:
+        acquired = await lock.acquire()
+    except Exception as exc:
+        handle_error(exc)
+        logging.warning("Failed to acquire fetch lock %s: %s", key, exc)
+        return await fetch()
+
+    if acquired:
+        try:
+            return await fetch()
+        finally:
+            try:
+                await lock.release()
+            except LockError:
+                pass
+            except Exception as exc:
+                handle_error(exc)
+
+    # Another replica is fetching the same key: wait for it to publish the result.
+    deadline = time.monotonic() + FETCH_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(FETCH_LOCK_POLL_INTERVAL)
+        cached = await read(key)
+        if cached is not None:
+            return cached
+        try:
+            if not await lock.locked():
+                break
+        except Exception as exc:
+            handle_error(exc)
+            break
+    return await fetch()
+
+
+async def coalesce(key: str, fetch: Callable[[], Awaitable[Any]],
+                   read: Callable[[str], Awaitable[Any]] = get_json) -> Any:
+    return await single_flight(key, lambda: fetch_locked(key, fetch, read))
+
+
+async def get_or_fetch(key: str, fetch: Callable[[], Awaitable[Any]], ttl: datetime.timedelta,
+                       stale_ttl: datetime.timedelta) -> CacheEntry | None:
+    entry = await get_entry(key)
+    if entry is not None and entry.fresh:
+        return entry
+
+    async def fetch_entry() -> CacheEntry | None:
+        value = await fetch()
+        if value is None:
+            return None
+        return await set_entry(key, value, ttl, stale_ttl)
+
+    if entry is None:
+        return await coalesce(key, fetch_entry, get_fresh_entry)
+
+    # Stale-while-revalidate: give the refresh a short head start, then serve the last good copy.
+    refresh = start_flight(key, lambda: fetch_locked(key, fetch_entry, get_fresh_entry))
+    try:
+        refreshed = await asyncio.wait_for(asyncio.shield(refresh), STALE_REFRESH_GRACE)
+    except asyncio.TimeoutError:
+        refreshed = None
+    return refreshed or entry
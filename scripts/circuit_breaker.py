@@ -0,0 +1,93 @@
+import logging
+import time
+from typing import Any
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+_TRANSITION_COUNTERS = {
+    STATE_CLOSED: "closed",
+    STATE_OPEN: "opened",
+    STATE_HALF_OPEN: "half_opened",
+}
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.stats = {
+            "successes": 0,
+            "failures": 0,
+            "rejected": 0,
+            "opened": 0,
+            "half_opened": 0,
+            "closed": 0,
+        }
+
+    def _transition(self, state: str) -> None:
+        logging.warning("circuit %s: %s -> %s", self.name, self.state, state)
+        self.state = state
+        self.stats[_TRANSITION_COUNTERS[state]] += 1
+
+    def allow_request(self) -> bool:
+        if self.state == STATE_OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                self.stats["rejected"] += 1
+                return False
+            self._transition(STATE_HALF_OPEN)
+
+        if self.state == STATE_HALF_OPEN:
+            # Only one trial request probes the endpoint, the rest keep failing fast.
+            if self.trial_in_flight:
+                self.stats["rejected"] += 1
+                return False
+            self.trial_in_flight = True
+        return True
+
+    @property
+    def is_trial(self) -> bool:
+        return self.state == STATE_HALF_OPEN
+
+    # trial tells whether the request reserved the half-open trial. A request admitted while the circuit was
+    # closed can finish during someone else's trial and must not free it.
+    def record_success(self, trial: bool = False) -> None:
+        self.stats["successes"] += 1
+        self.consecutive_failures = 0
+        if trial:
+            self.trial_in_flight = False
+        if self.state != STATE_CLOSED:
+            self._transition(STATE_CLOSED)
+
+    def release_trial(self) -> None:
+        # Called when a request ends without an outcome (e.g. it was cancelled).
+        self.trial_in_flight = False
+
+    def record_failure(self, trial: bool = False) -> None:
+        self.stats["failures"] += 1
+        self.consecutive_failures += 1
+        if trial:
+            self.trial_in_flight = False
+        if self.state == STATE_HALF_OPEN or (
+                self.state == STATE_CLOSED and self.consecutive_failures >= self.failure_threshold):
+            self.opened_at = time.monotonic()
+            self._transition(STATE_OPEN)
+
+    def status(self) -> dict[str, Any]:
+        retry_in = None
+        if self.state == STATE_OPEN:
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+        return {
+            "name": self.name,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "retry_in": retry_in,
+            **self.stats,
+        }
@@ -1,21 +1,106 @@
+import asyncio
+import logging
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
 
+# SQLite limits the number of bound parameters in one statement.
+QUERY_PARAMS_CHUNK = 500
+# How many queued requests the database thread runs in one transaction.
+REQUEST_BATCH_SIZE = 100
+SUBSCRIBERS_PAGE_SIZE = 1000
+SQLITE_CACHE_KIB = 16 * 1024
+SQLITE_BUSY_TIMEOUT_MS = 5000
 
-class Database:
-    def __init__(self, path):
-        self.connection = sqlite3.connect(path)
-        self.create_table()
+# Each migration is applied once, in order, in the same transaction as its version bump. Never edit an applied
+# migration, add a new one instead.
+MIGRATIONS = [
+    # 1: the original schema, a no-op for databases created before migrations existed
+    ("""CREATE TABLE IF NOT EXISTS users
+        (user_id    BIGINT  UNIQUE NOT NULL PRIMARY KEY,
+         group_id   INTEGER NOT NULL,
+         sub_group  INTEGER NOT NULL DEFAULT (0),
+         mailing    STRING  DEFAULT NULL);""",),
+    # 2: user_id becomes the rowid and mailing gets TEXT affinity instead of the NUMERIC one of STRING
+    ("""CREATE TABLE users_new
+        (user_id    INTEGER PRIMARY KEY,
+         group_id   INTEGER NOT NULL,
+         sub_group  INTEGER NOT NULL DEFAULT (0),
+         mailing    TEXT    DEFAULT NULL);""",
+     "INSERT INTO users_new (user_id, group_id, sub_group, mailing) "
+     "SELECT user_id, group_id, sub_group, CAST(mailing AS TEXT) FROM users",
+     "DROP TABLE users",
+     "ALTER TABLE users_new RENAME TO users"),
+    # 3: a covering index for users by group and for subscriber pages in (group_id, sub_group, mailing) order.
+    # Targeting by mailing time has no index of its own: it reads this index per group or scans the table, which
+    # on a four-column table costs about the same as a partial index (see benchmarks/bench_users_schema.py).
+    ("CREATE INDEX users_group_id ON users (group_id, sub_group, mailing)",),
+]
+
+
+def configure_connection(connection: sqlite3.Connection):
+    # WAL lets readers work while a write is in progress. With synchronous=NORMAL a power loss can drop only the
+    # last commits, never corrupt the file.
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}")
+    connection.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+
+
+class SqliteStore:
+    def __init__(self, path, check_same_thread: bool = True):
+        # storage/ is not in the repository, the first start creates it.
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode: transaction() opens transactions itself, the sqlite3 module would not do it before DDL.
+        self.connection = sqlite3.connect(path, check_same_thread=check_same_thread, isolation_level=None)
+        self._transaction_depth = 0
+        configure_connection(self.connection)
+
+    @contextmanager
+    def transaction(self):
+        # Nested calls join the outer transaction, so several method calls can be committed at once.
+        self._transaction_depth += 1
+        try:
+            if self._transaction_depth > 1:
+                yield
+                return
+            self.connection.execute("BEGIN")
+            try:
+                yield
+            except BaseException:
+                # SQLite may have rolled back already, e.g. on SQLITE_FULL.
+                if self.connection.in_transaction:
+                    self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+        finally:
+            self._transaction_depth -= 1
 
-    def create_table(self):
-        with self.connection:
-            self.connection.execute("""CREATE TABLE IF NOT EXISTS users 
-                                       (user_id    BIGINT  UNIQUE NOT NULL PRIMARY KEY, 
-                                        group_id   INTEGER NOT NULL, 
-                                        sub_group  INTEGER NOT NULL DEFAULT (0), 
-                                        mailing    STRING  DEFAULT NULL);""")
+
+class Database(SqliteStore):
+    def __init__(self, path, check_same_thread: bool = True):
+        super().__init__(path, check_same_thread)
+        self.migrate()
+
+    def get_schema_version(self) -> int:
+        with self.transaction():
+            self.connection.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            version = self.connection.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+        return version or 0
+
+    def migrate(self):
+        current = self.get_schema_version()
+        for version, statements in enumerate(MIGRATIONS[current:], start=current + 1):
+            with self.transaction():
+                for statement in statements:
+                    self.connection.execute(statement)
+                self.connection.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            logging.info(f"users database migrated to version {version}")
 
     def add_user(self, user_id, group_id, sub_group):
-        with self.connection:
+        with self.transaction():
             self.connection.execute(
                 "INSERT INTO users (user_id, group_id, sub_group) VALUES (?, ?, ?) "
                 "ON CONFLICT (user_id) DO UPDATE SET group_id = ?, sub_group = ?",
@@ -23,7 +108,7 @@ class Database:
             )
 
     def get_user(self, user_id):
-        with self.connection:
+        with self.transaction():
             user_data = self.connection.execute(
                 "SELECT group_id, sub_group FROM users WHERE user_id = ?",
                 (user_id,)
@@ -31,44 +116,209 @@ class Database:
         return user_data
 
     def set_mailing_time(self, user_id: int, mailing_time: str):
-        with self.connection:
+        with self.transaction():
             self.connection.execute(
                 "UPDATE users SET mailing = ? WHERE user_id = ?",
                 (mailing_time, user_id)
             )
 
     def del_mailing_time(self, user_id: int):
-        with self.connection:
+        with self.transaction():
             self.connection.execute(
                 "UPDATE users SET mailing = NULL WHERE user_id = ?",
                 (user_id,)
             )
 
     def get_mailing_time(self, user_id: int):
-        with self.connection:
+        with self.transaction():
             mailing_time = self.connection.execute(
                 "SELECT mailing FROM users WHERE user_id = ?",
                 (user_id,)
             ).fetchone()
         return mailing_time[0] if mailing_time else None
 
-    def get_mailing_list(self):
-        with self.connection:
-            mailing_list = self.connection.execute(
-                "SELECT user_id, mailing FROM users WHERE mailing IS NOT NULL"
+    def get_mailing_subscribers_page(self, after: tuple | None, limit: int):
+        # Keyset pagination over (group_id, sub_group, mailing, user_id): every page is an index range scan, no
+        # matter how far into the table it starts.
+        query = "SELECT user_id, group_id, sub_group, mailing FROM users WHERE mailing IS NOT NULL"
+        params = ()
+        if after:
+            user_id, group_id, sub_group, mailing = after
+            query += " AND (group_id, sub_group, mailing, user_id) > (?, ?, ?, ?)"
+            params = (group_id, sub_group, mailing, user_id)
+        with self.transaction():
+            subscribers = self.connection.execute(
+                f"{query} ORDER BY group_id, sub_group, mailing, user_id LIMIT ?",
+                (*params, limit)
+            ).fetchall()
+        return subscribers
+
+    def get_users_by_groups(self, group_ids):
+        group_ids = list(group_ids)
+        users = []
+        with self.transaction():
+            for start in range(0, len(group_ids), QUERY_PARAMS_CHUNK):
+                chunk = group_ids[start:start + QUERY_PARAMS_CHUNK]
+                users += self.connection.execute(
+                    "SELECT user_id, group_id, sub_group, mailing FROM users "
+                    f"WHERE group_id IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+        return users
+
+    def get_users_page(self, after_user_id: int | None, limit: int):
+        with self.transaction():
+            users = self.connection.execute(
+                "SELECT user_id, group_id, sub_group, mailing FROM users WHERE user_id > ? "
+                "ORDER BY user_id LIMIT ?",
+                (after_user_id if after_user_id is not None else -2 ** 63, limit)
             ).fetchall()
-        return mailing_list
+        return users
+
+    def import_users(self, users):
+        with self.transaction():
+            self.connection.executemany(
+                "INSERT INTO users (user_id, group_id, sub_group, mailing) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "group_id = excluded.group_id, sub_group = excluded.sub_group, mailing = excluded.mailing",
+                users
+            )
 
     def del_user(self, user_id):
-        with self.connection:
+        with self.transaction():
             self.connection.execute(
                 "DELETE FROM users WHERE user_id = ?",
                 (user_id,)
             )
 
-    def get_all_id(self):
-        with self.connection:
-            all_user_ids = self.connection.execute(
-                "SELECT user_id FROM users"
-            ).fetchall()
-        return all_user_ids
+    def del_users(self, user_ids):
+        with self.transaction():
+            self.connection.executemany(
+                "DELETE FROM users WHERE user_id = ?",
+                [(user_id,) for user_id in user_ids]
+            )
+
+    def count_users(self) -> int:
+        with self.transaction():
+            users_count = self.connection.execute(
+                "SELECT COUNT(*) FROM users"
+            ).fetchone()[0]
+        return users_count
+
+
+class DatabaseThread:
+    # One thread owns the connection of a SqliteStore and runs queued calls in order, committing everything that
+    # queued up meanwhile in a single transaction.
+    def __init__(self, database: SqliteStore, name: str):
+        self.database = database
+        self._requests: queue.SimpleQueue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name=name, daemon=True)
+        self._thread.start()
+
+    def _run_batch(self, batch):
+        try:
+            with self.database.transaction():
+                results = [method(self.database, *args) for method, args, _, _ in batch]
+        except Exception as exc:
+            if len(batch) == 1:
+                _, _, loop, future = batch[0]
+                loop.call_soon_threadsafe(_set_exception, future, exc)
+                return
+            # Rerun one by one so a single failing call does not fail the calls it was batched with.
+            for request in batch:
+                self._run_batch([request])
+            return
+        for (_, _, loop, future), result in zip(batch, results):
+            loop.call_soon_threadsafe(_set_result, future, result)
+
+    def _serve(self):
+        while True:
+            batch = [self._requests.get()]
+            while len(batch) < REQUEST_BATCH_SIZE:
+                try:
+                    batch.append(self._requests.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [request for request in batch if request is not None]
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                self.database.connection.close()
+                return
+
+    def _call(self, method, *args) -> asyncio.Future:
+        # The call is queued right away, the returned future can be awaited later.
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Nothing may be queued after close(), the thread would never answer it.
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError("Cannot operate on a closed database.")
+            self._requests.put((method, args, loop, future))
+        return future
+
+    async def close(self):
+        with self._lock:
+            self._closed = True
+            self._requests.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+
+class AsyncDatabase(DatabaseThread):
+    # The same methods as Database, but awaitable.
+    def __init__(self, path):
+        super().__init__(Database(path, check_same_thread=False), "database")
+
+    async def add_user(self, user_id, group_id, sub_group):
+        return await self._call(Database.add_user, user_id, group_id, sub_group)
+
+    async def get_user(self, user_id):
+        return await self._call(Database.get_user, user_id)
+
+    async def set_mailing_time(self, user_id: int, mailing_time: str):
+        return await self._call(Database.set_mailing_time, user_id, mailing_time)
+
+    async def del_mailing_time(self, user_id: int):
+        return await self._call(Database.del_mailing_time, user_id)
+
+    async def get_mailing_time(self, user_id: int):
+        return await self._call(Database.get_mailing_time, user_id)
+
+    async def iter_mailing_subscribers(self, page_size: int = SUBSCRIBERS_PAGE_SIZE):
+        after = None
+        while subscribers := await self._call(Database.get_mailing_subscribers_page, after, page_size):
+            yield subscribers
+            after = subscribers[-1]
+
+    async def get_users_by_groups(self, group_ids):
+        return await self._call(Database.get_users_by_groups, list(group_ids))
+
+    async def get_users_page(self, after_user_id: int | None, limit: int):
+        return await self._call(Database.get_users_page, after_user_id, limit)
+
+    async def import_users(self, users):
+        return await self._call(Database.import_users, list(users))
+
+    async def del_user(self, user_id):
+        return await self._call(Database.del_user, user_id)
+
+    async def del_users(self, user_ids):
+        return await self._call(Database.del_users, list(user_ids))
+
+    async def count_users(self) -> int:
+        return await self._call(Database.count_users)
+
+
+def _set_result(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exc: Exception):
+    if not future.done():
+        future.set_exception(exc)
+    else:
+        logging.error(f"database call failed after its caller went away: {exc}")
@@ -1,4 +1,4 @@
-import asyncio
+import html
 from datetime import timedelta
 import logging
 
@@ -8,12 +8,13 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, C
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.filters import Command
 
-from scripts.bot import dp, db, bot
+from scripts.bot import dp, bot, mailings
 
 from data.config import ADMIN_TELEGRAM_ID
-from scripts import keyboards
-from scripts.states import Broadcast, BroadcastAbort, StarsRefund
-from scripts.message_handlers import broadcast_message
+from scripts import keyboards, cache, schedule_api, broadcasts
+from scripts.mailing_store import METRICS_MAILING, METRICS_BROADCAST, METRICS_SCHEDULE_CHANGES
+from scripts.states import Broadcast, StarsRefund
+from scripts.utils import NumCallback, open_groups_file, generate_kb_nums
 
 
 @dp.message(F.from_user.id == ADMIN_TELEGRAM_ID, Command('admin'))
@@ -49,49 +50,152 @@ async def confirm_broadcast_message(msg: types.Message, state: FSMContext):
 
 
 @dp.callback_query(F.from_user.id == ADMIN_TELEGRAM_ID, Broadcast.MessageType)
-async def send_broadcast_message(call: CallbackQuery, state: FSMContext):
+async def choose_broadcast_target(call: CallbackQuery, state: FSMContext):
     await call.answer()
-    
+    await state.update_data(message_type=call.data)
+
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text='Всем', callback_data=broadcasts.TARGET_ALL))
+    builder.add(InlineKeyboardButton(text='Подписчикам рассылки', callback_data=broadcasts.TARGET_SUBSCRIBERS))
+    builder.row(InlineKeyboardButton(text='Факультету', callback_data=broadcasts.TARGET_FACULTY))
+    builder.add(InlineKeyboardButton(text='Группе', callback_data=broadcasts.TARGET_GROUP))
+    builder.row(keyboards.inline_bt_cancel)
+
+    await call.message.edit_text("Кому отправить сообщение?", reply_markup=builder.as_markup())
+    await state.set_state(Broadcast.Target)
+
+
+@dp.callback_query(F.from_user.id == ADMIN_TELEGRAM_ID, Broadcast.Target)
+async def set_broadcast_target(call: CallbackQuery, state: FSMContext):
+    await call.answer()
+
+    if call.data == broadcasts.TARGET_FACULTY:
+        faculties = await open_groups_file()
+        await state.update_data(faculties=list(faculties.keys()))
+        msg_text, inline_kb_numbers = await generate_kb_nums(faculties)
+        await call.message.edit_text(f"Выберите факультет:\n\n{msg_text}", reply_markup=inline_kb_numbers)
+        await state.set_state(Broadcast.Faculty)
+    elif call.data == broadcasts.TARGET_GROUP:
+        await call.message.edit_text("Пришлите ID группы.",
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[keyboards.inline_bt_cancel]]))
+        await state.set_state(Broadcast.Group)
+    elif call.data in (broadcasts.TARGET_ALL, broadcasts.TARGET_SUBSCRIBERS):
+        await start_broadcast(call.message, state, call.data)
+
+
+@dp.callback_query(F.from_user.id == ADMIN_TELEGRAM_ID, Broadcast.Faculty, NumCallback.filter())
+async def set_broadcast_faculty(call: CallbackQuery, callback_data: NumCallback, state: FSMContext):
+    await call.answer()
+    faculties = (await state.get_data())['faculties']
+    if not 1 <= callback_data.num <= len(faculties):
+        return
+    await start_broadcast(call.message, state, broadcasts.TARGET_FACULTY, faculties[callback_data.num - 1])
+
+
+@dp.message(F.from_user.id == ADMIN_TELEGRAM_ID, Broadcast.Group)
+async def set_broadcast_group(msg: Message, state: FSMContext):
+    if not (msg.text or "").strip().isdigit():
+        await msg.answer("ID группы должен быть числом, попробуйте еще раз.")
+        return
+    progress_message = await msg.answer("Готовлю рассылку...")
+    await start_broadcast(progress_message, state, broadcasts.TARGET_GROUP, msg.text.strip())
+
+
+async def start_broadcast(progress_message: Message, state: FSMContext, target: str, value: str | None = None):
     data = await state.get_data()
     msg = data['message']
-    msg_type = call.data
     await state.clear()
 
-    all_id = db.get_all_id()
-    all_id.remove((ADMIN_TELEGRAM_ID,))
-
-    max_counter = len(all_id)
-    update_interval = max(1, max_counter // 100)  # Update every 1% or at least every user if less than 100 users
-
-    await call.bot.send_message(ADMIN_TELEGRAM_ID, f"Это займет примерно {timedelta(seconds=max_counter * 0.5)}.")
-    await call.message.edit_text(f"Хорошо, отправляю {max_counter} сообщений...",
-                                    reply_markup=InlineKeyboardMarkup(
-                                        inline_keyboard=[[InlineKeyboardButton(
-                                            text="Отменить", callback_data="abort_broadcast")]]))
-
-    for msg_counter, user_id in enumerate(all_id, start=1):
-        # Check if the broadcast has been aborted
-        if await state.get_state() == BroadcastAbort.Abort:
-            text = f"🚫 Рассылка отменена. Отправлено {msg_counter - 1} из {max_counter}."
-            await call.message.edit_text(text)
-            break
-
-        await broadcast_message(user_id[0], msg, msg_type)
-        
-        if msg_counter % update_interval == 0 or msg_counter == max_counter:
-            progress = (msg_counter / max_counter) * 100
-            progress_bar = f"<code>[{'#' * (int(progress) // 5)}{'-' * (20 - (int(progress) // 5))}]</code>"
-            await call.message.edit_text(f"Отправлено {msg_counter} из {max_counter} ({progress:.2f}%) {progress_bar}",
-                                            reply_markup=InlineKeyboardMarkup(inline_keyboard=
-                                                [[InlineKeyboardButton(text="Отменить", callback_data="abort_broadcast")]]))
-        
-        await asyncio.sleep(.5)
-
-
-@dp.callback_query(F.from_user.id == ADMIN_TELEGRAM_ID, F.data == "abort_broadcast")
-async def abort_broadcast(call: CallbackQuery, state: FSMContext):
-    await state.set_state(BroadcastAbort.Abort)
-    await call.answer("Рассылка будет отменена.")
+    target_label = f"{target}:{value}" if value else target
+    job_id, recipients_count = await broadcasts.start_broadcast(
+        msg.chat.id, msg.message_id, data['message_type'], target_label, broadcasts.resolve_recipients(target, value),
+        progress_message.chat.id, progress_message.message_id)
+    if not recipients_count:
+        await progress_message.edit_text(f"Для выбранной аудитории ({html.escape(target_label)}) нет получателей.")
+        return
+
+    await bot.send_message(ADMIN_TELEGRAM_ID, f"Это займет примерно "
+                                              f"{timedelta(seconds=int(broadcasts.estimate_seconds(recipients_count)))}.")
+    await progress_message.edit_text(f"Хорошо, отправляю {recipients_count} сообщений...",
+                                     reply_markup=broadcasts.abort_markup(job_id))
+
+
+@dp.callback_query(F.from_user.id == ADMIN_TELEGRAM_ID, broadcasts.BroadcastAbortCallback.filter())
+async def abort_broadcast(call: CallbackQuery, callback_data: broadcasts.BroadcastAbortCallback):
+    if await broadcasts.abort_broadcast(callback_data.job_id):
+        await call.answer("Рассылка будет отменена.")
+    else:
+        await call.answer("Рассылка уже завершена.")
+
+
+@dp.message(F.from_user.id == ADMIN_TELEGRAM_ID, F.text == keyboards.bt_admin_status.text)
+async def show_status(msg: Message):
+    cache_status = cache.get_status()
+
+    state_labels = {
+        cache.CACHE_STATE_CONNECTED: "✅ подключен",
+        cache.CACHE_STATE_DOWN: "❌ недоступен, бот работает без кеша",
+        cache.CACHE_STATE_DISABLED: "⚪ не настроен (REDIS_URL)",
+    }
+    info_lines = ["📊 <b>Состояние</b>",
+                  f"Кеш Redis: <b>{state_labels[cache_status['state']]}</b>"]
+    if cache_status['down_since']:
+        info_lines.append(f"Недоступен с: {cache_status['down_since']:%d.%m.%Y %H:%M:%S} UTC")
+    if cache_status['next_probe_in'] is not None:
+        info_lines.append(f"Следующая проверка через: {cache_status['next_probe_in']:.0f} сек.")
+    if cache_status['last_error']:
+        info_lines.append(f"Последняя ошибка: <code>{html.escape(cache_status['last_error'])}</code>")
+    info_lines.append(f"Проверок: {cache_status['probes']}, сбоев: {cache_status['failures']}, "
+                      f"переподключений: {cache_status['reconnects']}")
+
+    circuit_labels = {
+        "closed": "✅",
+        "half_open": "🟡",
+        "open": "❌",
+    }
+    circuits = schedule_api.get_circuit_status()
+    if circuits:
+        info_lines.append("\nAPI расписания:")
+    for circuit in circuits:
+        line = (f"{circuit_labels[circuit['state']]} <code>{circuit['name']}</code>: "
+                f"успешно {circuit['successes']}, ошибок {circuit['failures']}, "
+                f"отклонено {circuit['rejected']}, размыканий {circuit['opened']}")
+        if circuit['retry_in'] is not None:
+            line += f" (повтор через {circuit['retry_in']:.0f} сек.)"
+        info_lines.append(line)
+
+    latest_run_id = await mailings.get_latest_run_id()
+    if latest_run_id:
+        run = await mailings.get_run_status(latest_run_id)
+        run_labels = {
+            "running": "⏳ идет",
+            "done": "✅ завершена",
+            "expired": "⚪ не возобновлена",
+        }
+        info_lines.append(f"\nПоследняя рассылка <code>{run['run_id']}</code>: {run_labels[run['status']]}")
+        info_lines.append(f"Отправлено {run['sent']} из {run['total']}, ошибок {run['failed']}, "
+                          f"в очереди {run['pending']}")
+
+    metrics_labels = {
+        METRICS_MAILING: "Рассылка расписания",
+        METRICS_BROADCAST: "Рассылка админа",
+        METRICS_SCHEDULE_CHANGES: "Уведомления об изменениях",
+    }
+    for kind, label in metrics_labels.items():
+        metrics = await mailings.get_run_metrics(kind, limit=1)
+        if not metrics:
+            continue
+        run = metrics[0]
+        info_lines.append(f"\n{label} <code>{run['run_id']}</code>, {run['started_at']} UTC:")
+        info_lines.append(f"доставлено {run['delivered']}, ошибок {run['failed']} за {run['duration']:.0f} сек. "
+                          f"({run['throughput']:.1f} сообщ./сек.)")
+        info_lines.append(f"загрузка расписаний {run['fetch_seconds']:.1f} сек., Telegram {run['api_seconds']:.1f} сек., "
+                          f"ожидание лимита {run['throttle_seconds']:.1f} сек.")
+        info_lines.append(f"retry-after {run['retry_after_count']} раз ({run['retry_after_seconds']:.0f} сек.), "
+                          f"forbidden {run['forbidden']}, not found {run['not_found']}, "
+                          f"bad request {run['bad_request']}, прочих {run['other_errors']}")
+
+    await msg.answer("\n".join(info_lines))
 
 
 @dp.message(F.from_user.id == ADMIN_TELEGRAM_ID, F.text == keyboards.bt_admin_refund.text)
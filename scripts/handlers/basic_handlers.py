@@ -61,7 +61,7 @@ async def send_specific_date_schedule(msg: types.Message, command: CommandObject
         logging.info(f"user validation failed - id: {msg.from_user.id}, username: @{msg.from_user.username}")
         return
 
-    group_id, sub_group = db.get_user(msg.from_user.id)
+    group_id, sub_group = await db.get_user(msg.from_user.id)
 
     args: str = command.args if command else msg.text
     if not args:
@@ -83,7 +83,7 @@ async def send_specific_date_schedule(msg: types.Message, command: CommandObject
         await msg.answer(f"Прости, но я не поддерживаю больше, чем 4 даты/периода за один запрос.")
         return
 
-    current_year = today_for_group(group_id).year
+    current_year = (await today_for_group(group_id)).year
     dates_formatted = []
     dates_range_formatted = []
     for date in dates:
@@ -137,9 +137,9 @@ async def send_today_schedule(msg: types.Message):
     if not await validate_user(msg.from_user.id):
         logging.info(f"user validation failed - id: {msg.from_user.id}, username: @{msg.from_user.username}")
         return
-    group_id, sub_group = db.get_user(msg.from_user.id)
+    group_id, sub_group = await db.get_user(msg.from_user.id)
 
-    today = today_for_group(group_id)
+    today = await today_for_group(group_id)
 
     logging.info(f"attempted send today schedule - id: {msg.from_user.id}, username: @{msg.from_user.username}")
 
@@ -154,9 +154,9 @@ async def send_tomorrow_schedule(msg: types.Message):
     if not await validate_user(msg.from_user.id):
         logging.info(f"user validation failed - id: {msg.from_user.id}, username: @{msg.from_user.username}")
         return
-    group_id, sub_group = db.get_user(msg.from_user.id)
+    group_id, sub_group = await db.get_user(msg.from_user.id)
 
-    tomorrow = today_for_group(group_id) + timedelta(days=1)
+    tomorrow = await today_for_group(group_id) + timedelta(days=1)
 
     logging.info(f"attempted send tomorrow schedule - id: {msg.from_user.id}, username: @{msg.from_user.username}")
 
@@ -171,9 +171,9 @@ async def send_curr_week_schedule(msg: types.Message):
     if not await validate_user(msg.from_user.id):
         logging.info(f"user validation failed - id: {msg.from_user.id}, username: @{msg.from_user.username}")
         return
-    group_id, sub_group = db.get_user(msg.from_user.id)
+    group_id, sub_group = await db.get_user(msg.from_user.id)
 
-    today = today_for_group(group_id)
+    today = await today_for_group(group_id)
 
     week_first = today - timedelta(days=today.weekday())
     week_last = week_first + timedelta(days=6)
@@ -192,9 +192,9 @@ async def send_next_week_schedule(msg: types.Message):
     if not await validate_user(msg.from_user.id):
         logging.info(f"user validation failed - id: {msg.from_user.id}, username: @{msg.from_user.username}")
         return
-    group_id, sub_group = db.get_user(msg.from_user.id)
+    group_id, sub_group = await db.get_user(msg.from_user.id)
 
-    today = today_for_group(group_id)
+    today = await today_for_group(group_id)
 
     week_first = today - timedelta(days=today.weekday()) + timedelta(days=7)
     week_last = week_first + timedelta(days=6)
@@ -1,4 +1,5 @@
 import logging
+from collections.abc import Mapping
 
 from aiogram import types, F
 from aiogram.fsm.context import FSMContext
@@ -8,6 +9,7 @@ from scripts.handlers import basic_handlers
 from scripts import states
 from scripts.utils import *
 from scripts import keyboards
+from scripts.message_handlers import reschedule_mailing
 
 
 @dp.callback_query(F.data == 'cancel')
@@ -22,14 +24,13 @@ async def cancel_process_cb(call: types.CallbackQuery, state: FSMContext):
 async def settings(msg: types.Message):
     group_label = None
     sub_group_label = None
-    mailing_time = db.get_mailing_time(msg.from_user.id)
+    mailing_time = await db.get_mailing_time(msg.from_user.id)
 
-    user_data = db.get_user(msg.from_user.id)
+    user_data = await db.get_user(msg.from_user.id)
     if user_data:
         group_id, sub_group_id = user_data
         try:
-            groups = await open_groups_file()
-            group_label, sub_group_label = find_group_info(groups, group_id, sub_group_id)
+            group_label, sub_group_label = await find_group_info(group_id, sub_group_id)
         except Exception:
             group_label = str(group_id)
         if not group_label and group_id is not None:
@@ -46,7 +47,8 @@ async def settings(msg: types.Message):
         info_lines.append("Группа: <b>не настроена</b>")
 
     if mailing_time:
-        info_lines.append(f"Рассылка: <b>включена</b> ({mailing_time} по МСК)")
+        period = "на сегодня" if mailing_period(mailing_time) == "today" else "на завтра"
+        info_lines.append(f"Рассылка: <b>включена</b> ({mailing_time} по местному времени, {period})")
     else:
         info_lines.append("Рассылка: <b>выключена</b>")
 
@@ -66,28 +68,35 @@ async def configure_mailing(msg: types.Message, state: FSMContext):
 
     logging.info(f"attempted configure mailing - id: {msg.from_user.id}, username: @{msg.from_user.username}")
 
-    if db.get_mailing_time(msg.from_user.id):
+    if await db.get_mailing_time(msg.from_user.id):
         await cancel_mailing(msg, state)
         return
 
     await msg.answer("🔔 Хочешь подписаться на <b>рассылку</b> расписания?\n\n"
-                     "Каждый день бот будет начинать рассылать <b>расписание на завтрашний день в 18:00 по МСК</b>.\n"
-                     "Рассылка может занять некоторое время, обычно около получаса. "
+                     "Выбери, во сколько присылать расписание. Время указано <b>местное для твоего факультета</b>: "
+                     "утром придет расписание на сегодня, вечером - на завтра.\n"
                      "Ты в любой момент сможешь как отписаться, так и подписаться снова.",
-                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[[keyboards.inline_bt_confirm], [keyboards.inline_bt_cancel]]))
+                     reply_markup=await generate_kb_mailing_times())
     await state.set_state(states.Mailing.Subscribe)
 
 
-@dp.callback_query(states.Mailing.Subscribe)
-async def set_mailing(call: types.CallbackQuery, state: FSMContext):
-    db.set_mailing_time(call.from_user.id, '18:00')
+@dp.callback_query(states.Mailing.Subscribe, MailingTimeCallback.filter())
+async def set_mailing(call: types.CallbackQuery, callback_data: MailingTimeCallback, state: FSMContext):
+    if not 0 <= callback_data.slot < len(MAILING_TIMES):
+        await call.answer()
+        return
+    mailing_time = MAILING_TIMES[callback_data.slot]
+    await db.set_mailing_time(call.from_user.id, mailing_time)
+    reschedule_mailing()
     await state.clear()
     await call.answer()
 
-    logging.info(f"subscribed to mailing - id: {call.from_user.id}, username: @{call.from_user.username}")
+    logging.info(f"subscribed to mailing at {mailing_time} - id: {call.from_user.id}, "
+                 f"username: @{call.from_user.username}")
 
+    period = "на сегодня" if mailing_period(mailing_time) == "today" else "на завтра"
     await call.message.edit_text(
-        "🤖 Хорошо, в следующий раз, когда буду рассылать расписание (18:00 по МСК), обязательно напишу и тебе!")
+        f"🤖 Хорошо, каждый день в {mailing_time} по местному времени буду присылать тебе расписание {period}!")
 
 
 async def cancel_mailing(msg: types.Message, state: FSMContext):
@@ -101,14 +110,15 @@ async def cancel_mailing(msg: types.Message, state: FSMContext):
 
 
 async def stop_mailing(call: types.CallbackQuery, state: FSMContext):
-    db.del_mailing_time(call.from_user.id)
+    await db.del_mailing_time(call.from_user.id)
+    reschedule_mailing()
     await state.clear()
     await call.answer()
 
     logging.info(f"unsubscribed from mailing - id: {call.from_user.id}, username: @{call.from_user.username}")
 
     await call.message.edit_text(
-        "🤖 Хорошо, больше не буду автоматически присылать тебе расписание на завтра.")
+        "🤖 Хорошо, больше не буду автоматически присылать тебе расписание.")
 
 
 @dp.callback_query(states.Mailing.Unsubscribe)
@@ -248,9 +258,9 @@ async def set_group(call: CallbackQuery, callback_data: NumCallback, state: FSMC
     group_name = list(groups[faculty_name][form_name][step_name][course_name].keys())[callback_data.num - 1]
     group_meta = groups[faculty_name][form_name][step_name][course_name][group_name]
     sub_groups = []
-    if isinstance(group_meta, dict):
+    if isinstance(group_meta, Mapping):
         group_id = group_meta.get("id")
-        sub_groups = group_meta.get("sub_groups") or []
+        sub_groups = [dict(sub_group) for sub_group in group_meta.get("sub_groups") or []]
     else:
         group_id = group_meta
     await state.update_data(group_id=group_id, sub_groups=sub_groups)
@@ -269,7 +279,7 @@ async def set_group(call: CallbackQuery, callback_data: NumCallback, state: FSMC
         await state.set_state(states.UserData.SubGroup)
         return
 
-    db.add_user(call.from_user.id, group_id, 0)
+    await db.add_user(call.from_user.id, group_id, 0)
 
     await call.message.edit_text("<b>Хорошо, все готово!</b>\n"
                                  "Теперь можешь использовать кнопки, чтобы смотреть расписание!")
@@ -311,7 +321,7 @@ async def set_subgroup(call: CallbackQuery, callback_data: NumCallback, state: F
             return
         sub_group_id = sub_group
 
-    db.add_user(call.from_user.id, group_id, sub_group_id)
+    await db.add_user(call.from_user.id, group_id, sub_group_id)
 
     await call.message.edit_text("<b>Хорошо, все готово!</b>\n"
                                  "Теперь можешь использовать кнопки, чтобы смотреть расписание!")
@@ -36,6 +36,8 @@ inline_kb_donate = InlineKeyboardMarkup(inline_keyboard=[[inline_bt_donate, inli
 
 bt_admin_broadcast = KeyboardButton(text='✉ Отправить сообщение всем')
 bt_admin_refund = KeyboardButton(text='⭐ Возврат звездочек')
+bt_admin_status = KeyboardButton(text='📊 Состояние')
 bt_admin_return = KeyboardButton(text='◀ Вернуть клавиатуру пользователя')
 
-kb_admin = ReplyKeyboardMarkup(keyboard=[[bt_admin_broadcast, bt_admin_refund], [bt_admin_return]], resize_keyboard=True)
+kb_admin = ReplyKeyboardMarkup(keyboard=[[bt_admin_broadcast, bt_admin_refund], [bt_admin_status], [bt_admin_return]],
+                               resize_keyboard=True)
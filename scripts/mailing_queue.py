@@ -0,0 +1,327 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import datetime
+from functools import partial
+from typing import Awaitable, Callable
+
+from aiogram import exceptions
+
+from scripts import cache, sender
+from scripts.mailing_store import group_recipient_pages
+
+QUEUE_KEY = "mailing:queue"
+PROCESSING_KEY = "mailing:processing"
+LEASE_PREFIX = "mailing:lease"
+RUN_PREFIX = "mailing:run"
+RATE_WINDOW_PREFIX = "mailing:rate"
+RATE_PAUSE_KEY = "mailing:rate:paused_until"
+
+SHARD_SIZE = 50
+# A requeued item skips recipients with a recorded result, so at most this many are sent twice after a crash.
+RESULT_FLUSH_SIZE = 10
+LEASE_TTL = 60
+LEASE_RENEW_INTERVAL = 20
+# Must stay below the Redis socket timeout, otherwise an idle blocking claim looks like a dead connection.
+CLAIM_TIMEOUT = 1
+ITEM_MAX_ATTEMPTS = 3
+COORDINATOR_POLL_INTERVAL = 2
+# If no worker claims any of the run's queued items for this long, the coordinator takes them back.
+UNCLAIMED_TIMEOUT = 60
+RUN_KEYS_TTL = 2 * 24 * 60 * 60
+RATE_WINDOW = 0.2
+REDIS_RETRY_DELAY = 5
+
+RESULT_SENT = "sent"
+RESULT_FAILED = "failed"
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_STATS_INT_FIELDS = ("delivered", "failed", "retry_after_count")
+_STATS_FLOAT_FIELDS = ("send_seconds", "throttle_seconds", "fetch_seconds", "retry_after_total")
+
+Renderer = Callable[[int, int, str, datetime | None], Awaitable]
+Deliverer = Callable[..., Awaitable]
+
+
+def _run_key(run_id: str, suffix: str) -> str:
+    return f"{RUN_PREFIX}:{run_id}:{suffix}"
+
+
+class SharedRateLimiter(sender.RateLimiter):
+    # The global budget is counted in short Redis windows shared by every worker. The per-chat spacing stays
+    # local: all messages to one chat are sent by the worker that claimed its shard.
+    def __init__(self, rate: float = sender.MAILING_RATE_LIMIT):
+        super().__init__(rate)
+        self.window_budget = max(1, int(rate * RATE_WINDOW))
+        self._pause_tasks: set[asyncio.Task] = set()
+
+    async def acquire(self, chat_id: int) -> None:
+        while True:
+            redis_client = await cache.get_redis()
+            if not redis_client:
+                return await super().acquire(chat_id)
+
+            now = time.time()
+            try:
+                paused_until = float(await redis_client.get(RATE_PAUSE_KEY) or 0)
+                chat_wait = self.chat_slots.get(chat_id, 0.0) - time.monotonic()
+                if paused_until > now or chat_wait > 0:
+                    await asyncio.sleep(max(paused_until - now, chat_wait))
+                    continue
+
+                window = int(now / RATE_WINDOW)
+                window_key = f"{RATE_WINDOW_PREFIX}:{window}"
+                used = await redis_client.incr(window_key)
+                if used == 1:
+                    await redis_client.expire(window_key, 5)
+            except Exception as exc:
+                cache.handle_error(exc)
+                logging.warning("Shared rate limiter is unavailable, using the local one: %s", exc)
+                return await super().acquire(chat_id)
+
+            if used <= self.window_budget:
+                self.chat_slots[chat_id] = time.monotonic() + self.per_chat_interval
+                self._prune_chat_slots(time.monotonic())
+                return
+            await asyncio.sleep((window + 1) * RATE_WINDOW - now)
+
+    async def _publish_pause(self, seconds: float) -> None:
+        redis_client = await cache.get_redis()
+        if not redis_client:
+            return
+        try:
+            await redis_client.set(RATE_PAUSE_KEY, time.time() + seconds, ex=int(seconds) + 1)
+        except Exception as exc:
+            cache.handle_error(exc)
+
+    def pause(self, seconds: float) -> None:
+        super().pause(seconds)
+        task = asyncio.create_task(self._publish_pause(seconds))
+        self._pause_tasks.add(task)
+        task.add_done_callback(self._pause_tasks.discard)
+
+
+async def _reap_expired_items(redis_client, suspects: set[str]) -> set[str]:
+    # An item without a lease is only requeued if it was already missing one on the previous poll, which covers
+    # the short gap between a worker claiming an item and setting its lease.
+    missing = set()
+    for raw in await redis_client.lrange(PROCESSING_KEY, 0, -1):
+        item = json.loads(raw)
+        if await redis_client.exists(f"{LEASE_PREFIX}:{item['id']}"):
+            continue
+        if raw not in suspects:
+            missing.add(raw)
+            continue
+        if not await redis_client.lrem(PROCESSING_KEY, 1, raw):
+            continue
+        item["attempts"] = item.get("attempts", 0) + 1
+        if item["attempts"] >= ITEM_MAX_ATTEMPTS:
+            logging.error(f"mailing item {item['id']} of run {item['run_id']} failed {item['attempts']} times, "
+                          f"dropping it")
+            await redis_client.hset(_run_key(item["run_id"], "results"),
+                                    mapping={user_id: f"{RESULT_FAILED}:{sender.ERROR_OTHER}"
+                                             for user_id in item["user_ids"]})
+            await redis_client.decr(_run_key(item["run_id"], "remaining"))
+        else:
+            logging.warning(f"requeueing mailing item {item['id']} of run {item['run_id']}")
+            await redis_client.rpush(QUEUE_KEY, json.dumps(item))
+    return missing
+
+
+async def _take_back_queued_items(redis_client, run_id: str) -> int:
+    taken = 0
+    for raw in await redis_client.lrange(QUEUE_KEY, 0, -1):
+        # A worker may claim the item right now, then it is its to finish.
+        if json.loads(raw)["run_id"] == run_id and await redis_client.lrem(QUEUE_KEY, 1, raw):
+            taken += 1
+    if taken:
+        await redis_client.decrby(_run_key(run_id, "remaining"), taken)
+    return taken
+
+
+async def _count_queued_items(redis_client, run_id: str) -> int:
+    return sum(json.loads(raw)["run_id"] == run_id for raw in await redis_client.lrange(QUEUE_KEY, 0, -1))
+
+
+async def distribute_run(run_id: str, message_type: str, recipient_pages, slot: datetime | None = None):
+    # Recipients whose items were taken back from the queue are missing from the results and stay pending.
+    redis_client = await cache.get_redis()
+    if not redis_client:
+        return None
+
+    report = sender.SendReport()
+    remaining_key = _run_key(run_id, "remaining")
+    try:
+        # A resumed coordinator keeps waiting for the items it already queued instead of queueing them again.
+        if not await redis_client.exists(remaining_key):
+            items = []
+            users_count = 0
+            async for (group_id, sub_group), user_ids in group_recipient_pages(recipient_pages):
+                users_count += len(user_ids)
+                for start in range(0, len(user_ids), SHARD_SIZE):
+                    items.append(json.dumps({
+                        "id": uuid.uuid4().hex,
+                        "run_id": run_id,
+                        "message_type": message_type,
+                        "slot": slot.isoformat() if slot else None,
+                        "group_id": group_id,
+                        "sub_group": sub_group,
+                        "user_ids": user_ids[start:start + SHARD_SIZE],
+                    }))
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(remaining_key, len(items), ex=RUN_KEYS_TTL)
+                if items:
+                    pipe.rpush(QUEUE_KEY, *items)
+                await pipe.execute()
+            logging.info(f"mailing run {run_id}: queued {len(items)} items for {users_count} users")
+    except Exception as exc:
+        cache.handle_error(exc)
+        logging.warning(f"failed to queue mailing run {run_id}: {exc}")
+        return None
+
+    suspects: set[str] = set()
+    progress = None
+    progress_at = time.monotonic()
+    while True:
+        redis_client = await cache.get_redis()
+        if not redis_client:
+            await asyncio.sleep(REDIS_RETRY_DELAY)
+            continue
+        try:
+            remaining = int(await redis_client.get(remaining_key) or 0)
+            if remaining <= 0:
+                results = await redis_client.hgetall(_run_key(run_id, "results"))
+                stats = await redis_client.hgetall(_run_key(run_id, "stats"))
+                break
+            suspects = await _reap_expired_items(redis_client, suspects)
+            queued = await _count_queued_items(redis_client, run_id)
+            if (remaining, queued) != progress:
+                progress, progress_at = (remaining, queued), time.monotonic()
+            elif queued and time.monotonic() - progress_at > UNCLAIMED_TIMEOUT:
+                taken = await _take_back_queued_items(redis_client, run_id)
+                logging.warning(f"mailing run {run_id}: no worker claimed an item for {UNCLAIMED_TIMEOUT}s, "
+                                f"took back {taken} items")
+                continue
+        except Exception as exc:
+            cache.handle_error(exc)
+            logging.warning(f"failed to check mailing run {run_id}: {exc}")
+        await asyncio.sleep(COORDINATOR_POLL_INTERVAL)
+
+    for field in _STATS_INT_FIELDS:
+        setattr(report, field, int(stats.get(field, 0)))
+    for field in _STATS_FLOAT_FIELDS:
+        setattr(report, field, float(stats.get(field, 0)))
+    for field, value in stats.items():
+        if field.startswith("error:"):
+            report.errors[field.removeprefix("error:")] = int(value)
+    report.finish()
+    return {int(user_id): result for user_id, result in results.items()}, report
+
+
+async def _renew_lease(redis_client, lease_key: str):
+    while True:
+        await asyncio.sleep(LEASE_RENEW_INTERVAL)
+        try:
+            await redis_client.expire(lease_key, LEASE_TTL)
+        except Exception as exc:
+            cache.handle_error(exc)
+
+
+async def _write_results(redis_client, results_key: str, results: dict):
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(results_key, mapping=results)
+        pipe.expire(results_key, RUN_KEYS_TTL)
+        await pipe.execute()
+
+
+async def _process_item(redis_client, raw: str, limiter: SharedRateLimiter, render: Renderer, deliver: Deliverer):
+    item = json.loads(raw)
+    run_id = item["run_id"]
+    results_key = _run_key(run_id, "results")
+    lease_key = f"{LEASE_PREFIX}:{item['id']}"
+    await redis_client.set(lease_key, WORKER_ID, ex=LEASE_TTL)
+    renewer = asyncio.create_task(_renew_lease(redis_client, lease_key))
+    try:
+        # Users already recorded for this run were handled by an earlier attempt of the same item.
+        done = set(await redis_client.hkeys(results_key))
+        user_ids = [user_id for user_id in item["user_ids"] if str(user_id) not in done]
+
+        started = time.monotonic()
+        slot = datetime.fromisoformat(item["slot"]) if item.get("slot") else None
+        rendered = await render(item["group_id"], item["sub_group"], item["message_type"], slot)
+        fetch_seconds = time.monotonic() - started
+
+        results = {}
+        writes = []
+        error_kinds = {}
+
+        async def record_error(user_id: int, e: exceptions.TelegramAPIError):
+            # User cleanup happens on the coordinator, which owns the users database.
+            error_kinds[user_id] = sender.classify_error(e)
+            logging.error(f"target id:{user_id} - {error_kinds[user_id]}")
+
+        def record_result(user_id: int, delivered: bool):
+            nonlocal results
+            results[user_id] = RESULT_SENT if delivered else \
+                f"{RESULT_FAILED}:{error_kinds.get(user_id, sender.ERROR_OTHER)}"
+            if len(results) >= RESULT_FLUSH_SIZE:
+                writes.append(asyncio.create_task(_write_results(redis_client, results_key, results)))
+                results = {}
+
+        async def deliveries():
+            for user_id in user_ids:
+                yield user_id, partial(deliver, user_id, rendered)
+
+        report = await sender.send_all(deliveries(), record_error, limiter=limiter, on_result=record_result)
+        # A failed write fails the item, which is requeued with the results written so far kept.
+        await asyncio.gather(*writes)
+        report.fetch_seconds = fetch_seconds
+
+        stats_key = _run_key(run_id, "stats")
+        async with redis_client.pipeline(transaction=True) as pipe:
+            if results:
+                pipe.hset(results_key, mapping=results)
+            for field in _STATS_INT_FIELDS:
+                pipe.hincrby(stats_key, field, getattr(report, field))
+            for field in _STATS_FLOAT_FIELDS:
+                pipe.hincrbyfloat(stats_key, field, getattr(report, field))
+            for kind, count in report.errors.items():
+                pipe.hincrby(stats_key, f"error:{kind}", count)
+            pipe.expire(results_key, RUN_KEYS_TTL)
+            pipe.expire(stats_key, RUN_KEYS_TTL)
+            pipe.lrem(PROCESSING_KEY, 1, raw)
+            pipe.decr(_run_key(run_id, "remaining"))
+            pipe.delete(lease_key)
+            await pipe.execute()
+        logging.info(f"mailing item {item['id']} of run {run_id} done: {report.summary()}")
+    finally:
+        renewer.cancel()
+
+
+async def run_mailing_worker(render: Renderer, deliver: Deliverer):
+    limiter = SharedRateLimiter()
+    logging.info(f"mailing worker {WORKER_ID} started")
+    while True:
+        redis_client = await cache.get_redis()
+        if not redis_client:
+            await asyncio.sleep(REDIS_RETRY_DELAY)
+            continue
+        try:
+            raw = await redis_client.blmove(QUEUE_KEY, PROCESSING_KEY, CLAIM_TIMEOUT, "LEFT", "RIGHT")
+        except Exception as exc:
+            cache.handle_error(exc)
+            logging.warning(f"failed to claim a mailing item: {exc}")
+            await asyncio.sleep(1)
+            continue
+        if raw is None:
+            continue
+        try:
+            await _process_item(redis_client, raw, limiter, render, deliver)
+        except Exception:
+            # The lease expires and the coordinator requeues the item.
+            logging.exception("failed to process mailing item")
@@ -0,0 +1,552 @@
+import abc
+import asyncio
+import json
+import logging
+from datetime import date, datetime, timezone
+
+from aiogram import exceptions
+
+from scripts import sender
+from scripts.database import DatabaseThread, SqliteStore
+
+RUN_RUNNING = 'running'
+RUN_DONE = 'done'
+RUN_EXPIRED = 'expired'
+
+RECIPIENT_PENDING = 'pending'
+RECIPIENT_SENT = 'sent'
+RECIPIENT_FAILED = 'failed'
+
+BROADCAST_PREPARING = 'preparing'
+BROADCAST_RUNNING = 'running'
+BROADCAST_DONE = 'done'
+BROADCAST_ABORTED = 'aborted'
+BROADCAST_FAILED = 'failed'
+
+METRICS_MAILING = 'mailing'
+METRICS_BROADCAST = 'broadcast'
+METRICS_SCHEDULE_CHANGES = 'schedule_changes'
+METRICS_HISTORY_LIMIT = 500
+RECIPIENTS_PAGE_SIZE = 1000
+
+OUTCOME_SENT = 'sent'
+
+_METRICS_FIELDS = ("kind", "run_id", "started_at", "finished_at", "duration", "delivered", "failed", "throughput",
+                   "fetch_seconds", "send_seconds", "api_seconds", "throttle_seconds", "retry_after_count",
+                   "retry_after_seconds", "forbidden", "not_found", "bad_request", "other_errors", "details")
+
+
+def _utc_now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+class MailingStore(SqliteStore):
+    def __init__(self, path, check_same_thread: bool = True):
+        super().__init__(path, check_same_thread)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.transaction():
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS mailing_runs
+                                       (run_id       TEXT    PRIMARY KEY,
+                                        message_type TEXT    NOT NULL,
+                                        slot         TEXT    NOT NULL,
+                                        status       TEXT    NOT NULL,
+                                        created_at   TEXT    NOT NULL,
+                                        finished_at  TEXT    DEFAULT NULL);""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS mailing_recipients
+                                       (run_id     TEXT    NOT NULL,
+                                        user_id    BIGINT  NOT NULL,
+                                        group_id   INTEGER NOT NULL,
+                                        sub_group  INTEGER NOT NULL DEFAULT (0),
+                                        mailing    TEXT    DEFAULT NULL,
+                                        status     TEXT    NOT NULL,
+                                        updated_at TEXT    NOT NULL,
+                                        PRIMARY KEY (run_id, user_id));""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS mailing_recipients_status "
+                                    "ON mailing_recipients (run_id, status)")
+            # Broadcast recipients have no mailing time, and a row value with NULL never compares greater, so the
+            # keyset is over COALESCE(mailing, ''). The index on the raw column is replaced by one on the keyset.
+            self.connection.execute("DROP INDEX IF EXISTS mailing_recipients_order")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS mailing_recipients_keyset ON mailing_recipients "
+                                    "(run_id, group_id, sub_group, COALESCE(mailing, ''), user_id)")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS schedule_snapshots
+                                       (group_id   INTEGER NOT NULL,
+                                        sub_group  INTEGER NOT NULL DEFAULT (0),
+                                        week_start TEXT    NOT NULL,
+                                        digest     TEXT    NOT NULL,
+                                        snapshot   TEXT    NOT NULL,
+                                        updated_at TEXT    NOT NULL,
+                                        PRIMARY KEY (group_id, sub_group, week_start));""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS broadcast_jobs
+                                       (job_id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        from_chat_id        BIGINT  NOT NULL,
+                                        message_id          INTEGER NOT NULL,
+                                        mode                TEXT    NOT NULL,
+                                        target              TEXT    NOT NULL,
+                                        status              TEXT    NOT NULL,
+                                        progress_chat_id    BIGINT  DEFAULT NULL,
+                                        progress_message_id INTEGER DEFAULT NULL,
+                                        created_at          TEXT    NOT NULL,
+                                        finished_at         TEXT    DEFAULT NULL);""")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS run_metrics
+                                       (id                  INTEGER PRIMARY KEY AUTOINCREMENT,
+                                        kind                TEXT    NOT NULL,
+                                        run_id              TEXT    NOT NULL,
+                                        started_at          TEXT    NOT NULL,
+                                        finished_at         TEXT    NOT NULL,
+                                        duration            REAL    NOT NULL,
+                                        delivered           INTEGER NOT NULL,
+                                        failed              INTEGER NOT NULL,
+                                        throughput          REAL    NOT NULL,
+                                        fetch_seconds       REAL    NOT NULL,
+                                        send_seconds        REAL    NOT NULL,
+                                        api_seconds         REAL    NOT NULL,
+                                        throttle_seconds    REAL    NOT NULL,
+                                        retry_after_count   INTEGER NOT NULL,
+                                        retry_after_seconds REAL    NOT NULL,
+                                        forbidden           INTEGER NOT NULL,
+                                        not_found           INTEGER NOT NULL,
+                                        bad_request         INTEGER NOT NULL,
+                                        other_errors        INTEGER NOT NULL,
+                                        details             TEXT    DEFAULT NULL);""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS run_metrics_kind ON run_metrics (kind, id)")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS delivery_outcomes
+                                       (user_id    BIGINT  PRIMARY KEY,
+                                        outcome    TEXT    NOT NULL,
+                                        streak     INTEGER NOT NULL,
+                                        updated_at TEXT    NOT NULL);""")
+
+    def _add_recipients(self, run_id: str, recipients, now: str):
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO mailing_recipients "
+            "(run_id, user_id, group_id, sub_group, mailing, status, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(run_id, user_id, group_id, sub_group, mailing, RECIPIENT_PENDING, now)
+             for user_id, group_id, sub_group, mailing in recipients]
+        )
+
+    def create_run(self, run_id: str, message_type: str, slot: datetime, subscribers):
+        # Re-creating an existing run keeps the recorded statuses, so a repeated call never re-sends.
+        now = _utc_now()
+        with self.transaction():
+            self.connection.execute(
+                "INSERT OR IGNORE INTO mailing_runs (run_id, message_type, slot, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (run_id, message_type, slot.isoformat(), RUN_RUNNING, now)
+            )
+            self._add_recipients(run_id, subscribers, now)
+
+    def get_pending_recipients_page(self, run_id: str, after: tuple | None, limit: int):
+        # Keyset pagination in mailing order. The cursor stays valid while earlier recipients are being marked as
+        # sent.
+        if after:
+            user_id, group_id, sub_group, mailing = after
+        else:
+            user_id, group_id, sub_group, mailing = -1, -1, -1, ""
+        with self.transaction():
+            recipients = self.connection.execute(
+                "SELECT user_id, group_id, sub_group, mailing FROM mailing_recipients "
+                "WHERE run_id = ? AND (group_id, sub_group, COALESCE(mailing, ''), user_id) > (?, ?, ?, ?) "
+                "AND status = ? "
+                "ORDER BY group_id, sub_group, COALESCE(mailing, ''), user_id LIMIT ?",
+                (run_id, group_id, sub_group, mailing or "", user_id, RECIPIENT_PENDING, limit)
+            ).fetchall()
+        return recipients
+
+    def mark_recipients(self, run_id: str, results):
+        now = _utc_now()
+        with self.transaction():
+            self.connection.executemany(
+                "UPDATE mailing_recipients SET status = ?, updated_at = ? WHERE run_id = ? AND user_id = ?",
+                [(status, now, run_id, user_id) for user_id, status in results]
+            )
+
+    def finish_run(self, run_id: str, status: str = RUN_DONE):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE mailing_runs SET status = ?, finished_at = ? WHERE run_id = ?",
+                (status, _utc_now(), run_id)
+            )
+
+    def get_unfinished_runs(self):
+        with self.transaction():
+            runs = self.connection.execute(
+                "SELECT run_id, message_type, slot FROM mailing_runs WHERE status = ? ORDER BY slot",
+                (RUN_RUNNING,)
+            ).fetchall()
+        return [(run_id, message_type, datetime.fromisoformat(slot)) for run_id, message_type, slot in runs]
+
+    def get_run_status(self, run_id: str):
+        with self.transaction():
+            run = self.connection.execute(
+                "SELECT run_id, message_type, slot, status, created_at, finished_at FROM mailing_runs "
+                "WHERE run_id = ?",
+                (run_id,)
+            ).fetchone()
+        if not run:
+            return None
+        return {
+            "run_id": run[0],
+            "message_type": run[1],
+            "slot": datetime.fromisoformat(run[2]),
+            "status": run[3],
+            "created_at": run[4],
+            "finished_at": run[5],
+            **self.get_recipient_counts(run_id),
+        }
+
+    def get_recipient_counts(self, run_id: str):
+        with self.transaction():
+            counts = dict(self.connection.execute(
+                "SELECT status, COUNT(*) FROM mailing_recipients WHERE run_id = ? GROUP BY status",
+                (run_id,)
+            ).fetchall())
+        return {
+            "total": sum(counts.values()),
+            RECIPIENT_PENDING: counts.get(RECIPIENT_PENDING, 0),
+            RECIPIENT_SENT: counts.get(RECIPIENT_SENT, 0),
+            RECIPIENT_FAILED: counts.get(RECIPIENT_FAILED, 0),
+        }
+
+    def get_latest_run_id(self):
+        with self.transaction():
+            run = self.connection.execute(
+                "SELECT run_id FROM mailing_runs ORDER BY created_at DESC, slot DESC LIMIT 1"
+            ).fetchone()
+        return run[0] if run else None
+
+    def get_schedule_snapshot(self, group_id: int, sub_group: int, week_start: date):
+        with self.transaction():
+            snapshot = self.connection.execute(
+                "SELECT snapshot FROM schedule_snapshots WHERE group_id = ? AND sub_group = ? AND week_start = ?",
+                (group_id, sub_group, week_start.isoformat())
+            ).fetchone()
+        return json.loads(snapshot[0]) if snapshot else None
+
+    def save_schedule_snapshot(self, group_id: int, sub_group: int, week_start: date, snapshot: dict):
+        with self.transaction():
+            self.connection.execute(
+                "INSERT INTO schedule_snapshots (group_id, sub_group, week_start, digest, snapshot, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (group_id, sub_group, week_start) DO UPDATE "
+                "SET digest = excluded.digest, snapshot = excluded.snapshot, updated_at = excluded.updated_at",
+                (group_id, sub_group, week_start.isoformat(), snapshot["digest"],
+                 json.dumps(snapshot, ensure_ascii=False), _utc_now())
+            )
+
+    def delete_schedule_snapshots_before(self, week_start: date):
+        with self.transaction():
+            self.connection.execute(
+                "DELETE FROM schedule_snapshots WHERE week_start < ?",
+                (week_start.isoformat(),)
+            )
+
+    def create_broadcast(self, from_chat_id: int, message_id: int, mode: str, target: str) -> int:
+        # Recipients are added page by page afterwards. Until start_broadcast the job is only being prepared, so a
+        # restart never resumes it with part of its audience.
+        with self.transaction():
+            job_id = self.connection.execute(
+                "INSERT INTO broadcast_jobs (from_chat_id, message_id, mode, target, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (from_chat_id, message_id, mode, target, BROADCAST_PREPARING, _utc_now())
+            ).lastrowid
+        return job_id
+
+    def add_broadcast_recipients(self, job_id: int, recipients):
+        with self.transaction():
+            self._add_recipients(broadcast_run_id(job_id), recipients, _utc_now())
+
+    def start_broadcast(self, job_id: int):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE broadcast_jobs SET status = ? WHERE job_id = ? AND status = ?",
+                (BROADCAST_RUNNING, job_id, BROADCAST_PREPARING)
+            )
+
+    def fail_unprepared_broadcasts(self):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE status = ?",
+                (BROADCAST_FAILED, _utc_now(), BROADCAST_PREPARING)
+            )
+
+    def set_broadcast_progress_message(self, job_id: int, chat_id: int, message_id: int):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE broadcast_jobs SET progress_chat_id = ?, progress_message_id = ? WHERE job_id = ?",
+                (chat_id, message_id, job_id)
+            )
+
+    def finish_broadcast(self, job_id: int, status: str):
+        with self.transaction():
+            self.connection.execute(
+                "UPDATE broadcast_jobs SET status = ?, finished_at = ? WHERE job_id = ?",
+                (status, _utc_now(), job_id)
+            )
+
+    def get_broadcast(self, job_id: int):
+        with self.transaction():
+            job = self.connection.execute(
+                "SELECT job_id, from_chat_id, message_id, mode, target, status, progress_chat_id, "
+                "progress_message_id FROM broadcast_jobs WHERE job_id = ?",
+                (job_id,)
+            ).fetchone()
+        if not job:
+            return None
+        return dict(zip(("job_id", "from_chat_id", "message_id", "mode", "target", "status",
+                         "progress_chat_id", "progress_message_id"), job))
+
+    def get_unfinished_broadcasts(self):
+        with self.transaction():
+            jobs = self.connection.execute(
+                "SELECT job_id FROM broadcast_jobs WHERE status = ? ORDER BY job_id",
+                (BROADCAST_RUNNING,)
+            ).fetchall()
+        return [job_id for job_id, in jobs]
+
+    def save_run_metrics(self, kind: str, run_id: str, report, details: dict | None = None):
+        errors = report.errors
+        known_errors = errors['forbidden'] + errors['not_found'] + errors['bad_request']
+        with self.transaction():
+            self.connection.execute(
+                f"INSERT INTO run_metrics ({', '.join(_METRICS_FIELDS)}) "
+                f"VALUES ({', '.join('?' * len(_METRICS_FIELDS))})",
+                (kind, run_id, report.started_at_utc.isoformat(timespec='seconds'), _utc_now(), report.duration,
+                 report.delivered, report.failed, report.throughput, report.fetch_seconds, report.send_seconds,
+                 report.api_seconds, report.throttle_seconds, report.retry_after_count, report.retry_after_total,
+                 errors['forbidden'], errors['not_found'], errors['bad_request'],
+                 sum(errors.values()) - known_errors, json.dumps(details or {}))
+            )
+            self.connection.execute(
+                "DELETE FROM run_metrics WHERE id <= (SELECT MAX(id) FROM run_metrics) - ?",
+                (METRICS_HISTORY_LIMIT,)
+            )
+
+    def get_run_metrics(self, kind: str | None = None, limit: int = 10):
+        query = f"SELECT {', '.join(_METRICS_FIELDS)} FROM run_metrics"
+        params = ()
+        if kind:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        with self.transaction():
+            rows = self.connection.execute(f"{query} ORDER BY id DESC LIMIT ?", (*params, limit)).fetchall()
+        metrics = [dict(zip(_METRICS_FIELDS, row)) for row in rows]
+        for item in metrics:
+            item["details"] = json.loads(item["details"] or "{}")
+        return metrics
+
+    def record_outcomes(self, outcomes):
+        # Only failures are kept: a successful delivery ends any streak, so its row is simply removed.
+        now = _utc_now()
+        with self.transaction():
+            self.connection.executemany(
+                "DELETE FROM delivery_outcomes WHERE user_id = ?",
+                [(user_id,) for user_id, outcome in outcomes if outcome == OUTCOME_SENT]
+            )
+            self.connection.executemany(
+                "INSERT INTO delivery_outcomes (user_id, outcome, streak, updated_at) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET "
+                "streak = CASE WHEN outcome = excluded.outcome THEN streak + 1 ELSE 1 END, "
+                "outcome = excluded.outcome, updated_at = excluded.updated_at",
+                [(user_id, outcome, now) for user_id, outcome in outcomes if outcome != OUTCOME_SENT]
+            )
+
+    def get_users_to_prune(self, rules: dict[str, int]):
+        if not rules:
+            return []
+        conditions = " OR ".join("(outcome = ? AND streak >= ?)" for _ in rules)
+        with self.transaction():
+            users = self.connection.execute(
+                f"SELECT user_id FROM delivery_outcomes WHERE {conditions}",
+                [value for rule in rules.items() for value in rule]
+            ).fetchall()
+        return [user_id for user_id, in users]
+
+    def delete_outcomes(self, user_ids):
+        with self.transaction():
+            self.connection.executemany(
+                "DELETE FROM delivery_outcomes WHERE user_id = ?",
+                [(user_id,) for user_id in user_ids]
+            )
+
+
+class AsyncMailingStore(DatabaseThread):
+    # The same methods as MailingStore, but awaitable. mark_recipients and record_outcomes return the queued write
+    # right away, so the send loop can go on without waiting for the commit.
+    def __init__(self, path):
+        super().__init__(MailingStore(path, check_same_thread=False), "mailing-store")
+
+    async def create_run(self, run_id: str, message_type: str, slot: datetime, subscribers):
+        return await self._call(MailingStore.create_run, run_id, message_type, slot, list(subscribers))
+
+    async def iter_pending_recipients(self, run_id: str, page_size: int = RECIPIENTS_PAGE_SIZE):
+        after = None
+        while recipients := await self._call(MailingStore.get_pending_recipients_page, run_id, after, page_size):
+            yield recipients
+            after = recipients[-1]
+
+    def mark_recipients(self, run_id: str, results) -> asyncio.Future:
+        return self._call(MailingStore.mark_recipients, run_id, list(results))
+
+    async def finish_run(self, run_id: str, status: str = RUN_DONE):
+        return await self._call(MailingStore.finish_run, run_id, status)
+
+    async def get_unfinished_runs(self):
+        return await self._call(MailingStore.get_unfinished_runs)
+
+    async def get_run_status(self, run_id: str):
+        return await self._call(MailingStore.get_run_status, run_id)
+
+    async def get_recipient_counts(self, run_id: str):
+        return await self._call(MailingStore.get_recipient_counts, run_id)
+
+    async def get_latest_run_id(self):
+        return await self._call(MailingStore.get_latest_run_id)
+
+    async def get_schedule_snapshot(self, group_id: int, sub_group: int, week_start: date):
+        return await self._call(MailingStore.get_schedule_snapshot, group_id, sub_group, week_start)
+
+    async def save_schedule_snapshot(self, group_id: int, sub_group: int, week_start: date, snapshot: dict):
+        return await self._call(MailingStore.save_schedule_snapshot, group_id, sub_group, week_start, snapshot)
+
+    async def delete_schedule_snapshots_before(self, week_start: date):
+        return await self._call(MailingStore.delete_schedule_snapshots_before, week_start)
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, mode: str, target: str) -> int:
+        return await self._call(MailingStore.create_broadcast, from_chat_id, message_id, mode, target)
+
+    async def add_broadcast_recipients(self, job_id: int, recipients):
+        return await self._call(MailingStore.add_broadcast_recipients, job_id, list(recipients))
+
+    async def start_broadcast(self, job_id: int):
+        return await self._call(MailingStore.start_broadcast, job_id)
+
+    async def fail_unprepared_broadcasts(self):
+        return await self._call(MailingStore.fail_unprepared_broadcasts)
+
+    async def set_broadcast_progress_message(self, job_id: int, chat_id: int, message_id: int):
+        return await self._call(MailingStore.set_broadcast_progress_message, job_id, chat_id, message_id)
+
+    async def finish_broadcast(self, job_id: int, status: str):
+        return await self._call(MailingStore.finish_broadcast, job_id, status)
+
+    async def get_broadcast(self, job_id: int):
+        return await self._call(MailingStore.get_broadcast, job_id)
+
+    async def get_unfinished_broadcasts(self):
+        return await self._call(MailingStore.get_unfinished_broadcasts)
+
+    async def save_run_metrics(self, kind: str, run_id: str, report, details: dict | None = None):
+        return await self._call(MailingStore.save_run_metrics, kind, run_id, report, details)
+
+    async def get_run_metrics(self, kind: str | None = None, limit: int = 10):
+        return await self._call(MailingStore.get_run_metrics, kind, limit)
+
+    def record_outcomes(self, outcomes) -> asyncio.Future:
+        return self._call(MailingStore.record_outcomes, list(outcomes))
+
+    async def get_users_to_prune(self, rules: dict[str, int]):
+        return await self._call(MailingStore.get_users_to_prune, dict(rules))
+
+    async def delete_outcomes(self, user_ids):
+        return await self._call(MailingStore.delete_outcomes, list(user_ids))
+
+
+async def group_recipient_pages(pages):
+    # Recipients come ordered by group, so each group is complete as soon as the next one starts.
+    key, user_ids = None, []
+    async for recipients in pages:
+        for user_id, group_id, sub_group, _ in recipients:
+            if (group_id, sub_group) != key:
+                if user_ids:
+                    yield key, user_ids
+                key, user_ids = (group_id, sub_group), []
+            user_ids.append(user_id)
+    if user_ids:
+        yield key, user_ids
+
+
+def broadcast_run_id(job_id: int) -> str:
+    return f"broadcast/{job_id}"
+
+
+class BufferedWriter(abc.ABC):
+    # Buffers rows and queues them to the store thread in batches, so the send loop never waits for a commit.
+    def __init__(self, flush_size: int):
+        self.flush_size = flush_size
+        self.rows = []
+        self.writes: list[asyncio.Future] = []
+
+    @abc.abstractmethod
+    def _write(self, rows) -> asyncio.Future: ...
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.flush_size:
+            self._queue_write()
+
+    def _queue_write(self):
+        # A failed earlier write is raised here, in the send loop, just like a failed commit used to be.
+        for write in self.writes:
+            if write.done():
+                write.result()
+        self.writes = [write for write in self.writes if not write.done()]
+        if self.rows:
+            self.writes.append(self._write(self.rows))
+            self.rows = []
+
+    async def flush(self):
+        self._queue_write()
+        writes, self.writes = self.writes, []
+        await asyncio.gather(*writes)
+
+
+class DeliveryJournal(BufferedWriter):
+    # Collects delivery outcomes during a run. Unreachable users are pruned in bulk after the run, so the send loop
+    # never waits for a users database commit.
+    def __init__(self, store: AsyncMailingStore, flush_size: int = 200):
+        super().__init__(flush_size)
+        self.store = store
+
+    def _write(self, rows) -> asyncio.Future:
+        return self.store.record_outcomes(rows)
+
+    def record(self, user_id: int, outcome: str):
+        self.add((user_id, outcome))
+
+    async def record_error(self, user_id: int, e: exceptions.TelegramAPIError):
+        kind = sender.classify_error(e)
+        if kind == sender.ERROR_OTHER:
+            logging.exception(f"target id:{user_id} - failed")
+        else:
+            logging.error(f"target id:{user_id} - {kind}: {e.message}")
+        self.record(user_id, kind)
+
+    def __call__(self, user_id: int, delivered: bool):
+        # Failures are recorded by record_error together with their kind.
+        if delivered:
+            self.record(user_id, OUTCOME_SENT)
+
+
+class RecipientRecorder(BufferedWriter):
+    # Buffers per-recipient results of a run and writes them in batches.
+    def __init__(self, store: AsyncMailingStore, run_id: str, flush_size: int = 50,
+                 journal: DeliveryJournal | None = None):
+        super().__init__(flush_size)
+        self.store = store
+        self.run_id = run_id
+        self.journal = journal
+
+    def _write(self, rows) -> asyncio.Future:
+        return self.store.mark_recipients(self.run_id, rows)
+
+    def __call__(self, user_id: int, delivered: bool):
+        if self.journal:
+            self.journal(user_id, delivered)
+        self.add((user_id, RECIPIENT_SENT if delivered else RECIPIENT_FAILED))
+
+    async def flush(self):
+        await super().flush()
+        if self.journal:
+            await self.journal.flush()
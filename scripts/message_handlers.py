@@ -1,20 +1,38 @@
 import asyncio
 import logging
 import random
-from datetime import timedelta
-from typing import List, Callable
-
-from aiogram.types import Message, InlineKeyboardButton, InlineKeyboardMarkup
-from aiogram import exceptions
-
-from scripts import keyboards
-from scripts.bot import db, bot
+import time
+from datetime import datetime, time as day_time, timedelta, timezone
+from functools import partial
+from typing import List, Dict, NamedTuple, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from data.config import (MAILING_WARMUP_MINUTES, MAILING_WARMUP_CONCURRENCY, MAILING_ROLE,
+                         MAILING_PRUNE_FORBIDDEN_AFTER, MAILING_PRUNE_NOT_FOUND_AFTER)
+from scripts import keyboards, mailing_queue, schedule_api, sender
+from scripts.bot import db, bot, mailings
+from scripts.mailing_store import (DeliveryJournal, RecipientRecorder, group_recipient_pages, RUN_EXPIRED,
+                                   METRICS_MAILING, RECIPIENT_PENDING, RECIPIENT_SENT, RECIPIENT_FAILED,
+                                   OUTCOME_SENT)
 from scripts.parse import parse_date_schedule
-from scripts.utils import validate_user, seconds_before_iso_time, generate_schedule_message, today_for_group
+from scripts.timezone import TZINFO
+from scripts.utils import (notify_unknown_group, generate_schedule_message, today_for_group, mailing_period,
+                           next_local_occurrence)
 
 TELEGRAM_MESSAGE_MAX_LEN = 4000
 SCHEDULE_CHUNK_BODY_LEN = 3300
 SCHEDULE_CHUNK_DELAY_SECONDS = 0.6
+MAILING_RENDER_AHEAD = 8
+MAILING_SLOT_GRACE_SECONDS = 1
+MAILING_STATUS_FLUSH_SIZE = 50
+MAILING_RESUME_MAX_AGE = timedelta(hours=6)
+# Subscriptions made through another replica sharing the user storage only show up in a rebuilt wheel.
+MAILING_WHEEL_REFRESH_SECONDS = 5 * 60
+PRUNE_RULES = {kind: streak for kind, streak in ((sender.ERROR_FORBIDDEN, MAILING_PRUNE_FORBIDDEN_AFTER),
+                                                 (sender.ERROR_NOT_FOUND, MAILING_PRUNE_NOT_FOUND_AFTER)) if streak}
+
+_mailing_wheel_changed = asyncio.Event()
 
 
 def _split_text_into_chunks(text: str, max_len: int) -> List[str]:
@@ -72,34 +90,34 @@ def _build_schedule_messages(header: str, period: str, schedule_text: str, remin
     return messages
 
 
-async def handle_broadcast_exceptions(user_id: int, e: exceptions.TelegramAPIError, retry_callback: Callable):
-    if isinstance(e, exceptions.TelegramForbiddenError):
-        logging.error(f"target id:{user_id} - forbidden")
-        db.del_user(user_id)
-    elif isinstance(e, exceptions.TelegramNotFound) or isinstance(e, exceptions.TelegramBadRequest):
-        db.del_user(user_id)
-        logging.error(f"target id:{user_id} - chat not found")
-    elif isinstance(e, exceptions.TelegramRetryAfter):
-        logging.error(f"target id:{user_id} - flood limit, sleep {e.retry_after} seconds")
-        await asyncio.sleep(e.retry_after)
-        return await retry_callback()
-    elif isinstance(e, exceptions.TelegramAPIError):
-        logging.exception(f"target id:{user_id} - failed")
+async def prune_unreachable_users(journal: DeliveryJournal):
+    await journal.flush()
+    user_ids = await mailings.get_users_to_prune(PRUNE_RULES)
+    if not user_ids:
+        return
+    await db.del_users(user_ids)
+    await mailings.delete_outcomes(user_ids)
+    logging.info(f"removed {len(user_ids)} unreachable users")
+
 
+class RenderedSchedule(NamedTuple):
+    messages: List[Tuple[str, InlineKeyboardMarkup | None]]
+    with_sticker: bool = False
+    failed: bool = False
 
-async def send_date_schedule(
-    user_id: int,
+
+async def render_date_schedule(
     schedule_response,
     period: str,
     header: str = "",
     buttons: List[InlineKeyboardButton] | None = None,
-):
+) -> RenderedSchedule | None:
     logging.debug(f"response: {schedule_response}")
 
     if schedule_response is None:
-        return
-    
-    schedule, url = schedule_response
+        return None
+
+    schedule, url, stale_since = schedule_response
 
     inline_keyboard = [[InlineKeyboardButton(text='Проверить на сайте', url=f"{url}")]]
     if buttons:
@@ -107,12 +125,17 @@ async def send_date_schedule(
     reply_markup = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
     if schedule is None:
-        await bot.send_message(user_id, f"{header}\n\n😖 Упс, кажется, расписание не отвечает. Попробуй еще раз.\n"
-                                           f"Если на сайте по кнопке ниже тоже ничего не работает, бот тут ни при чем. "
-                                           f"Если сайт показывает все исправно, напиши админу - ссылка в профиле бота.",
-                                  reply_markup=reply_markup)
-        logging.error(f"failed to get schedule for user {user_id}")
-        return
+        return RenderedSchedule(
+            [(f"{header}\n\n😖 Упс, кажется, расписание не отвечает. Попробуй еще раз.\n"
+              f"Если на сайте по кнопке ниже тоже ничего не работает, бот тут ни при чем. "
+              f"Если сайт показывает все исправно, напиши админу - ссылка в профиле бота.", reply_markup)],
+            failed=True,
+        )
+
+    if stale_since:
+        header = f"{header}\n\n" if header else ""
+        header += f"<i>⚠ Сайт расписания сейчас не отвечает, показываю сохраненную версию " \
+                  f"от {stale_since.astimezone(TZINFO):%d.%m %H:%M}.</i>"
 
     if random.randint(0, 100) < 5:
         reminder = "<i>\n😉 Не забывай про возможность поддержать разработчика через /donate.</i>"
@@ -129,13 +152,12 @@ async def send_date_schedule(
             period = "следующей неделе"
 
     if not schedule:
-        await bot.send_message(user_id, f"{header}\n\n"
-                                           f"🎉 На {period} занятий нет, можно отдыхать.\n"
-                                           f"{reminder}",
-                                  reply_markup=reply_markup)
-        await asyncio.sleep(0.5)
-        await bot.send_sticker(user_id, await get_random_chill_sticker())
-        return
+        return RenderedSchedule(
+            [(f"{header}\n\n"
+              f"🎉 На {period} занятий нет, можно отдыхать.\n"
+              f"{reminder}", reply_markup)],
+            with_sticker=True,
+        )
 
     if "недел" in period:
         if "этой" in period:
@@ -147,8 +169,7 @@ async def send_date_schedule(
     full_message = f"{header}\n\nВот твое расписание на {period}:\n{msg_text}{reminder}"
 
     if len(full_message) <= TELEGRAM_MESSAGE_MAX_LEN:
-        await bot.send_message(user_id, full_message, reply_markup=reply_markup)
-        return
+        return RenderedSchedule([(full_message, reply_markup)])
 
     split_messages = _build_schedule_messages(
         header=header,
@@ -156,80 +177,366 @@ async def send_date_schedule(
         schedule_text=msg_text,
         reminder=reminder,
     )
-    logging.info("schedule message split into %s parts for user %s", len(split_messages), user_id)
+    logging.info("schedule message split into %s parts", len(split_messages))
 
-    for index, message_text in enumerate(split_messages):
-        await bot.send_message(
-            user_id,
-            message_text,
-            reply_markup=reply_markup if index == len(split_messages) - 1 else None,
-        )
-        if index < len(split_messages) - 1:
+    return RenderedSchedule([
+        (message_text, reply_markup if index == len(split_messages) - 1 else None)
+        for index, message_text in enumerate(split_messages)
+    ])
+
+
+async def deliver_rendered_schedule(user_id: int, rendered: RenderedSchedule,
+                                    limiter: sender.RateLimiter | None = None):
+    if rendered.failed:
+        logging.error(f"failed to get schedule for user {user_id}")
+
+    # With a limiter the per-chat interval already spaces the parts out, so the fixed pauses are only
+    # needed for interactive replies.
+    for index, (message_text, reply_markup) in enumerate(rendered.messages):
+        if limiter:
+            await limiter.acquire(user_id)
+        await bot.send_message(user_id, message_text, reply_markup=reply_markup)
+        if not limiter and index < len(rendered.messages) - 1:
             await asyncio.sleep(SCHEDULE_CHUNK_DELAY_SECONDS)
 
+    if rendered.with_sticker:
+        if limiter:
+            await limiter.acquire(user_id)
+        else:
+            await asyncio.sleep(0.5)
+        await bot.send_sticker(user_id, await get_random_chill_sticker())
+
+
+async def send_date_schedule(
+    user_id: int,
+    schedule_response,
+    period: str,
+    header: str = "",
+    buttons: List[InlineKeyboardButton] | None = None,
+):
+    rendered = await render_date_schedule(schedule_response, period, header=header, buttons=buttons)
+    if rendered is None:
+        return
+    await deliver_rendered_schedule(user_id, rendered)
 
-async def mailing_schedule(mailing_time: str, schedule_date: str):
-    while True:
-        pause = await seconds_before_iso_time(mailing_time)
 
-        await asyncio.sleep(pause)
-        logging.info(f"starting to mail schedules")
-        mailing_list = db.get_mailing_list()
-        for user_id, mailing_time in mailing_list:
+def reschedule_mailing():
+    _mailing_wheel_changed.set()
+
+
+async def build_mailing_wheel(now: datetime) -> Dict[Tuple[datetime, str], list]:
+    # Buckets subscribers by the next UTC instant of their local mailing time and the schedule day it carries.
+    wheel: Dict[Tuple[datetime, str], list] = {}
+    timezones = {}
+    async for subscribers in db.iter_mailing_subscribers():
+        for subscriber in subscribers:
+            user_id, group_id, _, mailing_time = subscriber
             try:
-                await broadcast_schedule(user_id, message_type=schedule_date)
-            except asyncio.TimeoutError:
-                logging.error(f"Timeout error occurred while broadcasting schedule to user {user_id}")
-            await asyncio.sleep(.5)
-        await asyncio.sleep(1)
+                local_time = day_time.fromisoformat(mailing_time)
+            except (TypeError, ValueError):
+                logging.warning(f"unexpected mailing time {mailing_time!r} for user {user_id}")
+                continue
+            if group_id not in timezones:
+                timezones[group_id] = await schedule_api.get_group_timezone(group_id)
+            slot = next_local_occurrence(now, local_time, timezones[group_id]).astimezone(timezone.utc)
+            wheel.setdefault((slot, mailing_period(mailing_time)), []).append(subscriber)
+    return wheel
+
+
+async def _build_pending_wheel(checked_until: datetime, now: datetime) -> Dict[Tuple[datetime, str], list]:
+    # Slots that passed since the dispatcher last looked at the wheel, while the bot was down or busy sending, are
+    # still sent unless they already have a run. Otherwise they would be skipped until tomorrow.
+    wheel = await build_mailing_wheel(checked_until)
+    for slot, message_type in [key for key in wheel if key[0] <= now]:
+        if await mailings.get_run_status(mailing_run_id(slot, message_type)):
+            del wheel[slot, message_type]
+    return wheel
+
+
+async def _wait_for_wheel_change(timeout: float) -> bool:
+    try:
+        await asyncio.wait_for(_mailing_wheel_changed.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    return True
+
 
+def mailing_run_id(slot: datetime, message_type: str) -> str:
+    return f"{slot.astimezone(timezone.utc):%Y-%m-%dT%H:%M:%S}Z/{message_type}"
+
+
+async def execute_mailing_run(run_id: str, message_type: str,
+                              prerendered: Dict[Tuple[int, int], RenderedSchedule | None] | None = None,
+                              warmup_seconds: float = 0.0):
+    # Only recipients still pending are sent to, so a resumed or repeated run never messages anyone twice.
+    status = await mailings.get_run_status(run_id)
+    pending, slot = status['pending'], status['slot']
+    if pending and MAILING_ROLE == 'coordinator' and await execute_distributed_run(run_id, message_type,
+                                                                                  warmup_seconds, slot):
+        await mailings.finish_run(run_id)
+        return
 
-async def broadcast_schedule(user_id: int, message_type: str):
+    journal = DeliveryJournal(mailings)
+    recorder = RecipientRecorder(mailings, run_id, MAILING_STATUS_FLUSH_SIZE, journal)
     try:
-        if not await validate_user(user_id):
-            logging.info(f"user validation failed during mailing - id: {user_id}")
-            return
-        group_id, sub_group = db.get_user(user_id)
+        if pending:
+            report, render_stats = await run_schedule_mailing(message_type, mailings.iter_pending_recipients(run_id),
+                                                              journal.record_error, prerendered, on_result=recorder,
+                                                              slot=slot)
+            await mailings.save_run_metrics(METRICS_MAILING, run_id, report, {
+                "groups_warmed": render_stats["warmed"],
+                "groups_late": render_stats["late"],
+                "warmup_seconds": round(warmup_seconds, 1),
+            })
+    finally:
+        await recorder.flush()
+        await prune_unreachable_users(journal)
+    await mailings.finish_run(run_id)
+
+
+async def execute_distributed_run(run_id: str, message_type: str, warmup_seconds: float, slot: datetime) -> bool:
+    # Workers render from the shared Redis cache, which the coordinator's warm-up has already filled.
+    distributed = await mailing_queue.distribute_run(run_id, message_type, mailings.iter_pending_recipients(run_id),
+                                                     slot)
+    if distributed is None:
+        logging.warning(f"mailing run {run_id}: Redis is unavailable, sending from this process")
+        return False
+
+    results, report = distributed
+    journal = DeliveryJournal(mailings)
+    statuses = []
+    for user_id, result in results.items():
+        if result == mailing_queue.RESULT_SENT:
+            statuses.append((user_id, RECIPIENT_SENT))
+            journal.record(user_id, OUTCOME_SENT)
+        else:
+            statuses.append((user_id, RECIPIENT_FAILED))
+            journal.record(user_id, result.removeprefix(f"{mailing_queue.RESULT_FAILED}:"))
+    await mailings.mark_recipients(run_id, statuses)
+    await prune_unreachable_users(journal)
+
+    logging.info(f"mailing run {run_id} finished by workers: {report.summary()}")
+    await mailings.save_run_metrics(METRICS_MAILING, run_id, report, {
+        "distributed": True,
+        "warmup_seconds": round(warmup_seconds, 1),
+    })
+    pending = (await mailings.get_recipient_counts(run_id))[RECIPIENT_PENDING]
+    if pending:
+        logging.warning(f"mailing run {run_id}: {pending} recipients were left by workers, sending from this process")
+        return False
+    return True
+
+
+async def resume_mailing_runs():
+    for run_id, message_type, slot in await mailings.get_unfinished_runs():
+        if datetime.now(timezone.utc) - slot > MAILING_RESUME_MAX_AGE:
+            logging.warning(f"mailing run {run_id} is too old to resume, dropping it")
+            await mailings.finish_run(run_id, RUN_EXPIRED)
+            continue
+        status = await mailings.get_run_status(run_id)
+        logging.info(f"resuming mailing run {run_id}: {status['pending']} of {status['total']} recipients left")
+        try:
+            await execute_mailing_run(run_id, message_type)
+        except Exception:
+            logging.exception(f"failed to resume mailing run {run_id}")
+
+
+async def mailing_dispatcher():
+    # Slots missed while the bot was down are caught up within the window unfinished runs are resumed in.
+    checked_until = datetime.now(timezone.utc) - MAILING_RESUME_MAX_AGE
+    await resume_mailing_runs()
+    while True:
+        _mailing_wheel_changed.clear()
+        now = datetime.now(timezone.utc)
+        wheel = await _build_pending_wheel(checked_until, now)
+        if not wheel:
+            checked_until = now
+            await _wait_for_wheel_change(MAILING_WHEEL_REFRESH_SECONDS)
+            continue
 
-        header_text = "👋 Привет, это рассылка расписания."
+        slot = min(bucket_slot for bucket_slot, _ in wheel)
+        # Later missed slots stay in the next wheel.
+        checked_until = min(now, slot)
+        if slot <= now:
+            logging.warning(f"mailing slot {slot:%Y-%m-%dT%H:%M:%S}Z was missed, sending it now")
+        buckets = {message_type: subscribers for (bucket_slot, message_type), subscribers in wheel.items()
+                   if bucket_slot == slot}
+        pause = (slot - datetime.now(timezone.utc)).total_seconds()
+        warmup_seconds = MAILING_WARMUP_MINUTES * 60
+
+        if pause > warmup_seconds:
+            wait = min(pause - warmup_seconds, MAILING_WHEEL_REFRESH_SECONDS)
+            if await _wait_for_wheel_change(wait) or wait < pause - warmup_seconds:
+                continue
+
+        prerendered = {}
+        warmup_durations = {}
+        if warmup_seconds:
+            for message_type, subscribers in buckets.items():
+                started = time.monotonic()
+                try:
+                    prerendered[message_type] = await warm_up_mailing(message_type, subscribers, slot)
+                except Exception:
+                    logging.exception("mailing warm-up failed, schedules will be fetched at send time")
+                warmup_durations[message_type] = time.monotonic() - started
+
+        await asyncio.sleep(max(0.0, (slot - datetime.now(timezone.utc)).total_seconds()))
+
+        # Rebuild the bucket so subscriptions changed during the warm-up are respected.
+        wheel = await build_mailing_wheel(slot - timedelta(seconds=MAILING_SLOT_GRACE_SECONDS))
+        for (bucket_slot, message_type), subscribers in wheel.items():
+            if bucket_slot != slot:
+                continue
+            run_id = mailing_run_id(slot, message_type)
+            logging.info(f"starting mailing run {run_id}")
+            await mailings.create_run(run_id, message_type, slot, subscribers)
+            try:
+                await execute_mailing_run(run_id, message_type, prerendered.get(message_type),
+                                          warmup_durations.get(message_type, 0.0))
+            except Exception:
+                logging.exception(f"mailing run {run_id} failed, it will be resumed on restart")
 
-        if message_type in "today":
-            today = today_for_group(group_id)
 
-            logging.info(f"attempted to mail today schedule - id: {user_id}")
+def group_subscribers(subscribers) -> Dict[Tuple[int, int], List[int]]:
+    groups: Dict[Tuple[int, int], List[int]] = {}
+    for user_id, group_id, sub_group, _ in subscribers:
+        groups.setdefault((group_id, sub_group), []).append(user_id)
+    return groups
 
-            schedule_response = await parse_date_schedule(group=group_id, sub_group=sub_group, date_1=today)
-            await send_date_schedule(user_id, schedule_response, "сегодня",
-                                     header=header_text, buttons=[keyboards.inline_bt_unsub])
-        elif message_type in "tomorrow":
-            tomorrow = today_for_group(group_id) + timedelta(days=1)
 
-            logging.info(f"attempted to mail tomorrow schedule - id: {user_id}")
+async def render_group_mailing(group_id: int, sub_group: int, message_type: str,
+                               slot: datetime | None = None) -> RenderedSchedule | None:
+    if not await schedule_api.get_group_meta(group_id):
+        return None
 
-            schedule_response = await parse_date_schedule(group=group_id, sub_group=sub_group, date_1=tomorrow)
-            await send_date_schedule(user_id, schedule_response, "завтра",
-                                     header=header_text, buttons=[keyboards.inline_bt_unsub])
-    except exceptions.TelegramAPIError as e:
-        await handle_broadcast_exceptions(user_id, e, lambda: broadcast_schedule(user_id, message_type))
+    # "Today" is the local date of the slot being sent. A warm-up before midnight renders a slot after it.
+    if slot:
+        today = slot.astimezone(await schedule_api.get_group_timezone(group_id)).date()
+    else:
+        today = await today_for_group(group_id)
+    header_text = "👋 Привет, это рассылка расписания."
+    if message_type in "today":
+        schedule_date, period = today, "сегодня"
     else:
-        logging.info(f"target id:{user_id}: success")
-        return True
-    return False
+        schedule_date, period = today + timedelta(days=1), "завтра"
+
+    logging.info(f"rendering {message_type} mailing - group: {group_id}, sub group: {sub_group}")
 
+    schedule_response = await parse_date_schedule(group=group_id, sub_group=sub_group, date_1=schedule_date)
+    return await render_date_schedule(schedule_response, period,
+                                      header=header_text, buttons=[keyboards.inline_bt_unsub])
 
-async def broadcast_message(user_id: int, message: Message, message_type: str):
+
+async def warm_up_mailing(message_type: str, subscribers,
+                          slot: datetime) -> Dict[Tuple[int, int], RenderedSchedule | None]:
+    groups = group_subscribers(subscribers)
+    semaphore = asyncio.Semaphore(MAILING_WARMUP_CONCURRENCY)
+    started_at = time.monotonic()
+
+    async def warm_up_group(group_id: int, sub_group: int):
+        async with semaphore:
+            try:
+                return await render_group_mailing(group_id, sub_group, message_type, slot)
+            except Exception:
+                logging.exception(f"failed to warm up mailing for group {group_id}")
+                return None
+
+    results = await asyncio.gather(*(warm_up_group(*key) for key in groups))
+
+    # Groups whose schedule could not be fetched are left out, so the send time gets another try.
+    prerendered = {key: rendered for key, rendered in zip(groups, results)
+                   if rendered is None or not rendered.failed}
+    logging.info(f"{message_type} mailing warm-up: {len(prerendered)} of {len(groups)} groups ready "
+                 f"in {time.monotonic() - started_at:.1f}s")
+    return prerendered
+
+
+async def run_schedule_mailing(message_type: str, recipient_pages, on_error: sender.ErrorHandler,
+                               prerendered: Dict[Tuple[int, int], RenderedSchedule | None] | None = None,
+                               on_result: sender.ResultHandler | None = None, slot: datetime | None = None):
+    # Recipients are read page by page in group order, so memory does not grow with the number of subscribers.
+    prerendered = prerendered or {}
+    logging.info(f"mailing {message_type} schedule")
+    render_stats = {"warmed": 0, "late": 0, "failed": 0, "fetch_seconds": 0.0}
+
+    # Render the next groups while the current one is being sent, but never run far ahead of delivery.
+    rendered_queue: asyncio.Queue = asyncio.Queue(maxsize=MAILING_RENDER_AHEAD)
+
+    async def render_groups():
+        groups = group_recipient_pages(recipient_pages)
+        while True:
+            try:
+                (group_id, sub_group), user_ids = await anext(groups)
+            except StopAsyncIteration:
+                break
+            except Exception as e:
+                # Failing to read recipients fails the run, the rest stays pending for a resume.
+                await rendered_queue.put(e)
+                return
+            if (group_id, sub_group) in prerendered:
+                render_stats["warmed"] += 1
+                await rendered_queue.put((user_ids, prerendered[group_id, sub_group]))
+                continue
+            render_stats["late"] += 1
+            started = time.monotonic()
+            try:
+                rendered = await render_group_mailing(group_id, sub_group, message_type, slot)
+            except Exception:
+                logging.exception(f"failed to render mailing for group {group_id}")
+                # There is nothing to send them, so they are failed rather than left pending in a finished run.
+                render_stats["failed"] += len(user_ids)
+                if on_result:
+                    for user_id in user_ids:
+                        on_result(user_id, False)
+                continue
+            finally:
+                render_stats["fetch_seconds"] += time.monotonic() - started
+            await rendered_queue.put((user_ids, rendered))
+        await rendered_queue.put(None)
+
+    async def deliveries():
+        while (batch := await rendered_queue.get()) is not None:
+            if isinstance(batch, Exception):
+                raise batch
+            user_ids, rendered = batch
+            for user_id in user_ids:
+                yield user_id, partial(broadcast_schedule, user_id, rendered)
+
+    renderer = asyncio.create_task(render_groups())
     try:
-        if message_type in "copy":
-            await message.send_copy(user_id, disable_notification=True,
-                                    reply_markup=keyboards.kb_main)
-        elif message_type in "forward":
-            await message.forward(user_id, disable_notification=True)
-    except exceptions.TelegramAPIError as e:
-        await handle_broadcast_exceptions(user_id, e, lambda: broadcast_message(user_id, message, message_type))
-    else:
-        logging.info(f"target id:{user_id}: success")
-        return True
-    return False
+        report = await sender.send_all(deliveries(), on_error, on_result=on_result)
+    finally:
+        renderer.cancel()
+
+    report.fetch_seconds = render_stats["fetch_seconds"]
+    if render_stats["failed"]:
+        report.failed += render_stats["failed"]
+        report.errors[sender.ERROR_RENDER] += render_stats["failed"]
+    logging.info(f"{message_type} mailing finished: {report.summary()}; groups warmed "
+                 f"{render_stats['warmed']}, fetched late {render_stats['late']}")
+    return report, render_stats
+
+
+async def broadcast_schedule(user_id: int, rendered: RenderedSchedule | None,
+                             limiter: sender.RateLimiter | None = None):
+    if rendered is None:
+        if limiter:
+            await limiter.acquire(user_id)
+        await notify_unknown_group(user_id)
+        logging.info(f"user validation failed during mailing - id: {user_id}")
+        return
+    await deliver_rendered_schedule(user_id, rendered, limiter)
+
+
+async def broadcast_message(user_id: int, from_chat_id: int, message_id: int, message_type: str,
+                            limiter: sender.RateLimiter | None = None):
+    if limiter:
+        await limiter.acquire(user_id)
+    if message_type in "copy":
+        await bot.copy_message(user_id, from_chat_id, message_id, disable_notification=True,
+                               reply_markup=keyboards.kb_main)
+    elif message_type in "forward":
+        await bot.forward_message(user_id, from_chat_id, message_id, disable_notification=True)
 
 
 async def get_random_chill_sticker():
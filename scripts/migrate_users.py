@@ -0,0 +1,40 @@
+import argparse
+import asyncio
+import logging
+import time
+
+from scripts.user_storage import MIGRATION_BATCH_SIZE, iter_users, open_user_storage
+
+PROGRESS_LOG_INTERVAL = 5
+
+
+async def migrate(source_url: str, target_url: str, batch_size: int) -> int:
+    source = open_user_storage(source_url)
+    target = open_user_storage(target_url)
+    copied = 0
+    started = last_report = time.monotonic()
+    try:
+        async for users in iter_users(source, batch_size):
+            await target.import_users(users)
+            copied += len(users)
+            if time.monotonic() - last_report > PROGRESS_LOG_INTERVAL:
+                logging.info(f"copied {copied} users")
+                last_report = time.monotonic()
+        target_count = await target.count_users()
+    finally:
+        await source.close()
+        await target.close()
+
+    logging.info(f"copied {copied} users in {time.monotonic() - started:.1f}s, target now has {target_count}")
+    return copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy users between user storages, e.g. from SQLite to Redis")
+    parser.add_argument('source', help='sqlite://<path>, redis://host:port/db')
+    parser.add_argument('target', help='sqlite://<path>, redis://host:port/db')
+    parser.add_argument('--batch-size', type=int, default=MIGRATION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    asyncio.run(migrate(args.source, args.target, args.batch_size))
@@ -1,9 +1,9 @@
 import asyncio
 import datetime
 import logging
-from typing import Any
+import time
+from typing import Any, Awaitable
 
-from scripts.timezone import tzinfo_for_faculty
 from scripts.utils import seconds_before_iso_time
 from scripts import schedule_api
 
@@ -55,13 +55,20 @@ def _build_non_summer_ranges(start_date: datetime.date, end_date: datetime.date)
     return ranges
 
 
-def parse_groups() -> None:
-    if schedule_api.refresh_groups_cache():
+async def parse_groups() -> None:
+    if await schedule_api.refresh_groups_cache():
         logging.info("updated groups successfully")
     else:
         logging.info("can't update groups list: api response is invalid")
 
 
+async def parse_reference_data() -> None:
+    if await schedule_api.refresh_reference_snapshot():
+        logging.info("updated reference data snapshot successfully")
+    else:
+        logging.info("can't update reference data snapshot: api response is invalid")
+
+
 def _build_schedule(items: list[dict[str, Any]], teachers: dict[int, dict[str, Any]],
                     rooms: dict[int, dict[str, Any]], buildings: dict[int, dict[str, Any]],
                     target_tz: datetime.tzinfo) -> dict[str, list[dict[str, str]]]:
@@ -137,11 +144,29 @@ def _build_schedule(items: list[dict[str, Any]], teachers: dict[int, dict[str, A
             "teacher_url": teacher_url,
             "room": room_name,
             "class_url": item.get("class_url") or "",
+            "teacher_id": teacher_id,
+            "room_id": room_id,
         })
 
     return schedule
 
 
+async def _timed(timings: dict[str, float], stage: str, awaitable: Awaitable) -> Any:
+    started = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
+def _timed_sync(timings: dict[str, float], stage: str, func, *args) -> Any:
+    started = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        timings[stage] = time.perf_counter() - started
+
+
 async def parse_date_schedule(group, sub_group=None, date_1=None, date_2=None):
     if date_1 and not date_2:
         date_2 = date_1
@@ -167,40 +192,60 @@ async def parse_date_schedule(group, sub_group=None, date_1=None, date_2=None):
 
     date_ranges = _build_non_summer_ranges(date_1, date_2)
     if not date_ranges:
-        return {}, url
+        return {}, url, None
+
+    pipeline_started = time.perf_counter()
+    timings: dict[str, float] = {}
+
+    # Stage 1: schedule ranges and the group timezone do not depend on each other.
+    range_responses, target_tz = await asyncio.gather(
+        _timed(timings, "schedule", asyncio.gather(*(
+            schedule_api.get_schedule_range(group, start_date, end_date, sub_group_id=resolved_sub_group)
+            for start_date, end_date in date_ranges
+        ))),
+        _timed(timings, "timezone", schedule_api.get_group_timezone(group)),
+    )
 
     schedule_items: list[dict[str, Any]] = []
-    for start_date, end_date in date_ranges:
-        schedule_response = schedule_api.get_schedule(group, start_date, end_date, sub_group_id=resolved_sub_group)
+    stale_since: datetime.datetime | None = None
+    for schedule_response in range_responses:
         if schedule_response is None:
-            return None, url
-        if not isinstance(schedule_response, list):
-            logging.error("unexpected schedule response for group %s: %s", group, type(schedule_response))
-            return None, url
-        schedule_items.extend(schedule_response)
+            return None, url, None
+        schedule_items.extend(schedule_response.value)
+        if not schedule_response.fresh and schedule_response.fetched_at:
+            stale_since = min(filter(None, (stale_since, schedule_response.fetched_at)))
 
     if not schedule_items:
-        return {}, url
-
-    faculty_id = schedule_api.get_group_faculty_id(group)
-    target_tz = tzinfo_for_faculty(faculty_id)
+        return {}, url, stale_since
 
     teacher_ids = {item.get("teacher_id") for item in schedule_items if item.get("teacher_id") is not None}
     room_ids = {item.get("room_id") for item in schedule_items if item.get("room_id") is not None}
 
-    teachers = schedule_api.get_teachers(teacher_ids)
-    rooms = schedule_api.get_rooms(room_ids)
-    building_ids = {room.get("building_id") for room in rooms.values() if room.get("building_id") is not None}
-    buildings = schedule_api.get_buildings(building_ids)
+    async def fetch_rooms_and_buildings():
+        rooms = await _timed(timings, "rooms", schedule_api.get_rooms(room_ids))
+        building_ids = {room.get("building_id") for room in rooms.values() if room.get("building_id") is not None}
+        buildings = await _timed(timings, "buildings", schedule_api.get_buildings(building_ids))
+        return rooms, buildings
+
+    # Stage 2: teachers run alongside the rooms -> buildings chain.
+    teachers, (rooms, buildings) = await asyncio.gather(
+        _timed(timings, "teachers", schedule_api.get_teachers(teacher_ids)),
+        fetch_rooms_and_buildings(),
+    )
+
+    schedule = _timed_sync(timings, "build", _build_schedule, schedule_items, teachers, rooms, buildings, target_tz)
 
-    schedule = _build_schedule(schedule_items, teachers, rooms, buildings, target_tz)
-    return schedule, url
+    timings["total"] = time.perf_counter() - pipeline_started
+    logging.info("schedule pipeline for group %s (%s - %s): %s", group, date_1, date_2,
+                 ", ".join(f"{stage} {seconds * 1000:.0f}ms" for stage, seconds in timings.items()))
+    return schedule, url, stale_since
 
 
 async def update_groups(time_to_update: str = None):
     while True:
         logging.info("starting to update groups")
-        parse_groups()
+        await parse_groups()
+        await parse_reference_data()
 
         if not time_to_update:
             break
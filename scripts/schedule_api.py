@@ -1,12 +1,19 @@
+import asyncio
 import datetime
 import json
 import logging
-from typing import Any, Iterable
+import random
+import time
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import Any, Iterable, NamedTuple
 
-import requests as request
-from redis import Redis
+import aiohttp
 
-from data.config import REDIS_URL
+from data.config import BASE_DIR
+from scripts import cache
+from scripts.circuit_breaker import CircuitBreaker
+from scripts.timezone import tzinfo_for_faculty
 
 API_BASE_URL = 'https://api.herzen.spb.ru/schedule/v1'
 
@@ -19,142 +26,172 @@ ROOMS_URL = f'{API_BASE_URL}/rooms'
 BUILDINGS_URL = f'{API_BASE_URL}/buildings'
 
 REQUEST_TIMEOUT = 10
+HTTP_POOL_LIMIT = 20
+HTTP_KEEPALIVE_TIMEOUT = 30
+REQUEST_RETRIES = 2
+REQUEST_RETRY_BACKOFF = 0.5
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
 
 GROUPS_CACHE_TTL = datetime.timedelta(hours=24)
 REFERENCE_CACHE_TTL = datetime.timedelta(days=7)
 SCHEDULE_CACHE_TTL = datetime.timedelta(hours=1)
+SCHEDULE_STALE_TTL = datetime.timedelta(days=3)
+REFERENCE_STALE_TTL = datetime.timedelta(days=30)
+GROUPS_GENERATION_CHECK_INTERVAL = 5
 
 GROUPS_CACHE_KEY = "groups:tree"
+GROUPS_GENERATION_KEY = "groups:generation"
 TEACHER_CACHE_PREFIX = "teacher"
 ROOM_CACHE_PREFIX = "room"
 BUILDING_CACHE_PREFIX = "building"
 
-_redis_client: Redis | None = None
-_redis_disabled = False
+REFERENCE_SNAPSHOT_PATH = BASE_DIR / 'storage' / 'reference.json'
+# Only the fields _build_schedule needs are kept in memory and on disk.
+REFERENCE_FIELDS = {
+    TEACHER_CACHE_PREFIX: ("id", "name", "rank", "atlas_url"),
+    ROOM_CACHE_PREFIX: ("id", "name", "building_id"),
+    BUILDING_CACHE_PREFIX: ("id", "name"),
+}
+
+
+
+class GroupMeta(NamedTuple):
+    id: int
+    name: str
+    faculty_id: int | None
+    timezone: datetime.tzinfo
+    sub_groups: tuple[Mapping[str, Any], ...]
+    path: tuple[str, str, str, str]
+
+
+_http_session: aiohttp.ClientSession | None = None
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_reference_index: dict[str, dict[int, dict[str, Any]]] = {prefix: {} for prefix in REFERENCE_FIELDS}
+
+_groups_tree: Mapping[str, Any] | None = None
+_groups_index: Mapping[int, GroupMeta] = MappingProxyType({})
+_groups_generation: str | None = None
+_groups_loaded_at = 0.0
+_groups_checked_at = 0.0
 
 
 def _now() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc)
 
 
-def _get_redis() -> Redis | None:
-    global _redis_client, _redis_disabled
-    if _redis_disabled:
-        return None
-    if _redis_client is not None:
-        return _redis_client
-    if not REDIS_URL:
-        _redis_disabled = True
-        return None
-    try:
-        client = Redis.from_url(REDIS_URL, decode_responses=True)
-        client.ping()
-        _redis_client = client
-        return _redis_client
-    except Exception as exc:
-        logging.warning("Redis is unavailable: %s", exc)
-        _redis_disabled = True
-        return None
+async def open_http_session() -> aiohttp.ClientSession:
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+        )
+    return _http_session
 
-def request_json(url: str, params: dict | None = None, context: str = "request") -> Any | None:
-    try:
-        response = request.get(url, params=params, timeout=REQUEST_TIMEOUT)
-    except request.exceptions.Timeout:
-        logging.error("Timeout error occurred during %s: %s", context, url)
-        return None
-    except request.exceptions.RequestException as exc:
-        logging.error("Request error occurred during %s: %s (%s)", context, url, exc)
-        return None
 
-    if not response.ok:
-        logging.error("API response error during %s: %s (%s)", context, response.url, response.status_code)
-        return None
+async def close_http_session() -> None:
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
 
-    try:
-        return response.json()
-    except ValueError:
-        logging.error("Failed to decode JSON during %s: %s", context, response.url)
+
+def _prepare_params(params: dict | None) -> dict[str, str] | None:
+    if not params:
         return None
+    prepared = {}
+    for key, value in params.items():
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        prepared[key] = str(value)
+    return prepared
 
 
-def _normalize_ids(values: Iterable[int]) -> list[int]:
-    ids: list[int] = []
-    for value in values:
-        try:
-            ids.append(int(value))
-        except (TypeError, ValueError):
-            continue
-    return sorted(set(ids))
+class _RetryableError(Exception):
+    pass
 
 
-def _cache_get_json(key: str) -> Any | None:
-    redis_client = _get_redis()
-    if not redis_client:
-        return None
-    try:
-        cached = redis_client.get(key)
-        if not cached:
-            return None
-        return json.loads(cached)
-    except Exception as exc:
-        logging.warning("Failed to read cache %s: %s", key, exc)
-        return None
+def _get_circuit_breaker(url: str) -> CircuitBreaker:
+    endpoint = url.removeprefix(API_BASE_URL) or url
+    breaker = _circuit_breakers.get(endpoint)
+    if breaker is None:
+        breaker = CircuitBreaker(endpoint, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+        _circuit_breakers[endpoint] = breaker
+    return breaker
 
 
-def _cache_set_json(key: str, value: Any, ttl: datetime.timedelta) -> None:
-    redis_client = _get_redis()
-    if not redis_client:
-        return
-    try:
-        redis_client.setex(key, int(ttl.total_seconds()), json.dumps(value, ensure_ascii=False))
-    except Exception as exc:
-        logging.warning("Failed to write cache %s: %s", key, exc)
+def get_circuit_status() -> list[dict[str, Any]]:
+    return [breaker.status() for breaker in _circuit_breakers.values()]
 
 
-def _cache_get_many(prefix: str, ids: list[int]) -> tuple[dict[int, dict[str, Any]], list[int]]:
-    redis_client = _get_redis()
-    if not redis_client:
-        return {}, ids
-    keys = [f"{prefix}:{item_id}" for item_id in ids]
+async def _request_json_once(session: aiohttp.ClientSession, url: str, params: dict[str, str] | None,
+                             context: str) -> Any | None:
     try:
-        values = redis_client.mget(keys)
-    except Exception as exc:
-        logging.warning("Failed to read cache %s: %s", prefix, exc)
-        return {}, ids
-
-    found: dict[int, dict[str, Any]] = {}
-    missing: list[int] = []
-    for item_id, raw in zip(ids, values):
-        if raw:
+        async with session.get(url, params=params) as response:
+            if response.status >= 500 or response.status == 429:
+                raise _RetryableError(f"{response.url} ({response.status})")
+            if not response.ok:
+                logging.error("API response error during %s: %s (%s)", context, response.url, response.status)
+                return None
             try:
-                found[item_id] = json.loads(raw)
-            except Exception:
-                missing.append(item_id)
-        else:
-            missing.append(item_id)
-    return found, missing
-
-
-def _cache_set_many(prefix: str, items: Iterable[dict[str, Any]], ttl: datetime.timedelta) -> None:
-    redis_client = _get_redis()
-    if not redis_client:
-        return
-    ttl_seconds = int(ttl.total_seconds())
+                return await response.json(content_type=None)
+            except ValueError:
+                logging.error("Failed to decode JSON during %s: %s", context, response.url)
+                return None
+    except asyncio.TimeoutError:
+        raise _RetryableError(f"timeout: {url}")
+    except aiohttp.ClientError as exc:
+        raise _RetryableError(f"{url} ({exc})")
+
+
+async def request_json(url: str, params: dict | None = None, context: str = "request") -> Any | None:
+    breaker = _get_circuit_breaker(url)
+    if not breaker.allow_request():
+        logging.info("Circuit %s is open, skipping %s", breaker.name, context)
+        return None
+
+    # Only the request allow_request() let through a half-open circuit holds its trial.
+    trial = breaker.is_trial
+    session = await open_http_session()
+    prepared_params = _prepare_params(params)
+    # A half-open circuit gets exactly one attempt to prove the endpoint is back.
+    attempts = 1 if trial else REQUEST_RETRIES + 1
     try:
-        pipeline = redis_client.pipeline()
-        for item in items:
-            raw_id = item.get("id")
-            if raw_id is None:
-                continue
+        for attempt in range(attempts):
             try:
-                item_id = int(raw_id)
-            except (TypeError, ValueError):
+                data = await _request_json_once(session, url, prepared_params, context)
+            except _RetryableError as exc:
+                logging.error("Request error occurred during %s (attempt %s/%s): %s",
+                              context, attempt + 1, attempts, exc)
+                if attempt + 1 < attempts:
+                    # Full jitter keeps retries from several handlers from hitting the API in lockstep.
+                    await asyncio.sleep(random.uniform(0, REQUEST_RETRY_BACKOFF * 2 ** attempt))
                 continue
-            key = f"{prefix}:{item_id}"
-            pipeline.setex(key, ttl_seconds, json.dumps(item, ensure_ascii=False))
-        pipeline.execute()
-    except Exception as exc:
-        logging.warning("Failed to write cache %s: %s", prefix, exc)
+            breaker.record_success(trial)
+            return data
+    finally:
+        if trial:
+            breaker.release_trial()
+
+    breaker.record_failure(trial)
+    return None
+
+
+def _normalize_ids(values: Iterable[int]) -> list[int]:
+    ids: list[int] = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return sorted(set(ids))
+
 
 def _schedule_cache_key(group_id: int, start_date: datetime.date, end_date: datetime.date,
                         sub_group_id: int | None = None, exam_only: bool | None = None) -> str:
@@ -244,10 +281,12 @@ def _build_groups_tree(groups_data: list[dict[str, Any]], faculties_data: list[d
     return groups_tree
 
 
-def _fetch_groups_tree() -> dict[str, Any] | None:
-    groups_data = request_json(GROUPS_URL, context="groups")
-    faculties_data = request_json(FACULTIES_URL, context="faculties")
-    sub_groups_data = request_json(SUB_GROUPS_URL, context="sub_groups")
+async def _fetch_groups_tree() -> dict[str, Any] | None:
+    groups_data, faculties_data, sub_groups_data = await asyncio.gather(
+        request_json(GROUPS_URL, context="groups"),
+        request_json(FACULTIES_URL, context="faculties"),
+        request_json(SUB_GROUPS_URL, context="sub_groups"),
+    )
 
     if not isinstance(groups_data, list) or not isinstance(faculties_data, list) or not isinstance(sub_groups_data, list):
         return None
@@ -258,75 +297,157 @@ def _fetch_groups_tree() -> dict[str, Any] | None:
     return groups_tree
 
 
-def get_groups_tree(force_refresh: bool = False) -> dict[str, Any] | None:
-    if not force_refresh:
-        cached_data = _cache_get_json(GROUPS_CACHE_KEY)
-        if cached_data:
-            return cached_data
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
 
-    groups_tree = _fetch_groups_tree()
-    if groups_tree:
-        _cache_set_json(GROUPS_CACHE_KEY, groups_tree, GROUPS_CACHE_TTL)
-        return groups_tree
-    return None
 
+def _parse_int(value: Any) -> int | None:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
 
-def refresh_groups_cache() -> bool:
-    groups_tree = _fetch_groups_tree()
-    if not groups_tree:
+
+def _build_groups_index(groups_tree: Mapping[str, Any]) -> Mapping[int, GroupMeta]:
+    index: dict[int, GroupMeta] = {}
+    for faculty_name, forms in groups_tree.items():
+        for form_name, levels in forms.items():
+            for level_name, courses in levels.items():
+                for course_name, groups in courses.items():
+                    for group_name, leaf in groups.items():
+                        if isinstance(leaf, Mapping):
+                            group_id = _parse_int(leaf.get("id"))
+                            faculty_id = _parse_int(leaf.get("faculty_id"))
+                            sub_groups = tuple(leaf.get("sub_groups") or ())
+                        else:
+                            # Old tree format stored the bare group id as a leaf.
+                            group_id = _parse_int(leaf)
+                            faculty_id = None
+                            sub_groups = ()
+                        if group_id is None:
+                            continue
+                        index[group_id] = GroupMeta(
+                            id=group_id,
+                            name=group_name,
+                            faculty_id=faculty_id,
+                            timezone=tzinfo_for_faculty(faculty_id),
+                            sub_groups=sub_groups,
+                            path=(faculty_name, form_name, level_name, course_name),
+                        )
+    return MappingProxyType(index)
+
+
+def _install_groups_tree(groups_tree: dict[str, Any], generation: str | None) -> Mapping[str, Any]:
+    global _groups_tree, _groups_index, _groups_generation, _groups_loaded_at, _groups_checked_at
+    _groups_tree = _freeze(groups_tree)
+    _groups_index = _build_groups_index(_groups_tree)
+    _groups_generation = generation
+    _groups_loaded_at = _groups_checked_at = time.monotonic()
+    return _groups_tree
+
+
+async def _local_groups_tree_is_current() -> bool:
+    global _groups_checked_at
+    if _groups_tree is None:
         return False
-    _cache_set_json(GROUPS_CACHE_KEY, groups_tree, GROUPS_CACHE_TTL)
-    return True
+    now = time.monotonic()
+    if now - _groups_loaded_at > GROUPS_CACHE_TTL.total_seconds():
+        return False
+    if now - _groups_checked_at < GROUPS_GENERATION_CHECK_INTERVAL:
+        return True
 
+    generation = await cache.get_value(GROUPS_GENERATION_KEY)
+    # Without Redis, or without a generation (evicted, or never written), nothing says the local copy is stale: it
+    # stays valid until its TTL runs out instead of being decoded again on every check.
+    if generation is None or generation == _groups_generation:
+        _groups_checked_at = now
+        return True
+    return False
 
-def _find_group_meta(groups_node: dict[str, Any], group_id: int) -> dict[str, Any] | None:
-    for value in groups_node.values():
-        if not isinstance(value, dict):
-            continue
-        raw_group_id = value.get("id")
-        if raw_group_id is not None:
-            try:
-                if int(raw_group_id) == group_id:
-                    return value
-            except (TypeError, ValueError):
-                pass
-        nested_result = _find_group_meta(value, group_id)
-        if nested_result:
-            return nested_result
-    return None
 
+async def _fetch_and_cache_groups_tree() -> Mapping[str, Any] | None:
+    groups_tree = await _fetch_groups_tree()
+    if not groups_tree:
+        return None
+    await cache.set_json(GROUPS_CACHE_KEY, groups_tree, GROUPS_CACHE_TTL)
+    generation = await cache.incr(GROUPS_GENERATION_KEY)
+    return _install_groups_tree(groups_tree, str(generation) if generation is not None else None)
 
-def get_group_faculty_id(group_id: int) -> int | None:
-    try:
-        normalized_group_id = int(group_id)
-    except (TypeError, ValueError):
+
+async def _load_cached_groups_tree() -> Mapping[str, Any] | None:
+    # Read the generation first: a refresh in between only causes one extra reload later.
+    generation = await cache.get_value(GROUPS_GENERATION_KEY)
+    cached_data = await cache.get_json(GROUPS_CACHE_KEY)
+    if not cached_data:
         return None
+    return _install_groups_tree(cached_data, generation)
 
-    groups_tree = get_groups_tree()
+
+async def get_groups_tree(force_refresh: bool = False) -> Mapping[str, Any] | None:
+    if force_refresh:
+        return await cache.single_flight(f"{GROUPS_CACHE_KEY}:refresh", _fetch_and_cache_groups_tree)
+
+    if await _local_groups_tree_is_current():
+        return _groups_tree
+
+    groups_tree = await cache.single_flight(f"{GROUPS_CACHE_KEY}:load", _load_cached_groups_tree)
+    if groups_tree:
+        return groups_tree
+    groups_tree = await cache.coalesce(GROUPS_CACHE_KEY, _fetch_and_cache_groups_tree)
     if not groups_tree:
-        return None
+        # Upstream is unavailable: keep serving the last good tree this process has seen.
+        return _groups_tree
+    if groups_tree is not _groups_tree:
+        # Another replica fetched the tree while we waited on its lock.
+        groups_tree = _install_groups_tree(groups_tree, None)
+    return groups_tree
+
+
+async def refresh_groups_cache() -> bool:
+    groups_tree = await get_groups_tree(force_refresh=True)
+    return bool(groups_tree)
 
-    group_meta = _find_group_meta(groups_tree, normalized_group_id)
-    if not group_meta:
+
+async def get_group_meta(group_id: int) -> GroupMeta | None:
+    normalized_group_id = _parse_int(group_id)
+    if normalized_group_id is None:
+        return None
+    if not await get_groups_tree():
         return None
+    return _groups_index.get(normalized_group_id)
+
+
+async def get_faculty_group_ids(faculty_name: str) -> list[int]:
+    if not await get_groups_tree():
+        return []
+    return [group_meta.id for group_meta in _groups_index.values() if group_meta.path[0] == faculty_name]
+
 
-    faculty_id = group_meta.get("faculty_id")
-    if faculty_id is None:
+async def _resolve_group_meta(group_id: int) -> GroupMeta | None:
+    group_meta = await get_group_meta(group_id)
+    if group_meta and group_meta.faculty_id is None:
         # Cached tree can be stale and miss faculty metadata from old format.
-        refreshed_groups_tree = get_groups_tree(force_refresh=True)
-        if refreshed_groups_tree:
-            group_meta = _find_group_meta(refreshed_groups_tree, normalized_group_id)
-            if group_meta:
-                faculty_id = group_meta.get("faculty_id")
+        if await get_groups_tree(force_refresh=True):
+            group_meta = _groups_index.get(group_meta.id) or group_meta
+    return group_meta
+
+
+async def get_group_faculty_id(group_id: int) -> int | None:
+    group_meta = await _resolve_group_meta(group_id)
+    return group_meta.faculty_id if group_meta else None
 
-    try:
-        return int(faculty_id)
-    except (TypeError, ValueError):
-        return None
 
+async def get_group_timezone(group_id: int) -> datetime.tzinfo:
+    group_meta = await _resolve_group_meta(group_id)
+    return group_meta.timezone if group_meta else tzinfo_for_faculty(None)
 
-def get_schedule(group_id: int, start_date: datetime.date, end_date: datetime.date,
-                 sub_group_id: int | None = None, exam_only: bool | None = None) -> Any | None:
+
+async def get_schedule(group_id: int, start_date: datetime.date, end_date: datetime.date,
+                 sub_group_id: int | None = None, exam_only: bool | None = None) -> cache.CacheEntry | None:
     params = {
         "group_id": group_id,
         "start_date": start_date,
@@ -337,95 +458,181 @@ def get_schedule(group_id: int, start_date: datetime.date, end_date: datetime.da
     if exam_only is not None:
         params["exam_only"] = exam_only
 
-    redis_client = _get_redis()
     cache_key = _schedule_cache_key(group_id, start_date, end_date, sub_group_id, exam_only)
 
-    if redis_client:
-        try:
-            cached = redis_client.get(cache_key)
-            if cached:
-                return json.loads(cached)
-        except Exception as exc:
-            logging.warning("Failed to read schedule cache: %s", exc)
-
-    data = request_json(SCHEDULE_URL, params=params, context="schedule")
-    if data is None:
-        return None
+    async def fetch_schedule() -> list[dict[str, Any]] | None:
+        data = await request_json(SCHEDULE_URL, params=params, context="schedule")
+        if data is not None and not isinstance(data, list):
+            logging.error("unexpected schedule response for group %s: %s", group_id, type(data))
+            return None
+        return data
 
-    if redis_client and isinstance(data, list):
-        try:
-            redis_client.setex(cache_key, int(SCHEDULE_CACHE_TTL.total_seconds()),
-                               json.dumps(data, ensure_ascii=False))
-        except Exception as exc:
-            logging.warning("Failed to write schedule cache: %s", exc)
+    return await cache.get_or_fetch(cache_key, fetch_schedule, SCHEDULE_CACHE_TTL, SCHEDULE_STALE_TTL)
 
-    return data
 
+async def _fetch_reference(url: str, prefix: str, param: str, ids: list[int], context: str) -> Any | None:
+    joined_ids = ",".join(map(str, ids))
 
-def get_teachers(teacher_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
-    ids = _normalize_ids(teacher_ids)
-    if not ids:
-        return {}
+    async def fetch_reference() -> Any | None:
+        data = await request_json(url, params={param: joined_ids}, context=context)
+        if isinstance(data, list):
+            await cache.set_many(prefix, data, REFERENCE_CACHE_TTL, REFERENCE_STALE_TTL)
+        return data
 
-    found, missing = _cache_get_many(TEACHER_CACHE_PREFIX, ids)
+    return await cache.single_flight(f"{prefix}:{joined_ids}", fetch_reference)
 
-    if missing:
-        data = request_json(TEACHERS_URL, params={"teacher_ids": ",".join(map(str, missing))}, context="teachers")
-        if isinstance(data, list):
-            _cache_set_many(TEACHER_CACHE_PREFIX, data, REFERENCE_CACHE_TTL)
-            for item in data:
-                raw_id = item.get("id")
-                if raw_id is None:
-                    continue
-                try:
-                    found[int(raw_id)] = item
-                except (TypeError, ValueError):
-                    continue
 
-    return found
+def _compact_reference(prefix: str, item: dict[str, Any]) -> dict[str, Any]:
+    return {field: item[field] for field in REFERENCE_FIELDS[prefix] if item.get(field) is not None}
 
 
-def get_rooms(room_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
-    ids = _normalize_ids(room_ids)
-    if not ids:
-        return {}
+def _index_reference(prefix: str, items: Iterable[dict[str, Any]]) -> dict[int, dict[str, Any]]:
+    index = {}
+    for item in items:
+        item_id = _parse_int(item.get("id"))
+        if item_id is not None:
+            index[item_id] = _compact_reference(prefix, item)
+    return index
 
-    found, missing = _cache_get_many(ROOM_CACHE_PREFIX, ids)
 
-    if missing:
-        data = request_json(ROOMS_URL, params={"room_ids": ",".join(map(str, missing))}, context="rooms")
-        if isinstance(data, list):
-            _cache_set_many(ROOM_CACHE_PREFIX, data, REFERENCE_CACHE_TTL)
-            for item in data:
-                raw_id = item.get("id")
-                if raw_id is None:
-                    continue
-                try:
-                    found[int(raw_id)] = item
-                except (TypeError, ValueError):
-                    continue
+def load_reference_snapshot() -> bool:
+    try:
+        snapshot = json.loads(REFERENCE_SNAPSHOT_PATH.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as exc:
+        logging.warning("Failed to read reference snapshot: %s", exc)
+        return False
 
-    return found
+    for prefix in REFERENCE_FIELDS:
+        _reference_index[prefix] = _index_reference(prefix, snapshot.get(prefix) or [])
+    logging.info("loaded reference snapshot from %s", snapshot.get("saved_at"))
+    return True
+
+
+def _write_reference_snapshot(snapshot: dict[str, Any]) -> None:
+    REFERENCE_SNAPSHOT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = REFERENCE_SNAPSHOT_PATH.with_suffix(".tmp")
+    temp_path.write_text(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+    temp_path.replace(REFERENCE_SNAPSHOT_PATH)
 
 
-def get_buildings(building_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
-    ids = _normalize_ids(building_ids)
+async def refresh_reference_snapshot() -> bool:
+    teachers, rooms, buildings = await asyncio.gather(
+        request_json(TEACHERS_URL, context="teachers snapshot"),
+        request_json(ROOMS_URL, context="rooms snapshot"),
+        request_json(BUILDINGS_URL, context="buildings snapshot"),
+    )
+    datasets = {
+        TEACHER_CACHE_PREFIX: teachers,
+        ROOM_CACHE_PREFIX: rooms,
+        BUILDING_CACHE_PREFIX: buildings,
+    }
+    if not all(isinstance(items, list) and items for items in datasets.values()):
+        return False
+
+    snapshot: dict[str, Any] = {"saved_at": _now().isoformat()}
+    for prefix, items in datasets.items():
+        index = _index_reference(prefix, items)
+        # Keep ids learned incrementally that the bulk listing does not include.
+        _reference_index[prefix] = {**_reference_index[prefix], **index}
+        snapshot[prefix] = list(_reference_index[prefix].values())
+
+    try:
+        await asyncio.to_thread(_write_reference_snapshot, snapshot)
+    except OSError as exc:
+        logging.warning("Failed to write reference snapshot: %s", exc)
+    return True
+
+
+async def _get_reference(url: str, prefix: str, param: str, raw_ids: Iterable[int],
+                         context: str) -> dict[int, dict[str, Any]]:
+    ids = _normalize_ids(raw_ids)
     if not ids:
         return {}
 
-    found, missing = _cache_get_many(BUILDING_CACHE_PREFIX, ids)
+    local_index = _reference_index[prefix]
+    found = {item_id: local_index[item_id] for item_id in ids if item_id in local_index}
+    unknown_ids = [item_id for item_id in ids if item_id not in found]
+    if not unknown_ids:
+        return found
+
+    entries, missing = await cache.get_many(prefix, unknown_ids)
+    for item_id, entry in entries.items():
+        found[item_id] = entry.value
+        local_index[item_id] = _compact_reference(prefix, entry.value)
+
+    stale = [item_id for item_id, entry in entries.items() if not entry.fresh]
+    if stale:
+        # Stale reference data is still good enough to render, refresh it behind the response.
+        joined_ids = ",".join(map(str, stale))
+        cache.start_flight(f"{prefix}:refresh:{joined_ids}",
+                           lambda: _fetch_reference(url, prefix, param, stale, context=context))
 
     if missing:
-        data = request_json(BUILDINGS_URL, params={"building_ids": ",".join(map(str, missing))}, context="buildings")
+        data = await _fetch_reference(url, prefix, param, missing, context=context)
         if isinstance(data, list):
-            _cache_set_many(BUILDING_CACHE_PREFIX, data, REFERENCE_CACHE_TTL)
             for item in data:
-                raw_id = item.get("id")
-                if raw_id is None:
-                    continue
-                try:
-                    found[int(raw_id)] = item
-                except (TypeError, ValueError):
+                item_id = _parse_int(item.get("id"))
+                if item_id is None:
                     continue
+                found[item_id] = item
+                local_index[item_id] = _compact_reference(prefix, item)
 
     return found
+
+
+def _week_starts(start_date: datetime.date, end_date: datetime.date) -> list[datetime.date]:
+    week_start = start_date - datetime.timedelta(days=start_date.weekday())
+    week_starts = []
+    while week_start <= end_date:
+        week_starts.append(week_start)
+        week_start += datetime.timedelta(days=7)
+    return week_starts
+
+
+def _item_date(item: dict[str, Any]) -> datetime.date | None:
+    value = item.get("start_time")
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.replace("Z", "+00:00")).date()
+    except (TypeError, ValueError):
+        return None
+
+
+async def get_schedule_range(group_id: int, start_date: datetime.date, end_date: datetime.date,
+                             sub_group_id: int | None = None) -> cache.CacheEntry | None:
+    # Always fetch whole ISO weeks, so every range of a group is served from one cache entry per week.
+    week_starts = _week_starts(start_date, end_date)
+    entries = await asyncio.gather(*(
+        get_schedule(group_id, week_start, week_start + datetime.timedelta(days=6), sub_group_id=sub_group_id)
+        for week_start in week_starts
+    ))
+    if any(entry is None for entry in entries):
+        return None
+
+    items: list[dict[str, Any]] = []
+    for entry in entries:
+        for item in entry.value:
+            item_date = _item_date(item)
+            if item_date is not None and start_date <= item_date <= end_date:
+                items.append(item)
+
+    stale_fetched_at = [entry.fetched_at for entry in entries if not entry.fresh and entry.fetched_at]
+    if stale_fetched_at:
+        return cache.CacheEntry(items, min(stale_fetched_at), False)
+    return cache.CacheEntry(items, None, True)
+
+
+async def get_teachers(teacher_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+    return await _get_reference(TEACHERS_URL, TEACHER_CACHE_PREFIX, "teacher_ids", teacher_ids, context="teachers")
+
+
+async def get_rooms(room_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+    return await _get_reference(ROOMS_URL, ROOM_CACHE_PREFIX, "room_ids", room_ids, context="rooms")
+
+
+async def get_buildings(building_ids: Iterable[int]) -> dict[int, dict[str, Any]]:
+    return await _get_reference(BUILDINGS_URL, BUILDING_CACHE_PREFIX, "building_ids", building_ids,
+                                context="buildings")
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+from functools import partial
+from typing import Any, Dict, List, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from data.config import SCHEDULE_WATCH_MINUTES
+from scripts import keyboards, sender
+from scripts.bot import bot, db, mailings
+from scripts.mailing_store import DeliveryJournal, METRICS_SCHEDULE_CHANGES
+from scripts.message_handlers import TELEGRAM_MESSAGE_MAX_LEN, prune_unreachable_users
+from scripts.parse import parse_date_schedule
+from scripts.timezone import tz_today
+from scripts.utils import today_for_group
+
+SCHEDULE_WATCH_WEEKS = 2
+SCHEDULE_WATCH_CONCURRENCY = 4
+# Only fields that come from the schedule itself are hashed. Teacher and room names come from reference lookups,
+# and a failed lookup or a renamed room must not look like a schedule change.
+LESSON_FIELDS = ("time", "name", "type", "mod", "class_url", "teacher_id", "room_id")
+LESSON_DISPLAY_FIELDS = ("teacher", "room")
+SNAPSHOT_VERSION = 2
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha1(json.dumps(value, ensure_ascii=False, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _lesson_content(lesson: dict[str, Any]) -> dict[str, Any]:
+    return {field: lesson.get(field) if lesson.get(field) is not None else "" for field in LESSON_FIELDS}
+
+
+def _lookups_complete(schedule: dict[str, list[dict[str, Any]]]) -> bool:
+    return all((lesson["teacher"] or lesson.get("teacher_id") is None) and
+               (lesson["room"] or lesson.get("room_id") is None)
+               for day_lessons in schedule.values() for lesson in day_lessons)
+
+
+def _day_date(day_label: str) -> date:
+    return datetime.strptime(day_label.split(",")[0], "%d.%m.%Y").date()
+
+
+def build_snapshot(schedule: dict[str, list[dict[str, str]]]) -> dict[str, Any]:
+    lessons = {}
+    days = {}
+    for day_label, day_lessons in schedule.items():
+        hashes = []
+        for lesson in day_lessons:
+            content = _lesson_content(lesson)
+            lesson_hash = _digest(content)
+            lessons[lesson_hash] = {**content, **{field: lesson.get(field) or "" for field in LESSON_DISPLAY_FIELDS}}
+            hashes.append(lesson_hash)
+        days[day_label] = sorted(hashes)
+    return {"version": SNAPSHOT_VERSION, "digest": _digest(days), "days": days, "lessons": lessons}
+
+
+def diff_snapshots(previous: dict[str, Any], current: dict[str, Any],
+                   since: date) -> List[Tuple[str, List[dict], List[dict]]]:
+    changes = []
+    for day_label in sorted(set(previous["days"]) | set(current["days"]), key=_day_date):
+        if _day_date(day_label) < since:
+            continue
+        old_hashes = Counter(previous["days"].get(day_label, []))
+        new_hashes = Counter(current["days"].get(day_label, []))
+        removed = [previous["lessons"][lesson_hash] for lesson_hash in (old_hashes - new_hashes).elements()]
+        added = [current["lessons"][lesson_hash] for lesson_hash in (new_hashes - old_hashes).elements()]
+        if removed or added:
+            changes.append((day_label, removed, added))
+    return changes
+
+
+def _format_lesson(lesson: dict[str, Any]) -> str:
+    text = f"{lesson['time']} {lesson['name']}"
+    if lesson["type"]:
+        text += f" [{lesson['type'].lower()}]"
+    if lesson["room"]:
+        text += f", {lesson['room']}"
+    if lesson["teacher"]:
+        text += f", {lesson['teacher']}"
+    if lesson["mod"]:
+        text += f" <i>{lesson['mod']}</i>"
+    if lesson["class_url"]:
+        text += f" <a href=\"{lesson['class_url']}\">🔗 (курс)</a>"
+    return text
+
+
+def format_changes(changes: List[Tuple[str, List[dict], List[dict]]]) -> str:
+    lines = ["🔔 <b>Расписание изменилось</b>"]
+    for index, (day_label, removed, added) in enumerate(changes):
+        day_lines = [f"\n🗓{day_label}"]
+        day_lines += [f"➖ <s>{_format_lesson(lesson)}</s>" for lesson in removed]
+        day_lines += [f"➕ {_format_lesson(lesson)}" for lesson in added]
+        if len("\n".join(lines + day_lines)) > TELEGRAM_MESSAGE_MAX_LEN - 100:
+            lines.append(f"\n<i>...и еще изменения в {len(changes) - index} дн. Полное расписание - на сайте.</i>")
+            break
+        lines += day_lines
+    return "\n".join(lines)
+
+
+async def check_group_changes(group_id: int, sub_group: int):
+    today = await today_for_group(group_id)
+    first_week = today - timedelta(days=today.weekday())
+
+    changes = []
+    url = None
+    for week in range(SCHEDULE_WATCH_WEEKS):
+        week_start = first_week + timedelta(weeks=week)
+        schedule, url, stale_since = await parse_date_schedule(
+            group=group_id, sub_group=sub_group, date_1=week_start, date_2=week_start + timedelta(days=6))
+        # A failed or stale fetch says nothing about changes, keep the previous snapshot.
+        if schedule is None or stale_since:
+            continue
+
+        snapshot = build_snapshot(schedule)
+        previous = await mailings.get_schedule_snapshot(group_id, sub_group, week_start)
+        # A snapshot of another format hashed other fields, it can only be replaced as a baseline.
+        if previous and previous.get("version") != SNAPSHOT_VERSION:
+            previous = None
+        if previous and previous["digest"] == snapshot["digest"]:
+            continue
+        # The saved names are shown in the next diff, so wait until every teacher and room is resolved.
+        if not _lookups_complete(schedule):
+            continue
+        await mailings.save_schedule_snapshot(group_id, sub_group, week_start, snapshot)
+        if previous:
+            changes += diff_snapshots(previous, snapshot, today)
+    return changes, url
+
+
+async def notify_schedule_change(user_id: int, text: str, reply_markup: InlineKeyboardMarkup,
+                                 limiter: sender.RateLimiter | None = None):
+    if limiter:
+        await limiter.acquire(user_id)
+    await bot.send_message(user_id, text, reply_markup=reply_markup)
+
+
+async def run_schedule_watch():
+    started_at = time.monotonic()
+    # Only the groups are kept, subscribers are read again page by page when notifications go out.
+    group_keys = set()
+    async for subscribers in db.iter_mailing_subscribers():
+        group_keys.update((group_id, sub_group) for _, group_id, sub_group, _ in subscribers)
+    groups = sorted(group_keys)
+    semaphore = asyncio.Semaphore(SCHEDULE_WATCH_CONCURRENCY)
+
+    async def check_group(group_id: int, sub_group: int):
+        async with semaphore:
+            try:
+                return await check_group_changes(group_id, sub_group)
+            except Exception:
+                logging.exception(f"failed to check schedule changes for group {group_id}")
+                return [], None
+
+    results = await asyncio.gather(*(check_group(*key) for key in groups))
+    changed: Dict[Tuple[int, int], Tuple[str, InlineKeyboardMarkup]] = {}
+    for key, (changes, url) in zip(groups, results):
+        if changes:
+            reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text='Проверить на сайте', url=f"{url}")],
+                [keyboards.inline_bt_unsub],
+            ])
+            changed[key] = (format_changes(changes), reply_markup)
+
+    today = tz_today()
+    await mailings.delete_schedule_snapshots_before(today - timedelta(days=today.weekday(), weeks=1))
+
+    fetch_seconds = time.monotonic() - started_at
+    logging.info(f"schedule watch: {len(changed)} of {len(groups)} groups changed in {fetch_seconds:.1f}s")
+    if not changed:
+        return
+
+    async def deliveries():
+        async for subscribers in db.iter_mailing_subscribers():
+            for user_id, group_id, sub_group, _ in subscribers:
+                if (group_id, sub_group) in changed:
+                    text, reply_markup = changed[group_id, sub_group]
+                    yield user_id, partial(notify_schedule_change, user_id, text, reply_markup)
+
+    journal = DeliveryJournal(mailings)
+    try:
+        report = await sender.send_all(deliveries(), journal.record_error, on_result=journal)
+    finally:
+        await prune_unreachable_users(journal)
+    report.fetch_seconds = fetch_seconds
+    logging.info(f"schedule change notifications: {report.summary()}")
+    await mailings.save_run_metrics(METRICS_SCHEDULE_CHANGES, f"{report.started_at_utc:%Y-%m-%dT%H:%M:%S}Z/changes",
+                              report, {"groups_checked": len(groups), "groups_changed": len(changed)})
+
+
+async def watch_schedule_changes():
+    if not SCHEDULE_WATCH_MINUTES:
+        return
+    # Snapshots survive restarts, so there is no need to hit the API right at startup.
+    while True:
+        await asyncio.sleep(SCHEDULE_WATCH_MINUTES * 60)
+        try:
+            await run_schedule_watch()
+        except Exception:
+            logging.exception("schedule watch failed")
@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterable, Awaitable, Callable, Tuple
+
+from aiogram import exceptions
+
+from data.config import MAILING_RATE_LIMIT, MAILING_CONCURRENCY
+
+# Telegram allows about one message per second to the same private chat.
+PER_CHAT_INTERVAL = 1.0
+MAX_DELIVERY_ATTEMPTS = 3
+_CHAT_SLOTS_PRUNE_SIZE = 10000
+
+
+class RateLimiter:
+    def __init__(self, rate: float = MAILING_RATE_LIMIT, per_chat_interval: float = PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.per_chat_interval = per_chat_interval
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.chat_slots: dict[int, float] = {}
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def _prune_chat_slots(self, now: float) -> None:
+        if len(self.chat_slots) > _CHAT_SLOTS_PRUNE_SIZE:
+            self.chat_slots = {chat_id: slot for chat_id, slot in self.chat_slots.items() if slot > now}
+
+    async def acquire(self, chat_id: int) -> None:
+        while True:
+            now = time.monotonic()
+            wait = max(self.paused_until, self.chat_slots.get(chat_id, 0.0)) - now
+            if wait <= 0:
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.chat_slots[chat_id] = now + self.per_chat_interval
+                    self._prune_chat_slots(now)
+                    return
+                wait = (1 - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        # A flood-wait from Telegram applies to the whole bot, so every sender waits it out together.
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated_at = self.paused_until
+
+
+class DeliveryStopped(Exception):
+    pass
+
+
+class RunLimiter:
+    # Wraps the shared limiter for one run: measures time spent waiting for tokens and checks the stop flag
+    # right before every API call, so deliveries already waiting for a token stop too.
+    def __init__(self, limiter: RateLimiter, report: "SendReport", should_stop: Callable[[], bool] | None = None):
+        self.limiter = limiter
+        self.report = report
+        self.should_stop = should_stop
+
+    async def acquire(self, chat_id: int) -> None:
+        if self.should_stop and self.should_stop():
+            raise DeliveryStopped
+        started = time.monotonic()
+        await self.limiter.acquire(chat_id)
+        self.report.throttle_seconds += time.monotonic() - started
+        if self.should_stop and self.should_stop():
+            raise DeliveryStopped
+
+    def pause(self, seconds: float) -> None:
+        self.limiter.pause(seconds)
+
+
+ERROR_FORBIDDEN = "forbidden"
+ERROR_NOT_FOUND = "not_found"
+ERROR_BAD_REQUEST = "bad_request"
+ERROR_TIMEOUT = "timeout"
+ERROR_RENDER = "render"
+ERROR_OTHER = "other"
+
+
+def classify_error(e: Exception) -> str:
+    if isinstance(e, exceptions.TelegramForbiddenError):
+        return ERROR_FORBIDDEN
+    if isinstance(e, exceptions.TelegramNotFound):
+        return ERROR_NOT_FOUND
+    if isinstance(e, exceptions.TelegramBadRequest):
+        # Telegram reports deleted and never started chats as a plain 400.
+        if "chat not found" in e.message.lower():
+            return ERROR_NOT_FOUND
+        return ERROR_BAD_REQUEST
+    if isinstance(e, asyncio.TimeoutError):
+        return ERROR_TIMEOUT
+    return ERROR_OTHER
+
+
+class SendReport:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.started_at_utc = datetime.now(timezone.utc)
+        self.finished_at: float | None = None
+        self.delivered = 0
+        self.failed = 0
+        self.retry_after_total = 0.0
+        self.retry_after_count = 0
+        self.errors: Counter = Counter()
+        # Wall time summed over deliveries; throttle_seconds is the part spent waiting for the rate limiter.
+        self.send_seconds = 0.0
+        self.throttle_seconds = 0.0
+        self.fetch_seconds = 0.0
+
+    @property
+    def api_seconds(self) -> float:
+        return max(0.0, self.send_seconds - self.throttle_seconds)
+
+    @property
+    def duration(self) -> float:
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        return self.delivered / self.duration if self.duration > 0 else 0.0
+
+    def finish(self) -> None:
+        self.finished_at = time.monotonic()
+
+    def summary(self) -> str:
+        errors = ", ".join(f"{kind} {count}" for kind, count in self.errors.items()) or "none"
+        return (f"delivered {self.delivered}, failed {self.failed} in {self.duration:.1f}s "
+                f"({self.throughput:.2f} msg/s), fetch {self.fetch_seconds:.1f}s, "
+                f"telegram {self.api_seconds:.1f}s, throttled {self.throttle_seconds:.1f}s, "
+                f"retry-after {self.retry_after_count}x/{self.retry_after_total:.0f}s, errors: {errors}")
+
+
+# Telegram limits are per bot, so mailings and admin broadcasts share one bucket.
+bot_limiter = RateLimiter()
+
+Delivery = Callable[[RateLimiter], Awaitable]
+ErrorHandler = Callable[[int, exceptions.TelegramAPIError], Awaitable]
+ResultHandler = Callable[[int, bool], None]
+
+
+async def deliver_with_retry(limiter: RateLimiter, user_id: int, deliver: Delivery,
+                             on_error: ErrorHandler, report: SendReport) -> bool:
+    for _ in range(MAX_DELIVERY_ATTEMPTS):
+        started = time.monotonic()
+        try:
+            await deliver(limiter)
+        except exceptions.TelegramRetryAfter as e:
+            logging.error(f"target id:{user_id} - flood limit, pause sending for {e.retry_after} seconds")
+            report.retry_after_total += e.retry_after
+            report.retry_after_count += 1
+            limiter.pause(e.retry_after)
+            continue
+        except exceptions.TelegramAPIError as e:
+            await on_error(user_id, e)
+            report.errors[classify_error(e)] += 1
+            report.failed += 1
+            return False
+        except asyncio.TimeoutError as e:
+            logging.error(f"Timeout error occurred while sending to user {user_id}")
+            report.errors[classify_error(e)] += 1
+            report.failed += 1
+            return False
+        finally:
+            report.send_seconds += time.monotonic() - started
+        logging.info(f"target id:{user_id}: success")
+        report.delivered += 1
+        return True
+
+    report.errors[ERROR_OTHER] += 1
+    report.failed += 1
+    return False
+
+
+async def send_all(deliveries: AsyncIterable[Tuple[int, Delivery]], on_error: ErrorHandler,
+                   limiter: RateLimiter | None = None, concurrency: int = MAILING_CONCURRENCY,
+                   on_result: ResultHandler | None = None,
+                   should_stop: Callable[[], bool] | None = None) -> SendReport:
+    report = SendReport()
+    limiter = RunLimiter(limiter or bot_limiter, report, should_stop)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while (item := await queue.get()) is not None:
+            user_id, deliver = item
+            delivered = False
+            try:
+                delivered = await deliver_with_retry(limiter, user_id, deliver, on_error, report)
+            except DeliveryStopped:
+                continue
+            except Exception:
+                logging.exception(f"target id:{user_id} - failed")
+                report.failed += 1
+            if on_result:
+                on_result(user_id, delivered)
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for item in deliveries:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+        report.finish()
+    return report
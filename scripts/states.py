@@ -11,14 +11,14 @@ class UserData(StatesGroup):
 class Broadcast(StatesGroup):
     Message = State()
     MessageType = State()
+    Target = State()
+    Faculty = State()
+    Group = State()
 
 class Mailing(StatesGroup):
     Subscribe = State()
     Unsubscribe = State()
     
-class BroadcastAbort(StatesGroup):
-    Abort = State()
-
 class StarsRefund(StatesGroup):
     Refund = State()
     Confirm = State()
\ No newline at end of file
@@ -0,0 +1,264 @@
+import bisect
+from typing import AsyncIterator, Iterable, List, Protocol, Tuple
+
+from redis.asyncio import Redis
+
+from scripts.database import AsyncDatabase, SUBSCRIBERS_PAGE_SIZE
+
+# (user_id, group_id, sub_group, mailing)
+UserRow = Tuple[int, int, int, str | None]
+
+REDIS_KEY_PREFIX = "users"
+REDIS_BATCH_SIZE = 500
+MIGRATION_BATCH_SIZE = 1000
+
+
+class UserStorage(Protocol):
+    async def add_user(self, user_id: int, group_id: int, sub_group: int): ...
+
+    async def get_user(self, user_id: int) -> Tuple[int, int] | None: ...
+
+    async def set_mailing_time(self, user_id: int, mailing_time: str): ...
+
+    async def del_mailing_time(self, user_id: int): ...
+
+    async def get_mailing_time(self, user_id: int) -> str | None: ...
+
+    def iter_mailing_subscribers(self, page_size: int = SUBSCRIBERS_PAGE_SIZE) -> AsyncIterator[List[UserRow]]:
+        # Pages of subscribers ordered by (group_id, sub_group, mailing, user_id).
+        ...
+
+    async def get_users_by_groups(self, group_ids: Iterable[int]) -> List[UserRow]: ...
+
+    async def get_users_page(self, after_user_id: int | None, limit: int) -> List[UserRow]: ...
+
+    async def import_users(self, users: Iterable[UserRow]): ...
+
+    async def del_user(self, user_id: int): ...
+
+    async def del_users(self, user_ids: Iterable[int]): ...
+
+    async def count_users(self) -> int: ...
+
+    async def close(self): ...
+
+
+class MemoryUserStorage:
+    def __init__(self):
+        self.users: dict[int, list] = {}
+        # Kept sorted for get_users_page.
+        self.user_ids: list[int] = []
+
+    async def add_user(self, user_id, group_id, sub_group):
+        if user_id in self.users:
+            self.users[user_id][:2] = [group_id, sub_group]
+            return
+        self.users[user_id] = [group_id, sub_group, None]
+        bisect.insort(self.user_ids, user_id)
+
+    async def get_user(self, user_id):
+        user = self.users.get(user_id)
+        return (user[0], user[1]) if user else None
+
+    async def set_mailing_time(self, user_id, mailing_time):
+        if user_id in self.users:
+            self.users[user_id][2] = mailing_time
+
+    async def del_mailing_time(self, user_id):
+        if user_id in self.users:
+            self.users[user_id][2] = None
+
+    async def get_mailing_time(self, user_id):
+        user = self.users.get(user_id)
+        return user[2] if user else None
+
+    async def iter_mailing_subscribers(self, page_size=SUBSCRIBERS_PAGE_SIZE):
+        subscribers = sorted(((user_id, *user) for user_id, user in self.users.items() if user[2] is not None),
+                             key=lambda row: (row[1], row[2], row[3], row[0]))
+        for start in range(0, len(subscribers), page_size):
+            yield subscribers[start:start + page_size]
+
+    async def get_users_by_groups(self, group_ids):
+        group_ids = set(group_ids)
+        return [(user_id, *user) for user_id, user in self.users.items() if user[0] in group_ids]
+
+    async def get_users_page(self, after_user_id, limit):
+        start = 0 if after_user_id is None else bisect.bisect_right(self.user_ids, after_user_id)
+        return [(user_id, *self.users[user_id]) for user_id in self.user_ids[start:start + limit]]
+
+    async def import_users(self, users):
+        for user_id, group_id, sub_group, mailing in users:
+            await self.add_user(user_id, group_id, sub_group)
+            self.users[user_id][2] = mailing
+
+    async def del_user(self, user_id):
+        if self.users.pop(user_id, None) is not None:
+            del self.user_ids[bisect.bisect_left(self.user_ids, user_id)]
+
+    async def del_users(self, user_ids):
+        for user_id in user_ids:
+            await self.del_user(user_id)
+
+    async def count_users(self):
+        return len(self.users)
+
+    async def close(self):
+        pass
+
+
+class RedisUserStorage:
+    # Every user is a hash; a sorted set of ids, a set per group and a set of subscribers serve as indexes. Writes
+    # that move a user between index sets run as WATCH/MULTI transactions on the user's hash.
+    def __init__(self, url: str, prefix: str = REDIS_KEY_PREFIX):
+        self.redis = Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.ids_key = f"{prefix}:ids"
+        self.mailing_key = f"{prefix}:mailing"
+
+    def _user_key(self, user_id: int) -> str:
+        return f"{self.prefix}:{user_id}"
+
+    def _group_key(self, group_id) -> str:
+        return f"{self.prefix}:group:{group_id}"
+
+    async def _get_rows(self, user_ids) -> List[UserRow]:
+        rows = []
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), REDIS_BATCH_SIZE):
+            chunk = [int(user_id) for user_id in user_ids[start:start + REDIS_BATCH_SIZE]]
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for user_id in chunk:
+                    pipe.hmget(self._user_key(user_id), "group_id", "sub_group", "mailing")
+                values = await pipe.execute()
+            rows += [(user_id, int(group_id), int(sub_group), mailing or None)
+                     for user_id, (group_id, sub_group, mailing) in zip(chunk, values) if group_id is not None]
+        return rows
+
+    async def add_user(self, user_id, group_id, sub_group):
+        user_key = self._user_key(user_id)
+
+        async def update(pipe):
+            old_group_id = await pipe.hget(user_key, "group_id")
+            pipe.multi()
+            if old_group_id is not None and int(old_group_id) != group_id:
+                pipe.srem(self._group_key(old_group_id), user_id)
+            pipe.hset(user_key, mapping={"group_id": group_id, "sub_group": sub_group})
+            pipe.zadd(self.ids_key, {user_id: user_id})
+            pipe.sadd(self._group_key(group_id), user_id)
+
+        await self.redis.transaction(update, user_key)
+
+    async def get_user(self, user_id):
+        group_id, sub_group = await self.redis.hmget(self._user_key(user_id), "group_id", "sub_group")
+        return (int(group_id), int(sub_group)) if group_id is not None else None
+
+    async def set_mailing_time(self, user_id, mailing_time):
+        user_key = self._user_key(user_id)
+
+        async def update(pipe):
+            exists = await pipe.exists(user_key)
+            pipe.multi()
+            if exists:
+                pipe.hset(user_key, "mailing", mailing_time)
+                pipe.sadd(self.mailing_key, user_id)
+
+        await self.redis.transaction(update, user_key)
+
+    async def del_mailing_time(self, user_id):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._user_key(user_id), "mailing")
+            pipe.srem(self.mailing_key, user_id)
+            await pipe.execute()
+
+    async def get_mailing_time(self, user_id):
+        return await self.redis.hget(self._user_key(user_id), "mailing")
+
+    async def iter_mailing_subscribers(self, page_size=SUBSCRIBERS_PAGE_SIZE):
+        # Goes group by group, so only the subscribers of one group are held at a time.
+        group_ids = sorted([int(key.rsplit(":", 1)[1])
+                            async for key in self.redis.scan_iter(match=self._group_key("*"), count=1000)])
+        page = []
+        for group_id in group_ids:
+            user_ids = await self.redis.sinter([self._group_key(group_id), self.mailing_key])
+            page += sorted(await self._get_rows(user_ids), key=lambda row: (row[2], row[3], row[0]))
+            while len(page) >= page_size:
+                yield page[:page_size]
+                page = page[page_size:]
+        if page:
+            yield page
+
+    async def get_users_by_groups(self, group_ids):
+        group_keys = [self._group_key(group_id) for group_id in group_ids]
+        if not group_keys:
+            return []
+        return await self._get_rows(await self.redis.sunion(group_keys))
+
+    async def get_users_page(self, after_user_id, limit):
+        user_ids = await self.redis.zrangebyscore(
+            self.ids_key, "-inf" if after_user_id is None else f"({after_user_id}", "+inf", start=0, num=limit)
+        return await self._get_rows(user_ids)
+
+    async def import_users(self, users):
+        # Two round trips per batch instead of a transaction per user. It is meant for migrations, while nothing
+        # else writes to the same users.
+        users = list(users)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for user_id, *_ in users:
+                pipe.hget(self._user_key(user_id), "group_id")
+            old_group_ids = await pipe.execute()
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for (user_id, group_id, sub_group, mailing), old_group_id in zip(users, old_group_ids):
+                user_key = self._user_key(user_id)
+                if old_group_id is not None and int(old_group_id) != group_id:
+                    pipe.srem(self._group_key(old_group_id), user_id)
+                pipe.hset(user_key, mapping={"group_id": group_id, "sub_group": sub_group})
+                if mailing:
+                    pipe.hset(user_key, "mailing", mailing)
+                    pipe.sadd(self.mailing_key, user_id)
+                else:
+                    pipe.hdel(user_key, "mailing")
+                    pipe.srem(self.mailing_key, user_id)
+                pipe.zadd(self.ids_key, {user_id: user_id})
+                pipe.sadd(self._group_key(group_id), user_id)
+            await pipe.execute()
+
+    async def del_user(self, user_id):
+        user_key = self._user_key(user_id)
+
+        async def delete(pipe):
+            group_id = await pipe.hget(user_key, "group_id")
+            pipe.multi()
+            if group_id is not None:
+                pipe.srem(self._group_key(group_id), user_id)
+            pipe.delete(user_key)
+            pipe.zrem(self.ids_key, user_id)
+            pipe.srem(self.mailing_key, user_id)
+
+        await self.redis.transaction(delete, user_key)
+
+    async def del_users(self, user_ids):
+        for user_id in user_ids:
+            await self.del_user(user_id)
+
+    async def count_users(self):
+        return await self.redis.zcard(self.ids_key)
+
+    async def close(self):
+        await self.redis.aclose()
+
+
+def open_user_storage(url: str) -> UserStorage:
+    if url.startswith("sqlite://"):
+        return AsyncDatabase(url.removeprefix("sqlite://"))
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisUserStorage(url)
+    if url == "memory://":
+        return MemoryUserStorage()
+    raise ValueError(f"unsupported user storage url: {url}")
+
+
+async def iter_users(storage: UserStorage, batch_size: int = MIGRATION_BATCH_SIZE) -> AsyncIterator[List[UserRow]]:
+    after_user_id = None
+    while users := await storage.get_users_page(after_user_id, batch_size):
+        yield users
+        after_user_id = users[-1][0]
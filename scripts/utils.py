@@ -9,7 +9,7 @@ from data.config import ADMIN_TELEGRAM_ID
 from scripts import keyboards
 from scripts.bot import db, dp, bot
 from scripts import schedule_api
-from scripts.timezone import tz_now, tzinfo_for_faculty
+from scripts.timezone import tz_now
 
 day_pattern = r"(\b((0[1-9])|([1-2]\d)|(3[0-1])|([1-9])))"
 month_pattern = r"(\.((0[1-9])|(1[0-2])|([1-9]))\b)"
@@ -26,14 +26,23 @@ class NumCallback(CallbackData, prefix="data"):
     num: int
 
 
+class MailingTimeCallback(CallbackData, prefix="mailing"):
+    slot: int
+
+
+# Local time of the group's faculty. Morning mailings carry today's schedule, the rest carry tomorrow's.
+MAILING_TIMES = ('07:00', '08:00', '18:00', '20:00', '21:00')
+MAILING_DEFAULT_TIME = '18:00'
+MAILING_TOMORROW_FROM = time(12, 0)
+
+
 async def open_groups_file():
-    groups = schedule_api.get_groups_tree()
+    groups = await schedule_api.get_groups_tree()
     return groups or {}
 
 
-def today_for_group(group_id: int) -> date:
-    faculty_id = schedule_api.get_group_faculty_id(group_id)
-    group_tz = tzinfo_for_faculty(faculty_id)
+async def today_for_group(group_id: int) -> date:
+    group_tz = await schedule_api.get_group_timezone(group_id)
     return datetime.now(tz=group_tz).date()
 
 
@@ -57,32 +66,11 @@ def _resolve_sub_group_name(sub_groups, sub_group_id):
     return str(sub_group_id)
 
 
-def find_group_info(groups, group_id, sub_group_id=None):
-    try:
-        target_id = int(group_id)
-    except (TypeError, ValueError):
+async def find_group_info(group_id, sub_group_id=None):
+    group_meta = await schedule_api.get_group_meta(group_id)
+    if not group_meta:
         return None, None
-
-    for key, value in groups.items():
-        if isinstance(value, dict):
-            if "id" in value:
-                try:
-                    if int(value.get("id")) == target_id:
-                        sub_groups = value.get("sub_groups") or []
-                        return key, _resolve_sub_group_name(sub_groups, sub_group_id)
-                except (TypeError, ValueError):
-                    continue
-            group_name, sub_group_name = find_group_info(value, target_id, sub_group_id)
-            if group_name:
-                return group_name, sub_group_name
-        elif isinstance(value, (int, str)):
-            try:
-                if int(value) == target_id:
-                    return key, None
-            except (TypeError, ValueError):
-                continue
-
-    return None, None
+    return group_meta.name, _resolve_sub_group_name(group_meta.sub_groups, sub_group_id)
 
 
 async def generate_kb_nums(source):
@@ -98,6 +86,28 @@ async def generate_kb_nums(source):
     return msg_text, builder.as_markup()
 
 
+def mailing_period(mailing_time: str) -> str:
+    return "today" if time.fromisoformat(mailing_time) < MAILING_TOMORROW_FROM else "tomorrow"
+
+
+def next_local_occurrence(now: datetime, at: time, tzinfo) -> datetime:
+    local_now = now.astimezone(tzinfo)
+    target = datetime.combine(local_now.date(), at, tzinfo=tzinfo)
+    if target <= local_now:
+        target = datetime.combine(local_now.date() + timedelta(days=1), at, tzinfo=tzinfo)
+    return target
+
+
+async def generate_kb_mailing_times():
+    builder = InlineKeyboardBuilder()
+    for slot, mailing_time in enumerate(MAILING_TIMES):
+        period = "на сегодня" if mailing_period(mailing_time) == "today" else "на завтра"
+        builder.button(text=f'{mailing_time} ({period})', callback_data=MailingTimeCallback(slot=slot).pack())
+    builder.adjust(2)
+    builder.row(keyboards.inline_bt_cancel)
+    return builder.as_markup()
+
+
 async def generate_schedule_message(schedule):
     msg_text = ''
     for day in schedule:
@@ -168,41 +178,21 @@ async def generate_schedule_message(schedule):
     return msg_text
 
 
-def extract_group_numbers(data):
-    group_numbers = []
-
-    if isinstance(data, dict):
-        if "id" in data and isinstance(data["id"], (int, str)):
-            group_numbers.append(str(data["id"]))
-            return group_numbers
-        for value in data.values():
-            group_numbers.extend(extract_group_numbers(value))
-    elif isinstance(data, str):
-        try:
-            int(data)
-            group_numbers.append(data)
-        except ValueError:
-            pass
-    elif isinstance(data, int):
-        group_numbers.append(str(data))
-
-    return group_numbers
-
-
 async def validate_user(user_id: int):
-    user_data = db.get_user(user_id)
-
-    groups_dict = await open_groups_file()
-    groups_list = extract_group_numbers(groups_dict)
+    user_data = await db.get_user(user_id)
 
-    if not user_data or str(user_data[0]) not in groups_list:
-        await bot.send_message(user_id, f"Кажется, я не знаю, где ты учишься.\n"
-                                        f"Нажми на кнопку <b>{keyboards.bt_group_config.text}</b>, чтобы я мог вывести твое расписание.",
-                                  reply_markup=keyboards.kb_settings)
+    if not user_data or not await schedule_api.get_group_meta(user_data[0]):
+        await notify_unknown_group(user_id)
         return False
     return True
 
 
+async def notify_unknown_group(user_id: int):
+    await bot.send_message(user_id, f"Кажется, я не знаю, где ты учишься.\n"
+                                    f"Нажми на кнопку <b>{keyboards.bt_group_config.text}</b>, чтобы я мог вывести твое расписание.",
+                           reply_markup=keyboards.kb_settings)
+
+
 async def throttled(*args, **kwargs):
     msg = args[0]
     logging.info(f"throttled: {msg.from_user.id} (@{msg.from_user.username})")
@@ -0,0 +1,22 @@
+import asyncio
+
+import fakeredis
+import pytest
+
+from scripts import cache
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    # Every event loop gets its own client of one in-memory server, like separate processes sharing one Redis.
+    server = fakeredis.FakeServer()
+    clients = {}
+
+    async def get_redis():
+        loop = asyncio.get_running_loop()
+        if loop not in clients:
+            clients[loop] = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+        return clients[loop]
+
+    monkeypatch.setattr(cache, "get_redis", get_redis)
+    return server
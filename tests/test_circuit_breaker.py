@@ -0,0 +1,39 @@
+import asyncio
+
+from scripts import schedule_api
+from scripts.circuit_breaker import STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+
+def test_request_admitted_while_closed_does_not_free_the_trial(monkeypatch):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    monkeypatch.setattr(schedule_api, "_get_circuit_breaker", lambda url: breaker)
+    monkeypatch.setattr(schedule_api, "open_http_session", lambda: asyncio.sleep(0))
+    started = {}
+
+    async def request_once(session, url, params, context):
+        started[url].set()
+        await asyncio.sleep(3600)
+
+    monkeypatch.setattr(schedule_api, "_request_json_once", request_once)
+
+    async def main():
+        started.update(old=asyncio.Event(), trial=asyncio.Event())
+        old = asyncio.create_task(schedule_api.request_json("old"))
+        await started["old"].wait()
+        breaker.record_failure()
+        assert breaker.state == STATE_OPEN
+        trial = asyncio.create_task(schedule_api.request_json("trial"))
+        await started["trial"].wait()
+        assert breaker.state == STATE_HALF_OPEN
+
+        old.cancel()
+        await asyncio.gather(old, return_exceptions=True)
+        second_trial_allowed = breaker.allow_request()
+        trial.cancel()
+        await asyncio.gather(trial, return_exceptions=True)
+        return second_trial_allowed, breaker.trial_in_flight
+
+    second_trial_allowed, trial_in_flight = asyncio.run(main())
+
+    assert not second_trial_allowed
+    assert not trial_in_flight
@@ -0,0 +1,65 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from scripts import database
+from scripts.database import AsyncDatabase, Database
+from scripts.mailing_store import MailingStore
+
+
+def test_async_database_batches_concurrent_calls(tmp_path):
+    async def main():
+        database = AsyncDatabase(tmp_path / "users.db")
+        try:
+            await asyncio.gather(*(database.add_user(user_id, 100 + user_id % 3, 0) for user_id in range(300)))
+            # A failing call is rerun alone and does not fail the calls batched with it.
+            results = await asyncio.gather(database.get_user(1), database._call(Database.get_user),
+                                           database.get_user(2), return_exceptions=True)
+            return results, await database.count_users()
+        finally:
+            await database.close()
+
+    (first, failed, second), users_count = asyncio.run(main())
+
+    assert first == (101, 0)
+    assert isinstance(failed, TypeError)
+    assert second == (102, 0)
+    assert users_count == 300
+
+
+def test_async_database_rejects_calls_after_close(tmp_path):
+    async def main():
+        database = AsyncDatabase(tmp_path / "users.db")
+        await database.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            await database.get_user(1)
+
+    asyncio.run(main())
+
+
+def test_interrupted_migration_is_rolled_back(tmp_path, monkeypatch):
+    path = tmp_path / "users.db"
+    first, second, *_ = database.MIGRATIONS
+    monkeypatch.setattr(database, "MIGRATIONS", [first])
+    Database(path).import_users([(1, 101, 0, "07:00"), (2, 102, 1, None)])
+
+    # Migration 2 fails after users_new is created and filled.
+    monkeypatch.setattr(database, "MIGRATIONS", [first, second[:2] + ("INSERT INTO users_new (user_id) VALUES (1)",)])
+    with pytest.raises(sqlite3.IntegrityError):
+        Database(path)
+
+    monkeypatch.undo()
+    migrated = Database(path)
+    tables = migrated.connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+
+    assert ("users_new",) not in tables
+    assert migrated.get_schema_version() == len(database.MIGRATIONS)
+    assert migrated.get_users_page(None, 10) == [(1, 101, 0, "07:00"), (2, 102, 1, None)]
+
+
+def test_stores_create_their_directory(tmp_path):
+    Database(tmp_path / "storage" / "user_data.db").connection.close()
+    MailingStore(tmp_path / "storage" / "mailing" / "mailing.db").connection.close()
+
+    assert (tmp_path / "storage" / "mailing" / "mailing.db").exists()
@@ -0,0 +1,134 @@
+import asyncio
+import time
+from collections import Counter
+from functools import partial
+
+from scripts import cache, mailing_queue
+
+
+async def _recipients(users_count: int, groups_count: int = 4):
+    users = sorted(((user_id, 100 + user_id % groups_count, 0, "07:00") for user_id in range(1, users_count + 1)),
+                   key=lambda user: (user[1], user[0]))
+    for start in range(0, len(users), 40):
+        yield users[start:start + 40]
+
+
+async def _render(group_id, sub_group, message_type, slot=None):
+    return f"{message_type} {group_id}/{sub_group}"
+
+
+def _fast_polling(monkeypatch):
+    monkeypatch.setattr(mailing_queue, "COORDINATOR_POLL_INTERVAL", 0.05)
+    monkeypatch.setattr(mailing_queue, "CLAIM_TIMEOUT", 0.1)
+    monkeypatch.setattr(mailing_queue, "SharedRateLimiter", partial(mailing_queue.SharedRateLimiter, rate=1000))
+
+
+def test_workers_send_every_recipient_once(monkeypatch, redis_server):
+    _fast_polling(monkeypatch)
+    sent = []
+
+    async def deliver(user_id, rendered, limiter=None):
+        await limiter.acquire(user_id)
+        sent.append((time.time(), user_id))
+
+    async def main():
+        workers = [asyncio.create_task(mailing_queue.run_mailing_worker(_render, deliver)) for _ in range(3)]
+        try:
+            return await mailing_queue.distribute_run("r1", "today", _recipients(200))
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    results, report = asyncio.run(main())
+
+    assert sorted(user_id for _, user_id in sent) == list(range(1, 201))
+    assert results == {user_id: mailing_queue.RESULT_SENT for user_id in range(1, 201)}
+    assert report.delivered == 200
+
+
+def test_shared_rate_limit_holds_across_workers(redis_server):
+    limiters = [mailing_queue.SharedRateLimiter(rate=50) for _ in range(3)]
+    acquired = []
+
+    async def send(limiter, chat_ids):
+        for chat_id in chat_ids:
+            await limiter.acquire(chat_id)
+            acquired.append(time.time())
+
+    async def main():
+        await asyncio.gather(*(send(limiter, range(index * 100, index * 100 + 20))
+                               for index, limiter in enumerate(limiters)))
+
+    asyncio.run(main())
+
+    per_window = Counter(int(at / mailing_queue.RATE_WINDOW) for at in acquired)
+    assert len(acquired) == 60
+    assert max(per_window.values()) <= limiters[0].window_budget
+
+
+def test_item_of_a_dead_worker_is_requeued(monkeypatch, redis_server):
+    _fast_polling(monkeypatch)
+    monkeypatch.setattr(mailing_queue, "LEASE_TTL", 1)
+    sent = []
+    resent = []
+    stuck = asyncio.Event()
+
+    async def hanging_deliver(user_id, rendered, limiter=None):
+        if user_id == 25:
+            stuck.set()
+            await asyncio.sleep(3600)
+        sent.append(user_id)
+
+    async def deliver(user_id, rendered, limiter=None):
+        resent.append(user_id)
+
+    async def main():
+        dead = asyncio.create_task(mailing_queue.run_mailing_worker(_render, hanging_deliver))
+        run = asyncio.create_task(mailing_queue.distribute_run("r1", "today", _recipients(30, groups_count=1)))
+        await stuck.wait()
+        await asyncio.sleep(0.1)
+        dead.cancel()
+        alive = asyncio.create_task(mailing_queue.run_mailing_worker(_render, deliver))
+        try:
+            return await run
+        finally:
+            alive.cancel()
+
+    results, _ = asyncio.run(main())
+
+    assert sorted(set(sent) | set(resent)) == list(range(1, 31))
+    assert 25 in resent
+    # Results flushed before the crash are not sent again.
+    assert len(set(sent) & set(resent)) < mailing_queue.RESULT_FLUSH_SIZE
+    assert set(results.values()) == {mailing_queue.RESULT_SENT}
+
+
+def test_shared_rate_limiter_prunes_chat_slots(monkeypatch, redis_server):
+    monkeypatch.setattr(mailing_queue.sender, "_CHAT_SLOTS_PRUNE_SIZE", 10)
+    limiter = mailing_queue.SharedRateLimiter(rate=1000)
+    limiter.per_chat_interval = 0.01
+
+    async def main():
+        for chat_id in range(100):
+            await limiter.acquire(chat_id)
+            await asyncio.sleep(0.001)
+
+    asyncio.run(main())
+
+    assert len(limiter.chat_slots) <= 11
+
+
+def test_items_nobody_claims_are_taken_back(monkeypatch, redis_server):
+    _fast_polling(monkeypatch)
+    monkeypatch.setattr(mailing_queue, "UNCLAIMED_TIMEOUT", 0.3)
+
+    async def main():
+        results, report = await mailing_queue.distribute_run("r1", "today", _recipients(120))
+        redis_client = await cache.get_redis()
+        return results, report, await redis_client.llen(mailing_queue.QUEUE_KEY)
+
+    results, report, queued = asyncio.run(main())
+
+    assert results == {}
+    assert report.delivered == 0
+    assert queued == 0
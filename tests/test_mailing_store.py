@@ -0,0 +1,71 @@
+import asyncio
+from datetime import datetime, timezone
+
+from scripts.mailing_store import (BROADCAST_FAILED, RECIPIENT_PENDING, RECIPIENT_SENT, AsyncMailingStore,
+                                   broadcast_run_id)
+
+# Broadcast recipients without a mailing time next to subscribers, spanning page boundaries.
+RECIPIENTS = [(1, 100, 0, None), (2, 100, 0, None), (3, 100, 0, "18:00"), (4, 100, 0, None), (5, 101, 0, None),
+              (6, 101, 0, "18:00")]
+
+
+def test_pending_recipients_pages_include_null_mailings(tmp_path):
+    async def main():
+        mailings = AsyncMailingStore(tmp_path / "mailing.db")
+        try:
+            await mailings.create_run("r1", "broadcast", datetime.now(timezone.utc), RECIPIENTS)
+            return [page async for page in mailings.iter_pending_recipients("r1", page_size=2)]
+        finally:
+            await mailings.close()
+
+    pages = asyncio.run(main())
+
+    assert [len(page) for page in pages] == [2, 2, 2]
+    assert [recipient for page in pages for recipient in page] == [
+        (1, 100, 0, None), (2, 100, 0, None), (4, 100, 0, None), (3, 100, 0, "18:00"), (5, 101, 0, None),
+        (6, 101, 0, "18:00")]
+
+
+def test_pending_recipients_cursor_survives_marking(tmp_path):
+    async def main():
+        mailings = AsyncMailingStore(tmp_path / "mailing.db")
+        seen = []
+        try:
+            await mailings.create_run("r1", "broadcast", datetime.now(timezone.utc), RECIPIENTS)
+            async for page in mailings.iter_pending_recipients("r1", page_size=2):
+                seen += [user_id for user_id, *_ in page]
+                await mailings.mark_recipients("r1", [(user_id, RECIPIENT_SENT) for user_id, *_ in page])
+            return seen, await mailings.get_recipient_counts("r1")
+        finally:
+            await mailings.close()
+
+    seen, counts = asyncio.run(main())
+
+    assert sorted(seen) == [1, 2, 3, 4, 5, 6]
+    assert counts[RECIPIENT_SENT] == 6
+
+
+def test_broadcast_prepared_page_by_page(tmp_path):
+    async def main():
+        mailings = AsyncMailingStore(tmp_path / "mailing.db")
+        try:
+            job_id = await mailings.create_broadcast(1, 2, "copy", "all")
+            await mailings.add_broadcast_recipients(job_id, RECIPIENTS[:3])
+            unfinished_while_preparing = await mailings.get_unfinished_broadcasts()
+            await mailings.add_broadcast_recipients(job_id, RECIPIENTS[3:])
+            await mailings.start_broadcast(job_id)
+            interrupted_job_id = await mailings.create_broadcast(1, 3, "copy", "all")
+            await mailings.add_broadcast_recipients(interrupted_job_id, RECIPIENTS[:3])
+            await mailings.fail_unprepared_broadcasts()
+            return (unfinished_while_preparing, await mailings.get_unfinished_broadcasts(),
+                    await mailings.get_recipient_counts(broadcast_run_id(job_id)),
+                    (await mailings.get_broadcast(interrupted_job_id))["status"])
+        finally:
+            await mailings.close()
+
+    unfinished_while_preparing, unfinished, counts, interrupted_status = asyncio.run(main())
+
+    assert unfinished_while_preparing == []
+    assert unfinished == [1]
+    assert counts[RECIPIENT_PENDING] == 6
+    assert interrupted_status == BROADCAST_FAILED
@@ -0,0 +1,31 @@
+import asyncio
+
+from scripts import cache, schedule_api
+
+GROUPS_TREE = {"Факультет": {"очная": {"бакалавриат": {"1": {"Группа 1": {"id": 1, "faculty_id": 10}}}}}}
+
+
+def test_missing_generation_keeps_the_local_groups_tree(monkeypatch, redis_server):
+    monkeypatch.setattr(schedule_api, "GROUPS_GENERATION_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(cache, "is_available", lambda: True)
+    for name in ("_groups_index", "_groups_generation", "_groups_loaded_at", "_groups_checked_at"):
+        monkeypatch.setattr(schedule_api, name, getattr(schedule_api, name))
+    monkeypatch.setattr(schedule_api, "_groups_tree", None)
+    loads = []
+
+    async def load_cached_groups_tree():
+        loads.append(True)
+        return schedule_api._install_groups_tree(GROUPS_TREE, None)
+
+    monkeypatch.setattr(schedule_api, "_load_cached_groups_tree", load_cached_groups_tree)
+
+    async def main():
+        for _ in range(3):
+            await schedule_api.get_groups_tree()
+        # Another replica refreshed the tree.
+        await (await cache.get_redis()).incr(schedule_api.GROUPS_GENERATION_KEY)
+        await schedule_api.get_groups_tree()
+
+    asyncio.run(main())
+
+    assert len(loads) == 2
@@ -0,0 +1,78 @@
+import asyncio
+import random
+
+import fakeredis
+import pytest
+
+from scripts import migrate_users, user_storage
+
+
+@pytest.fixture
+def redis_url(monkeypatch, redis_server):
+    monkeypatch.setattr(user_storage.Redis, "from_url",
+                        lambda url, **kwargs: fakeredis.FakeAsyncRedis(server=redis_server, **kwargs))
+    return "redis://localhost:6379/0"
+
+
+async def _exercise(storage):
+    for user_id in range(1, 30):
+        await storage.add_user(user_id, 100 + user_id % 3, user_id % 2)
+    await storage.set_mailing_time(5, "07:00")
+    await storage.set_mailing_time(6, "18:00")
+    await storage.set_mailing_time(999, "07:00")
+    await storage.add_user(5, 200, 1)
+    await storage.del_mailing_time(6)
+    await storage.del_user(7)
+    await storage.del_users([8, 9, 1234])
+    await storage.set_mailing_time(10, "21:00")
+    return [
+        await storage.get_user(5),
+        await storage.get_user(7),
+        await storage.get_mailing_time(5),
+        await storage.get_mailing_time(6),
+        [page async for page in storage.iter_mailing_subscribers(page_size=1)],
+        [page async for page in user_storage.iter_users(storage, batch_size=4)],
+        sorted(await storage.get_users_by_groups([200, 101])),
+        await storage.count_users(),
+        await storage.get_users_page(None, 3),
+        await storage.get_users_page(10, 3),
+    ]
+
+
+def test_backends_behave_the_same(tmp_path, redis_url):
+    async def main():
+        results = []
+        for url in (f"sqlite://{tmp_path / 'users.db'}", "memory://", redis_url):
+            storage = user_storage.open_user_storage(url)
+            try:
+                results.append(await _exercise(storage))
+            finally:
+                await storage.close()
+        return results
+
+    sqlite_result, memory_result, redis_result = asyncio.run(main())
+
+    assert sqlite_result == memory_result == redis_result
+    assert sqlite_result[0] == (200, 1)
+
+
+def test_migration_round_trip(tmp_path, redis_url):
+    random.seed(1)
+    users = [(10 ** 9 + index, random.randrange(300), random.randrange(3), random.choice(["07:00", None, None]))
+             for index in range(2500)]
+    source_url = f"sqlite://{tmp_path / 'source.db'}"
+    target_url = f"sqlite://{tmp_path / 'target.db'}"
+
+    async def main():
+        source = user_storage.open_user_storage(source_url)
+        await source.import_users(users)
+        await source.close()
+        await migrate_users.migrate(source_url, redis_url, 1000)
+        await migrate_users.migrate(redis_url, target_url, 1000)
+        target = user_storage.open_user_storage(target_url)
+        try:
+            return [user async for users in user_storage.iter_users(target) for user in users]
+        finally:
+            await target.close()
+
+    assert sorted(asyncio.run(main())) == users